@@ -1,9 +1,21 @@
 from flask import Flask
 from flask_supabase import Supabase
 from settings import supabase_url, supabase_key
+from app.utils.write_behind import WriteBehindQueue
+from app.utils.reference_cache import ReferenceDataCache
 import os
 
 supabase_extension = Supabase()
+write_behind_queue = WriteBehindQueue(supabase_extension)
+# Small lookup tables (speech patterns, triggers, background) served from memory
+reference_data = ReferenceDataCache(
+    supabase_extension,
+    # Seconds between change probes, and between full fetches when nothing changed
+    refresh_interval=float(os.environ.get("REFERENCE_REFRESH_INTERVAL", "60")),
+    full_refresh_interval=float(
+        os.environ.get("REFERENCE_FULL_REFRESH_INTERVAL", "3600")
+    ),
+)
 
 
 def create_app():
@@ -13,6 +25,8 @@ def create_app():
     app.config["SUPABASE_KEY"] = supabase_key
 
     supabase_extension.init_app(app)
+    write_behind_queue.init_app(app)
+    reference_data.init_app(app)
 
     from .routes.index_routes import index_bp
     from .routes.chat_routes import chat_bp
@@ -1,23 +1,52 @@
 import os
 import json
-from datetime import datetime
-from flask import Blueprint, render_template, request, jsonify, session, current_app
-from app.utils.call_llm import deepseek_request
+import threading
+from datetime import datetime, timezone
+from flask import (
+    Blueprint,
+    Response,
+    render_template,
+    request,
+    jsonify,
+    session,
+    current_app,
+    stream_with_context,
+)
+from app.utils.call_llm import (
+    deepseek_request,
+    deepseek_request_stream,
+    get_prompt_cache_stats,
+    llm_router,
+)
 from app.utils.helpers import *
+from app.utils.session_cache import session_cache, parse_conversation_id
+from app.utils.response_cache import response_cache
+from app.utils.context_packer import context_packer
 from app.utils.agent_components import (
     EmotionalStateTracker,
     ConversationManager,
     AutoObserver,
     populate_initial_data,
     analyze_conversation_for_save,
-    # DISABLED: Embedding functionality commented out to avoid large model dependency
-    # generate_embedding,
+    generate_embedding,
+    memory_text,
     # populate_embeddings_for_existing_memories,
+    memory_cache,
+    conversation_cache,
+    retrieval_pipeline,
+    conversation_features,
+    get_embedding_cache_stats,
+    NEAR_DUPLICATE_BOOST,
+    TOP_TERMS_PER_MEMORY,
 )
-from app import supabase_extension
+from app import supabase_extension, write_behind_queue, reference_data
 
 chat_bp = Blueprint("chat", __name__)
 
+# Chat turns served by this worker, including ones the client abandoned mid-stream
+_turn_stats = {"completed": 0, "cancelled": 0}
+_turn_stats_lock = threading.Lock()
+
 
 @chat_bp.route("/analyze-conversation", methods=["POST"])
 def analyze_conversation():
@@ -77,13 +106,17 @@ def send():
         print("Received JSON:", data)
         user_message = data.get("message", "").strip()
         prompt = data.get("prompt", "").strip()
+        conversation_id = parse_conversation_id(data.get("conversation_id"))
 
         if not user_message:
             return jsonify({"error": "Message is required"}), 400
 
         # Call your language model with prompt and message
         print("generating reply...")
-        response_data = deepseek_request(user_message, prompt=prompt)
+        response_data = deepseek_request(
+            user_message, prompt=prompt, conversation_id=conversation_id
+        )
+        _record_turn(cancelled=False)
         print(response_data)
 
         # Extract reply and emotional state
@@ -91,46 +124,147 @@ def send():
         emotion = response_data.get("emotion", "neutral")
         intensity = response_data.get("intensity", 0.5)
 
-        # Store emotional state in database
-        try:
-            supabase_extension.client.table("emotional_states").insert(
-                {
-                    "emotion": emotion,
-                    "intensity": intensity,
-                    "trigger": f"User message: {user_message[:100]}...",
-                    "conversation_context": f"Response to: {user_message[:100]}...",
-                    "transition_from": "previous_state",  # You could track this more precisely
-                }
-            ).execute()
-        except Exception as e:
-            print(f"Error storing emotional state: {e}")
-
-        # Store conversation context in memory_stream (without embedding - disabled)
-        try:
-            # DISABLED: Embedding generation commented out to avoid large model dependency
-            # context_text = f"User: {user_message}\nCharlotte: {reply}"
-            # context_embedding = generate_embedding(context_text)
-
-            # Store in memory_stream table (without embedding)
-            supabase_extension.client.table("memory_stream").insert(
-                {
-                    "user_message": user_message,
-                    "agent_response": reply,
-                    "conversation_topic": "general",  # Could be extracted later
-                    # "context_embedding": context_embedding,  # Disabled
-                    "emotional_context": {"emotion": emotion, "intensity": intensity},  # JSONB format
-                    "relevance_score": 0.5,  # Match schema column name
-                }
-            ).execute()
-            print(f"✓ Memory stored: {user_message[:30]}... → {reply[:30]}...")
-        except Exception as e:
-            print(f"✗ Error storing conversation context: {e}")
+        _store_turn(user_message, reply, emotion, intensity, conversation_id)
 
         return jsonify({"reply": reply, "emotion": emotion, "intensity": intensity})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@chat_bp.route("/send-stream", methods=["POST"])
+def send_stream():
+    """Streaming variant of /send: newline-delimited JSON token events, then a done event"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    user_message = data.get("message") or ""
+    prompt = data.get("prompt") or ""
+    if not isinstance(user_message, str) or not isinstance(prompt, str):
+        return jsonify({"error": "message and prompt must be strings"}), 400
+    user_message, prompt = user_message.strip(), prompt.strip()
+    conversation_id = parse_conversation_id(data.get("conversation_id"))
+
+    if not user_message:
+        return jsonify({"error": "Message is required"}), 400
+
+    def generate():
+        events = deepseek_request_stream(
+            user_message, prompt=prompt, conversation_id=conversation_id
+        )
+        finished = False
+        try:
+            for event in events:
+                # Raises GeneratorExit here once the client has disconnected
+                yield json.dumps(event) + "\n"
+                if event["type"] == "done":
+                    finished = True
+                    _store_turn(
+                        user_message,
+                        event["reply"],
+                        event["emotion"],
+                        event["intensity"],
+                        conversation_id,
+                    )
+        finally:
+            # Abort generation and skip persistence for abandoned turns
+            events.close()
+            _record_turn(cancelled=not finished)
+            if not finished:
+                print(f"✗ Client disconnected, turn cancelled: {user_message[:30]}...")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+
+def _record_turn(cancelled: bool) -> None:
+    """Count a finished or client-cancelled chat turn"""
+    with _turn_stats_lock:
+        _turn_stats["cancelled" if cancelled else "completed"] += 1
+
+def _store_turn(
+    user_message: str,
+    reply: str,
+    emotion: str,
+    intensity: float,
+    conversation_id: str = None,
+) -> None:
+    """Queue the emotional state and memory of one chat turn for persistence"""
+    # Rows are written in the background, so stamp them with the turn's own time
+    created_at = datetime.now(timezone.utc).isoformat()
+
+    # Emotional triggers in this turn (matched in memory, no database round trip)
+    triggers = EmotionalStateTracker().detect_triggers([user_message + " " + reply])
+    strongest = triggers["strongest_trigger"]
+
+    # Store emotional state in database
+    write_behind_queue.enqueue(
+        "emotional_states",
+        {
+            "created_at": created_at,
+            "emotion": emotion,
+            "intensity": intensity,
+            "trigger": (
+                strongest["trigger"]
+                if strongest
+                else f"User message: {user_message[:100]}..."
+            ),
+            "conversation_context": f"Response to: {user_message[:100]}...",
+            "transition_from": "previous_state",  # You could track this more precisely
+            "metadata": {"detected_triggers": triggers["detected_triggers"]},
+        },
+    )
+
+    # Store conversation context in memory_stream with its embedding
+    memory = {
+        "created_at": created_at,
+        "conversation_id": conversation_id,
+        "user_message": user_message,
+        "agent_response": reply,
+        "conversation_topic": "general",  # Could be extracted later
+        "emotional_context": {
+            "emotion": emotion,
+            "intensity": intensity,
+        },  # JSONB format
+        "relevance_score": 0.5,  # Match schema column name
+    }
+    # TF-IDF terms against the memories so far, so summaries need not recompute them
+    memory["metadata"] = {
+        "top_terms": memory_cache.top_terms(memory_text(memory), TOP_TERMS_PER_MEMORY)
+    }
+    # A near-duplicate stored for the same conversation (so rehydrating the
+    # conversation still finds it) is reinforced instead of adding a row
+    duplicate = memory_cache.absorb_duplicate(
+        memory, NEAR_DUPLICATE_BOOST, same=("conversation_id",)
+    )
+    if duplicate is not None:
+        # Incremented in the database, so concurrent reinforcements all count;
+        # the cached score is only this process's estimate
+        write_behind_queue.enqueue_rpc(
+            "reinforce_memory",
+            {
+                # Rows this process inserted carry no id until the cache reloads;
+                # those are matched on conversation and creation time instead
+                "p_id": duplicate.get("id"),
+                "p_conversation_id": duplicate.get("conversation_id"),
+                "p_created_at": duplicate["created_at"],
+                "p_increment": NEAR_DUPLICATE_BOOST,
+            },
+        )
+        print(f"✓ Near-duplicate memory reinforced: {user_message[:30]}...")
+    else:
+        memory["embedding"] = generate_embedding(memory_text(memory)) or None
+        write_behind_queue.enqueue("memory_stream", memory)
+        memory_cache.add([memory])
+        print(f"✓ Memory queued: {user_message[:30]}... → {reply[:30]}...")
+
+    # Keep this conversation's recent turns in memory for the next request
+    if conversation_id:
+        session_cache.append(conversation_id, memory)
+
 @chat_bp.route("/current-emotion", methods=["GET"])
 def get_current_emotion():
     """Get the most recent emotional state"""
@@ -223,6 +357,32 @@ def get_memory_log():
         return jsonify({"error": str(e)}), 500
 
 
+@chat_bp.route("/chat-metrics", methods=["GET"])
+def get_chat_metrics():
+    """Get performance counters for the chat pipeline in this worker"""
+    try:
+        return jsonify(
+            {
+                "success": True,
+                "turns": dict(_turn_stats),
+                "prompt_cache": get_prompt_cache_stats(),
+                "write_behind": write_behind_queue.stats(),
+                "sessions": session_cache.stats(),
+                "response_cache": response_cache.stats(),
+                "context_packer": context_packer.stats(),
+                "llm_providers": llm_router.stats(),
+                "memory_cache": memory_cache.stats(),
+                "conversation_cache": conversation_cache.stats(),
+                "retrieval_pipeline": retrieval_pipeline.stats(),
+                "embedding_cache": get_embedding_cache_stats(),
+                "conversation_features": conversation_features.stats(),
+                "reference_data": reference_data.stats(),
+            }
+        )
+    except Exception as e:
+        print(f"Error getting chat metrics: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @chat_bp.route("/save", methods=["POST"])
 def save():
     try:
@@ -450,7 +610,8 @@ def save_simple():
         return jsonify({"error": str(e)}), 500
 
 
-# DISABLED: Embedding functionality commented out to avoid large model dependency
+# DISABLED: a full-table backfill does not belong on a request thread; run the
+# batched, resumable scripts/populate_embeddings.py instead
 # @chat_bp.route("/populate-embeddings", methods=["POST"])
 # def populate_embeddings():
 #     """Populate embeddings for existing memory stream data"""
@@ -461,3 +622,19 @@ def save_simple():
 #         )
 #     except Exception as e:
 #         return jsonify({"error": str(e)}), 500
+
+
+@chat_bp.route("/reference-data/invalidate", methods=["POST"])
+def invalidate_reference_data():
+    """Reload cached reference tables (one table, or all when none is given)"""
+    if not session.get("dev"):
+        return jsonify({"error": "Forbidden"}), 403
+
+    try:
+        data = request.get_json(silent=True) or {}
+        tables = reference_data.invalidate(data.get("table"))
+        return jsonify({"success": True, "invalidated": tables})
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -179,6 +179,24 @@ function mapOldEmotionToNew(emotion) {
   return emotionMapping[lowerEmotion] || lowerEmotion;
 }
 
+// Identifies this browser tab's conversation so the server can keep its recent turns
+function getConversationId() {
+  let conversationId = sessionStorage.getItem("conversationId");
+  if (!conversationId) {
+    conversationId =
+      window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : "10000000-1000-4000-8000-100000000000".replace(/[018]/g, (c) =>
+            (
+              c ^
+              (crypto.getRandomValues(new Uint8Array(1))[0] & (15 >> (c / 4)))
+            ).toString(16)
+          );
+    sessionStorage.setItem("conversationId", conversationId);
+  }
+  return conversationId;
+}
+
 // Load initial emotional state when page loads
 document.addEventListener("DOMContentLoaded", function () {
   loadCurrentEmotion();
@@ -355,59 +373,163 @@ function sendMessage() {
   // Add loading animation
   const loadingContainer = addLoadingMessage();
 
-  fetch("/send", {
+  // Aborting closes the connection, which makes the server stop generating
+  const controller = new AbortController();
+  activeReplyControllers.add(controller);
+  const timeoutId = setTimeout(() => controller.abort(), REPLY_TIMEOUT_MS);
+
+  fetch("/send-stream", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
+    signal: controller.signal,
     body: JSON.stringify({
       message: msg,
       prompt: prompt,
+      conversation_id: getConversationId(),
     }),
   })
-    .then((response) => response.json())
-    .then((data) => {
-      console.log("=== DEBUG: RECEIVED RESPONSE ===");
-      console.log("Full response data:", data);
-
-      // Remove loading animation
-      removeLoadingMessage(loadingContainer);
-
-      if (data.error) {
-        console.error("Error:", data.error);
-        addMessage("Error: " + data.error, "bot");
-      } else {
-        addMessage(data.reply, "bot");
-
-        // Update emotional state if provided
-        if (data.emotion && data.intensity !== undefined) {
-          console.log("=== DEBUG: UPDATING EMOTION STATE ===");
-          console.log("Emotion:", data.emotion);
-          console.log("Intensity:", data.intensity);
-          console.log("Valid emotions:", Object.keys(emotionEmojis));
-
-          // Check if emotion is valid
-          if (!Object.keys(emotionEmojis).includes(data.emotion)) {
-            console.warn("Invalid emotion received:", data.emotion);
-            data.emotion = "calm"; // Default to calm for invalid emotions
-          }
-
-          updateEmotionalState(data.emotion, data.intensity);
-        } else {
-          console.warn("No emotion data in response:", data);
-        }
+    .then((response) => {
+      if (!response.ok || !response.body) {
+        return response.json().then((data) => {
+          throw new Error(data.error || "Failed to send message");
+        });
       }
+      return readReplyStream(response, loadingContainer);
     })
     .catch((error) => {
       // Remove loading animation
       removeLoadingMessage(loadingContainer);
 
       console.error("Fetch error:", error);
-      addMessage("Error: Failed to send message", "bot");
+      if (error.name === "AbortError") {
+        addMessage("Error: The reply took too long, please try again", "bot");
+      } else {
+        addMessage("Error: " + error.message, "bot");
+      }
+    })
+    .finally(() => {
+      clearTimeout(timeoutId);
+      activeReplyControllers.delete(controller);
     });
 
   input.value = "";
   autoResize(input);
 }
 
+// Give up on a reply after this long; the server cancels generation when we abort
+const REPLY_TIMEOUT_MS = 90000;
+
+// In-flight replies, aborted when the page goes away so the server stops generating
+const activeReplyControllers = new Set();
+
+window.addEventListener("pagehide", () => {
+  for (const controller of activeReplyControllers) {
+    controller.abort();
+  }
+});
+
+// Read newline-delimited JSON events from /send-stream and render tokens as they arrive
+function readReplyStream(response, loadingContainer) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let botMessage = null;
+
+  function handleEvent(event) {
+    if (!botMessage) {
+      removeLoadingMessage(loadingContainer);
+      botMessage = addStreamingMessage();
+    }
+
+    if (event.type === "token") {
+      botMessage.append(event.text);
+    } else if (event.type === "done") {
+      console.log("=== DEBUG: RECEIVED RESPONSE ===");
+      console.log("Full response data:", event);
+
+      // The final event carries the canonical clean reply
+      botMessage.set(event.reply);
+
+      if (event.emotion && event.intensity !== undefined) {
+        if (!Object.keys(emotionEmojis).includes(event.emotion)) {
+          console.warn("Invalid emotion received:", event.emotion);
+          event.emotion = "calm"; // Default to calm for invalid emotions
+        }
+        updateEmotionalState(event.emotion, event.intensity);
+      } else {
+        console.warn("No emotion data in response:", event);
+      }
+    }
+  }
+
+  function pump() {
+    return reader.read().then(({ done, value }) => {
+      buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+
+      const lines = buffer.split("\n");
+      buffer = lines.pop();
+      for (const line of lines) {
+        if (line.trim()) {
+          handleEvent(JSON.parse(line));
+        }
+      }
+
+      if (done) {
+        if (buffer.trim()) {
+          handleEvent(JSON.parse(buffer));
+        }
+        removeLoadingMessage(loadingContainer);
+        return;
+      }
+      return pump();
+    });
+  }
+
+  return pump();
+}
+
+// Add an empty bot message that is filled in progressively while streaming
+function addStreamingMessage() {
+  const chatDiv = document.getElementById("chat");
+  const container = document.createElement("div");
+  container.className = "message-container bot-container";
+
+  let target;
+  if (isDev === true || isDev === "true") {
+    target = document.createElement("textarea");
+    target.className = "message-textarea";
+    target.oninput = () => autoResize(target);
+  } else {
+    target = document.createElement("div");
+    target.className = "message bot";
+  }
+
+  container.appendChild(target);
+  chatDiv.appendChild(container);
+
+  function render(text) {
+    if (target.tagName === "TEXTAREA") {
+      target.value = text;
+      autoResize(target);
+    } else {
+      target.textContent = text;
+    }
+    chatDiv.scrollTop = chatDiv.scrollHeight;
+  }
+
+  let text = "";
+  return {
+    append(chunk) {
+      text += chunk;
+      render(text);
+    },
+    set(fullText) {
+      text = fullText;
+      render(text);
+    },
+  };
+}
+
 function saveConversation() {
   const chatDiv = document.getElementById("chat");
   const messages = [];
@@ -1,73 +1,255 @@
 import os
+import time
 import uuid
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable
 import numpy as np
 import threading
 from typing import List
-from app import supabase_extension
-
-# from sentence_transformers import SentenceTransformer
-
-# Disable tokenizer parallelism to avoid fork warnings
+from flask import current_app, g
+from app import supabase_extension, reference_data, write_behind_queue
+from app.utils.session_cache import session_cache
+from app.utils.context_packer import context_packer
+from app.utils.embeddings import (
+    EmbeddingBackend,
+    create_embedding_backend,
+    parse_embedding,
+    to_pg_vector,
+)
+from app.utils.embedding_cache import EmbeddingCache, CachedEmbedding
+from app.utils.memory_cache import CachedTable, parse_timestamp
+from app.utils.text_processing import extract_keywords
+from app.utils.retrieval_pipeline import RetrievalPipeline
+from app.utils.keyword_matcher import KeywordMatcher
+from app.utils.trigger_matcher import TriggerAutomaton, match_triggers
+from app.utils.conversation_features import (
+    ConversationFeatures,
+    ConversationFeatureCache,
+)
+
+# Disable tokenizer parallelism to avoid fork warnings (optional e5 backend)
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 # Global variables for lazy loading
 _embedding_model = None
 _model_lock = threading.Lock()
 
+# On-disk cache of embeddings by model and text, shared with scripts/populate_embeddings.py:
+# "auto" caches expensive backends only, "on" always, "off" never
+EMBEDDING_CACHE = os.environ.get("EMBEDDING_CACHE", "auto")
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3"
+)
+
+# Bounded pool shared by all requests for concurrent context retrieval
+RETRIEVAL_MAX_WORKERS = int(os.environ.get("RETRIEVAL_MAX_WORKERS", "8"))
+# Overall deadline (seconds) after which the prompt is built from whatever returned
+RETRIEVAL_DEADLINE = float(os.environ.get("RETRIEVAL_DEADLINE", "1.0"))
+# Per-source timeouts (seconds), capped by RETRIEVAL_DEADLINE
+RETRIEVAL_SOURCE_TIMEOUTS = {
+    "recent_context": 0.6,
+    "historical_context": 1.0,
+    "lexical_context": 0.3,
+}
+# Candidates fetched per source (x limit) for fusion and diversity selection
+RETRIEVAL_CANDIDATE_FACTOR = int(os.environ.get("RETRIEVAL_CANDIDATE_FACTOR", "3"))
+# Reciprocal-rank fusion constant: higher flattens the gap between ranks
+RRF_K = int(os.environ.get("RRF_K", "60"))
+# Maximal-marginal-relevance trade-off: 0 ranks by relevance only, 1 by novelty only
+MMR_DIVERSITY = float(os.environ.get("MMR_DIVERSITY", "0.5"))
+
+# Number of latest rows ranked while the columnar caches are still loading
+HISTORICAL_CANDIDATES = int(os.environ.get("HISTORICAL_CANDIDATES", "100"))
+# Approximate nearest-neighbour index over memory embeddings (see memory_index.py)
+MEMORY_INDEX_PARAMS = {
+    # Lists probed per query: higher improves recall at the cost of latency
+    "nprobe": int(os.environ.get("MEMORY_INDEX_NPROBE", "16")),
+    # Below this many memories search stays exact
+    "train_size": int(os.environ.get("MEMORY_INDEX_TRAIN_SIZE", "10000")),
+}
+MEMORY_INDEX_DIR = os.environ.get("MEMORY_INDEX_DIR", ".cache/memory_index")
+# Keep cached embeddings int8-quantized in files under MEMORY_INDEX_DIR that every
+# worker process maps, instead of a float32 matrix per process (see vector_store.py)
+MAPPED_VECTORS = os.environ.get("MAPPED_VECTORS", "true").lower() == "true"
+# Estimated Jaccard similarity (character shingles) above which a new memory is
+# folded into an existing one instead of inserted (see minhash.py)
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+# relevance_score added to a memory each time a near-duplicate is folded into it,
+# by the reinforce_memory function in sqls/create_reinforce_memory_function.sql
+NEAR_DUPLICATE_BOOST = float(os.environ.get("NEAR_DUPLICATE_BOOST", "0.1"))
+# Highest TF-IDF terms stored with each memory (metadata.top_terms) at write time
+TOP_TERMS_PER_MEMORY = int(os.environ.get("TOP_TERMS_PER_MEMORY", "5"))
+# "cache" ranks rows in-process (columnar caches + ANN index); "rpc" ranks them in
+# Postgres with the match functions in sqls/create_match_functions.sql
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "cache")
+
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix="retrieval"
+)
+
+
+def bind_app_context(fn: Callable) -> Callable:
+    """Wrap fn to run in another thread under the caller's app context and Supabase client"""
+    app = current_app._get_current_object()
+    client = supabase_extension.client
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            # Share the request's client instead of building a new one per task
+            g.supabase_client = client
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                # Keep the extension's teardown from signing out the shared client
+                g.pop("supabase_client", None)
+
+    return wrapper
+
+
+def get_embedding_model() -> EmbeddingBackend:
+    """Get the embedding backend with lazy loading and thread safety.
+
+    EMBEDDING_BACKEND selects it: "hashing" (default, no model download) or "e5"
+    (requires sentence-transformers). Stored vectors are only comparable within
+    one backend, so switch backends together with populate_embeddings.
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        with _model_lock:
+            # Double-check pattern to prevent race conditions
+            if _embedding_model is None:
+                backend = create_embedding_backend(
+                    os.environ.get("EMBEDDING_BACKEND", "hashing")
+                )
+                if EMBEDDING_CACHE == "on" or (
+                    EMBEDDING_CACHE == "auto" and backend.expensive
+                ):
+                    backend = CachedEmbedding(
+                        backend, EmbeddingCache(EMBEDDING_CACHE_PATH)
+                    )
+                _embedding_model = backend
+                print(f"Loaded embedding backend {_embedding_model.model_id}")
+    return _embedding_model
 
-# def get_embedding_model():
-#     """Get the embedding model with lazy loading and thread safety"""
-#     global _embedding_model
-#     if _embedding_model is None:
-#         with _model_lock:
-#             # Double-check pattern to prevent race conditions
-#             if _embedding_model is None:
-#                 _embedding_model = SentenceTransformer("intfloat/multilingual-e5-base")
-#     return _embedding_model
 
+def get_embedding_cache_stats() -> Optional[Dict[str, Any]]:
+    """Hit/miss counters of the embedding cache, or None when it is disabled"""
+    model = _embedding_model
+    return model.stats() if isinstance(model, CachedEmbedding) else None
 
-# def generate_embedding(text: str) -> List[float]:
-#     """Generate embedding for text using Sentence Transformers intfloat/multilingual-e5-base model"""
-#     try:
-#         # Get model with lazy loading
-#         model = get_embedding_model()
 
-#         # E5 models require a "query: " prefix for optimal performance
-#         prefixed_text = f"query: {text}"
+def set_embedding_model(backend: EmbeddingBackend) -> None:
+    """Replace the embedding backend (e.g. with a custom EmbeddingBackend)"""
+    global _embedding_model
+    with _model_lock:
+        _embedding_model = backend
 
-#         # Generate embedding using sentence transformers
-#         embedding = model.encode(prefixed_text, convert_to_tensor=False)
-#         return embedding.tolist()
-#     except Exception as e:
-#         print(f"Error generating Sentence Transformer embedding: {e}")
-#         return []
 
+def generate_embeddings(texts: List[str]) -> np.ndarray:
+    """Embed a batch of texts into an (n, dim) array of unit vectors"""
+    return get_embedding_model().embed_batch(texts)
 
-def cosine_similarity(a: List[float], b: List[float]) -> float:
-    """Calculate cosine similarity between two vectors"""
-    import json
 
-    # Handle case where embeddings might be stored as JSON strings
-    if isinstance(a, str):
-        try:
-            a = json.loads(a)
-        except:
-            return 0.0
-    if isinstance(b, str):
-        try:
-            b = json.loads(b)
-        except:
-            return 0.0
+def generate_embedding(text: str) -> List[float]:
+    """Generate an embedding for text as a list suitable for a vector column"""
+    try:
+        return to_pg_vector(generate_embeddings([text])[0])
+    except Exception as e:
+        print(f"Error generating embedding: {e}")
+        return []
 
-    if not a or not b:
-        return 0.0
 
-    a = np.array(a, dtype=np.float32)
-    b = np.array(b, dtype=np.float32)
+def memory_text(memory: Dict) -> str:
+    """Text of a memory_stream row that its embedding is computed from"""
+    return f"{memory.get('user_message', '')} {memory.get('agent_response', '')}"
 
-    if a.shape != b.shape or a.size == 0:
+
+def memory_top_terms(memory: Dict) -> List[str]:
+    """Top terms stored with a memory when it was written, computed for older rows"""
+    metadata = memory.get("metadata")
+    if isinstance(metadata, dict) and metadata.get("top_terms") is not None:
+        return metadata["top_terms"]
+    return memory_cache.top_terms(memory_text(memory), TOP_TERMS_PER_MEMORY)
+
+
+def conversation_text(conversation_data: List[Dict]) -> str:
+    """Text of a saved conversation that its embedding is computed from"""
+    return " ".join(
+        [
+            f"{msg.get('text', '')} {msg.get('user_message', '')} {msg.get('agent_response', '')}"
+            for msg in conversation_data
+        ]
+    )
+
+
+# Columnar caches scored in one vectorized pass per query (see memory_cache.py)
+memory_cache = CachedTable(
+    "memory_stream",
+    "id, created_at, conversation_id, user_message, agent_response, "
+    "conversation_topic, emotional_context, relevance_score, metadata, embedding",
+    text_fn=memory_text,
+    encoder=generate_embeddings,
+    importance_column="relevance_score",
+    index_params=MEMORY_INDEX_PARAMS,
+    index_dir=MEMORY_INDEX_DIR,
+    lexical=True,
+    mapped_vectors=MAPPED_VECTORS,
+    near_duplicates=NEAR_DUPLICATE_THRESHOLD,
+)
+conversation_cache = CachedTable(
+    "saved_conversations",
+    "*",
+    text_fn=lambda conv: conversation_text(conv.get("conversation_data") or []),
+    encoder=generate_embeddings,
+    quality_column="quality_score",
+    filters={"is_active": True},
+    index_dir=MEMORY_INDEX_DIR,
+    mapped_vectors=MAPPED_VECTORS,
+)
+reference_data.register("speech_patterns")
+# update_background stamps last_updated on edits, so probe that instead of created_at
+reference_data.register("background_knowledge", version_column="last_updated")
+reference_data.register(
+    "emotional_triggers",
+    build=lambda rows: TriggerAutomaton([row.get("trigger_value") for row in rows]),
+)
+# Dedupe, reciprocal-rank fusion and MMR over historical candidates
+retrieval_pipeline = RetrievalPipeline(
+    encoder=generate_embeddings,
+    text_fn=memory_text,
+    rrf_k=RRF_K,
+    diversity=MMR_DIVERSITY,
+    vector_lookup=memory_cache.vectors_for,
+)
+
+
+def match_rows(
+    function: str, query_vector: np.ndarray, limit: int
+) -> Optional[List[Dict]]:
+    """Call a pgvector match function over PostgREST; None if the call failed"""
+    try:
+        response = supabase_extension.client.rpc(
+            function,
+            {"query_embedding": to_pg_vector(query_vector), "match_count": limit},
+        ).execute()
+        return response.data or []
+    except Exception as e:
+        print(f"Error calling {function}, falling back to cache retrieval: {e}")
+        return None
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    """Calculate cosine similarity between two vectors (lists or JSON strings).
+
+    For scoring many rows use the columnar caches, which score in one pass.
+    """
+    a = parse_embedding(a)
+    b = parse_embedding(b)
+    if a is None or b is None or a.shape != b.shape:
         return 0.0
 
     norm_a = np.linalg.norm(a)
@@ -79,12 +261,169 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
     return float(np.dot(a, b) / (norm_a * norm_b))
 
 
+# Keyword lists of the conversation analyzers, one taxonomy per analyzer
+KEYWORD_TAXONOMIES = {
+    # ConversationManager._classify_conversation
+    "saved_type": {
+        "academic": [
+            "research",
+            "study",
+            "paper",
+            "analysis",
+            "methodology",
+            "academic",
+        ],
+        "technical": [
+            "code",
+            "programming",
+            "algorithm",
+            "system",
+            "implementation",
+            "technical",
+        ],
+        "emotional": [
+            "feel",
+            "emotion",
+            "sad",
+            "happy",
+            "excited",
+            "worried",
+            "love",
+            "hate",
+        ],
+        "casual": [
+            "hello",
+            "how are you",
+            "nice",
+            "good",
+            "great",
+            "thanks",
+            "thank you",
+        ],
+    },
+    # ConversationManager._extract_topics
+    "saved_topic": {
+        "research": ["research", "study", "paper", "experiment"],
+        "coding": ["code", "programming", "algorithm", "bug", "function"],
+        "personal": ["family", "friend", "home", "life", "experience"],
+        "academic": ["university", "professor", "class", "assignment", "grade"],
+        "technology": ["computer", "software", "app", "system", "technology"],
+        "emotions": ["feel", "happy", "sad", "excited", "worried", "love"],
+    },
+    # ConversationManager._extract_emotional_arc (per bot message)
+    "response_emotion": {
+        "positive": ["happy", "excited", "great", "wonderful"],
+        "negative": ["sad", "sorry", "unfortunate", "worried"],
+    },
+    # SpeechStyleRetriever._classify_conversation
+    "style_type": {
+        "academic": ["research", "study", "paper", "analysis", "methodology"],
+        "technical": [
+            "code",
+            "programming",
+            "algorithm",
+            "system",
+            "implementation",
+        ],
+        "emotional": ["feel", "emotion", "sad", "happy", "excited", "worried"],
+        "casual": ["hello", "how are you", "nice", "good", "great"],
+    },
+    # AutoObserver._extract_topics
+    "observed_topic": {
+        "technology": ["code", "programming", "software", "computer", "tech"],
+        "academic": ["research", "study", "paper", "analysis", "academic"],
+        "personal": ["feel", "think", "believe", "experience", "life"],
+        "casual": ["hello", "how", "nice", "good", "thanks"],
+    },
+    # AutoObserver._analyze_emotional_tone
+    "observed_tone": {
+        "positive": [
+            "happy",
+            "excited",
+            "great",
+            "wonderful",
+            "amazing",
+            "love",
+            "enjoy",
+        ],
+        "negative": [
+            "sad",
+            "angry",
+            "frustrated",
+            "worried",
+            "hate",
+            "terrible",
+            "awful",
+        ],
+        "neutral": ["okay", "fine", "alright", "neutral", "normal"],
+    },
+    # _classify_conversation_type
+    "conversation_type": {
+        "academic": [
+            "research",
+            "study",
+            "paper",
+            "analysis",
+            "methodology",
+            "academic",
+        ],
+        "technical": ["code", "programming", "algorithm", "system", "implementation"],
+        "emotional": ["feel", "emotion", "sad", "happy", "excited", "worried"],
+        "casual": ["hello", "how are you", "nice", "good", "thanks", "thank you"],
+        "philosophical": [
+            "think",
+            "believe",
+            "philosophy",
+            "meaning",
+            "purpose",
+            "existence",
+        ],
+    },
+    # _extract_conversation_topics
+    "conversation_topic": {
+        "AI": ["ai", "artificial intelligence", "machine learning", "neural network"],
+        "research": ["research", "study", "experiment", "analysis", "methodology"],
+        "technology": ["technology", "tech", "software", "computer", "digital"],
+        "philosophy": ["philosophy", "ethics", "morality", "meaning", "purpose"],
+        "personal": ["personal", "life", "experience", "feelings", "emotions"],
+        "academic": ["academic", "university", "education", "learning", "knowledge"],
+    },
+    # _analyze_conversation_tone
+    "conversation_tone": {
+        "positive": [
+            "happy",
+            "excited",
+            "great",
+            "wonderful",
+            "amazing",
+            "love",
+            "enjoy",
+        ],
+        "negative": [
+            "sad",
+            "angry",
+            "frustrated",
+            "worried",
+            "hate",
+            "terrible",
+            "awful",
+            "bad",
+        ],
+    },
+}
+# Compiled once: every analyzer's keywords are counted in one scan of a text
+keyword_matcher = KeywordMatcher(KEYWORD_TAXONOMIES)
+# Shared by /analyze-conversation and /save, which analyze the same conversation
+conversation_features = ConversationFeatureCache(keyword_matcher)
+
+
 class ConversationManager:
     """Manages conversation storage and retrieval for context building"""
 
-    def __init__(self):
+    def __init__(self, retrieval_mode: Optional[str] = None):
         self.saved_conversations_table = "saved_conversations"
         self.memory_stream_table = "memory_stream"
+        self.retrieval_mode = retrieval_mode or RETRIEVAL_MODE
 
     def save_conversation(
         self,
@@ -96,24 +435,17 @@ class ConversationManager:
         """Save a conversation to the database with embeddings"""
         try:
             # Analyze conversation for type and topics
-            conversation_type = self._classify_conversation(conversation_data)
-            topics = self._extract_topics(conversation_data)
-            emotional_arc = self._extract_emotional_arc(conversation_data)
+            features = conversation_features.get(conversation_data)
+            conversation_type = self._classify_conversation(features)
+            topics = self._extract_topics(features)
+            emotional_arc = self._extract_emotional_arc(features)
 
             # Generate title if not provided
             if not title:
                 title = f"Conversation {datetime.now().strftime('%Y-%m-%d %H:%M')}"
 
             # Generate embedding for the entire conversation
-            # DISABLED: Embedding functionality commented out to avoid large model dependency
-            # conv_text = " ".join(
-            #     [
-            #         f"{msg.get('text', '')} {msg.get('user_message', '')} {msg.get('agent_response', '')}"
-            #         for msg in conversation_data
-            #     ]
-            # )
-            # embedding = generate_embedding(conv_text)
-            embedding = None  # Embeddings disabled
+            embedding = generate_embedding(conversation_text(conversation_data)) or None
 
             # Insert into database
             response = (
@@ -136,6 +468,7 @@ class ConversationManager:
             )
 
             if response.data:
+                conversation_cache.add(response.data)
                 return response.data[0]["id"]
             else:
                 raise Exception("Failed to save conversation")
@@ -147,58 +480,46 @@ class ConversationManager:
     def get_relevant_conversations(
         self, user_message: str, limit: int = 3
     ) -> List[Dict]:
-        """Retrieve relevant conversations based on recency and metadata (embeddings disabled)"""
+        """Retrieve relevant conversations based on semantic similarity, recency and quality"""
         try:
-            print("\n=== DEBUG: SEARCHING WITH RECENCY + METADATA (EMBEDDINGS DISABLED) ===")
-
-            # DISABLED: Embedding-based retrieval
-            # query_embedding = generate_embedding(user_message)
-
-            # Get all active conversations
-            response = (
-                supabase_extension.client.table(self.saved_conversations_table)
-                .select("*")
-                .eq("is_active", True)
-                .order("created_at", desc=True)  # Sort by recency
-                .execute()
-            )
+            print("\n=== DEBUG: SEARCHING WITH EMBEDDINGS + RECENCY + METADATA ===")
+
+            query_vector = get_embedding_model().embed(user_message)
+            if self.retrieval_mode == "rpc":
+                matched = match_rows("match_conversations", query_vector, limit)
+                if matched is not None:
+                    print(f"Matched {len(matched)} conversations in the database")
+                    return [
+                        dict(conv, relevance_score=conv["score"]) for conv in matched
+                    ]
+
+            scored = conversation_cache.search(query_vector, limit)
+            if scored is None:
+                # Cache still loading: score active conversations fetched directly
+                response = (
+                    supabase_extension.client.table(self.saved_conversations_table)
+                    .select("*")
+                    .eq("is_active", True)
+                    .order("created_at", desc=True)  # Sort by recency
+                    .limit(HISTORICAL_CANDIDATES)
+                    .execute()
+                )
+                scored = conversation_cache.score_rows(
+                    query_vector, response.data or [], limit
+                )
 
-            if not response.data:
+            if not scored:
                 print("No conversations found in database")
                 return []
 
-            # Simple recency + quality scoring (without embeddings)
-            conversations_with_scores = []
-            for conv in response.data:
-                # Calculate score based on quality and recency only
-                quality_boost = float(conv.get("quality_score", 0.5))
-
-                # Check recency
-                try:
-                    created_time = datetime.fromisoformat(conv.get("created_at", ""))
-                    time_diff = datetime.now() - created_time
-                    if time_diff.days < 1:  # Within last 24 hours
-                        recency_score = 1.5
-                    elif time_diff.days < 7:  # Within last week
-                        recency_score = 1.2
-                    else:
-                        recency_score = 1.0
-                except (ValueError, TypeError):
-                    recency_score = 1.0
-
-                # Calculate final score (without semantic similarity)
-                final_score = quality_boost * recency_score
-
-                conv["relevance_score"] = final_score
-                conversations_with_scores.append(conv)
-
-            # Sort by relevance and return top results
-            conversations_with_scores.sort(
-                key=lambda x: x["relevance_score"], reverse=True
-            )
+            # Semantic similarity weighted by recency and quality
+            conversations_with_scores = [
+                dict(conv, similarity=similarity, relevance_score=score)
+                for conv, score, similarity in scored
+            ]
 
             print(f"Found {len(conversations_with_scores)} relevant conversations")
-            return conversations_with_scores[:limit]
+            return conversations_with_scores
 
         except Exception as e:
             print(f"Error retrieving relevant conversations: {e}")
@@ -214,18 +535,28 @@ class ConversationManager:
             if not relevant_conversations:
                 return ""
 
+            # Key exchanges from each conversation, packed into one shared budget
+            items = [
+                [
+                    (
+                        "User" if msg.get("sender") == "user" else "Charlotte",
+                        msg.get("text", ""),
+                    )
+                    for msg in conv.get("conversation_data", [])[:6]
+                ]
+                for conv in relevant_conversations
+            ]
+            packed_items, tokens, dropped, _ = context_packer.pack_section(
+                "conversations", items
+            )
+            print(f"Packed conversation context: {tokens} tokens, {dropped} dropped")
+
             context_parts = []
-            for conv in relevant_conversations:
+            for conv, lines in zip(relevant_conversations, packed_items):
                 context_parts.append(
-                    f"Relevant conversation about {', '.join(conv['topics'][:3])}:"
+                    f"Relevant conversation about {', '.join((conv.get('topics') or [])[:3])}:"
                 )
-
-                # Add key exchanges from the conversation
-                messages = conv.get("conversation_data", [])
-                for i, msg in enumerate(messages[:6]):  # Limit to 6 messages
-                    sender = "User" if msg.get("sender") == "user" else "Charlotte"
-                    context_parts.append(f"{sender}: {msg.get('text', '')}")
-
+                context_parts.extend(lines)
                 context_parts.append("")  # Add spacing
 
             return "\n".join(context_parts)
@@ -243,53 +574,9 @@ class ConversationManager:
         except Exception as e:
             print(f"Error updating usage count: {e}")
 
-    def _classify_conversation(self, conversation_data: List[Dict]) -> str:
+    def _classify_conversation(self, features: ConversationFeatures) -> str:
         """Classify conversation type based on content"""
-        text = " ".join([msg.get("text", "") for msg in conversation_data]).lower()
-
-        keywords = {
-            "academic": [
-                "research",
-                "study",
-                "paper",
-                "analysis",
-                "methodology",
-                "academic",
-            ],
-            "technical": [
-                "code",
-                "programming",
-                "algorithm",
-                "system",
-                "implementation",
-                "technical",
-            ],
-            "emotional": [
-                "feel",
-                "emotion",
-                "sad",
-                "happy",
-                "excited",
-                "worried",
-                "love",
-                "hate",
-            ],
-            "casual": [
-                "hello",
-                "how are you",
-                "nice",
-                "good",
-                "great",
-                "thanks",
-                "thank you",
-            ],
-        }
-
-        scores = {k: 0 for k in keywords.keys()}
-        for conv_type, words in keywords.items():
-            for word in words:
-                if word in text:
-                    scores[conv_type] += 1
+        scores = features.keyword_hits["saved_type"]
 
         # Return the type with highest score, default to casual
         return (
@@ -298,47 +585,24 @@ class ConversationManager:
             else "casual"
         )
 
-    def _extract_topics(self, conversation_data: List[Dict]) -> List[str]:
+    def _extract_topics(self, features: ConversationFeatures) -> List[str]:
         """Extract main topics from conversation"""
-        # Simple keyword extraction - could be enhanced with NLP
-        text = " ".join([msg.get("text", "") for msg in conversation_data]).lower()
-
-        # Common topics/keywords
-        topics = []
-        topic_keywords = {
-            "research": ["research", "study", "paper", "experiment"],
-            "coding": ["code", "programming", "algorithm", "bug", "function"],
-            "personal": ["family", "friend", "home", "life", "experience"],
-            "academic": ["university", "professor", "class", "assignment", "grade"],
-            "technology": ["computer", "software", "app", "system", "technology"],
-            "emotions": ["feel", "happy", "sad", "excited", "worried", "love"],
-        }
-
-        for topic, keywords in topic_keywords.items():
-            if any(keyword in text for keyword in keywords):
-                topics.append(topic)
+        topics = features.categories("saved_topic")
 
         return topics[:5]  # Limit to 5 topics
 
-    def _extract_emotional_arc(self, conversation_data: List[Dict]) -> Dict[str, Any]:
+    def _extract_emotional_arc(self, features: ConversationFeatures) -> Dict[str, Any]:
         """Extract emotional progression throughout conversation"""
         # Simple emotional analysis - could be enhanced
         emotions = []
-        for msg in conversation_data:
-            if msg.get("sender") == "bot":  # Only analyze Charlotte's responses
-                text = msg.get("text", "").lower()
-
-                # Simple emotion detection
-                if any(
-                    word in text for word in ["happy", "excited", "great", "wonderful"]
-                ):
-                    emotions.append("positive")
-                elif any(
-                    word in text for word in ["sad", "sorry", "unfortunate", "worried"]
-                ):
-                    emotions.append("negative")
-                else:
-                    emotions.append("neutral")
+        for hits in features.response_emotions:  # Only Charlotte's responses
+            # Simple emotion detection
+            if hits["positive"]:
+                emotions.append("positive")
+            elif hits["negative"]:
+                emotions.append("negative")
+            else:
+                emotions.append("neutral")
 
         return {
             "emotions": emotions,
@@ -355,65 +619,7 @@ class ConversationManager:
 
     def _extract_keywords(self, text: str) -> List[str]:
         """Extract keywords from text for matching"""
-        # Simple keyword extraction - could be enhanced with NLP
-        stop_words = {
-            "the",
-            "a",
-            "an",
-            "and",
-            "or",
-            "but",
-            "in",
-            "on",
-            "at",
-            "to",
-            "for",
-            "of",
-            "with",
-            "by",
-            "is",
-            "are",
-            "was",
-            "were",
-            "be",
-            "been",
-            "have",
-            "has",
-            "had",
-            "do",
-            "does",
-            "did",
-            "will",
-            "would",
-            "could",
-            "should",
-            "may",
-            "might",
-            "can",
-            "this",
-            "that",
-            "these",
-            "those",
-            "i",
-            "you",
-            "he",
-            "she",
-            "it",
-            "we",
-            "they",
-            "me",
-            "him",
-            "her",
-            "us",
-            "them",
-        }
-
-        words = text.split()
-        keywords = [
-            word for word in words if word.lower() not in stop_words and len(word) > 2
-        ]
-
-        return keywords[:10]  # Limit to 10 keywords
+        return extract_keywords(text, 10)  # Limit to 10 keywords
 
 
 class BackgroundManager:
@@ -425,16 +631,14 @@ class BackgroundManager:
     def get_background_prompt(self) -> str:
         """Retrieve and format background knowledge for LLM prompt"""
         try:
-            response = (
-                supabase_extension.client.table(self.table_name)
-                .select("*")
-                .eq("is_active", True)
-                .order("confidence_score", desc=True)
-                .execute()
+            items = sorted(
+                reference_data.get(self.table_name).where(is_active=True),
+                key=lambda item: item.get("confidence_score") or 0.0,
+                reverse=True,
             )
 
             background_parts = []
-            for item in response.data:
+            for item in items:
                 background_parts.append(f"{item['knowledge_type']}: {item['content']}")
 
             return "You are Charlotte. " + " ".join(background_parts)
@@ -476,6 +680,10 @@ class BackgroundManager:
                     }
                 ).execute()
 
+            # Reload now so this worker's next read sees the change; other
+            # workers pick it up on their next periodic refresh
+            reference_data.refresh(self.table_name)
+
         except Exception as e:
             print(f"Error updating background: {e}")
 
@@ -483,9 +691,11 @@ class BackgroundManager:
 class ContextRetriever:
     """Retrieves relevant context from memory stream and database"""
 
-    def __init__(self):
+    def __init__(self, retrieval_mode: Optional[str] = None):
         self.memory_table = "memory_stream"
         self.conversations_table = "saved_conversations"
+        # "cache" (in-process ranking) or "rpc" (server-side pgvector match functions)
+        self.retrieval_mode = retrieval_mode or RETRIEVAL_MODE
 
     def retrieve_relevant_conversation(
         self, user_message: str, limit: int = 3
@@ -537,47 +747,82 @@ class ContextRetriever:
     def _get_historical_conversations(
         self, user_message: str, limit: int
     ) -> List[Dict]:
-        """Get historically relevant context based on recency (embeddings disabled)"""
+        """Get historically relevant conversations ranked by semantic similarity"""
         try:
-            print("\n=== DEBUG: HISTORICAL CONTEXT SEARCH (EMBEDDINGS DISABLED) ===")
-
-            # DISABLED: Embedding-based retrieval
-            # query_embedding = generate_embedding(user_message)
-
-            # Get recent conversations, sorted by creation date
-            conversations = (
-                supabase_extension.client.table(self.conversations_table)
-                .select("*")
-                .order("created_at", desc=True)
-                .limit(limit)
-                .execute()
-            )
-
-            if not conversations.data:
-                return []
+            print("\n=== DEBUG: HISTORICAL CONVERSATION SEARCH ===")
+
+            query_vector = get_embedding_model().embed(user_message)
+            if self.retrieval_mode == "rpc":
+                matched = match_rows("match_conversations", query_vector, limit)
+                if matched is not None:
+                    print(f"Matched {len(matched)} historical conversations")
+                    return matched
+
+            scored = conversation_cache.search(query_vector, limit)
+            if scored is None:
+                conversations = (
+                    supabase_extension.client.table(self.conversations_table)
+                    .select("*")
+                    .order("created_at", desc=True)
+                    .limit(HISTORICAL_CANDIDATES)
+                    .execute()
+                )
+                scored = conversation_cache.score_rows(
+                    query_vector, conversations.data or [], limit
+                )
 
-            # Return most recent conversations (without semantic similarity)
-            print(f"Found {len(conversations.data)} recent historical items")
-            return conversations.data
+            print(f"Ranked {len(scored)} historical conversations")
+            return [dict(conv, similarity=similarity) for conv, _, similarity in scored]
 
         except Exception as e:
             print(f"Error getting historical context: {e}")
             return []
 
     def retrieve_relevant_context(
-        self, user_message: str, limit: int = 5
+        self, user_message: str, limit: int = 5, conversation_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """Retrieve relevant context (single conversation back and forth) based on user message"""
         try:
             print("\n=== DEBUG: RETRIEVING CONTEXT ===")
             print("User message:", user_message)
 
-            # Get recent conversations (last 24 hours)
-            recent_context = self._get_recent_context(limit)
-            print("Recent context count:", len(recent_context))
+            sources = {
+                # Recent turns of this conversation (or last 24 hours)
+                "recent_context": (
+                    self._get_recent_context,
+                    (limit, conversation_id),
+                ),
+                # Relevant historical context
+                "historical_context": (
+                    self._get_historical_context,
+                    (user_message, limit * RETRIEVAL_CANDIDATE_FACTOR),
+                ),
+            }
+            if self.retrieval_mode != "rpc":
+                # Memories sharing the message's words. BM25 lives in the memory
+                # cache, which rpc mode exists to avoid loading into every worker
+                sources["lexical_context"] = (
+                    self._get_lexical_context,
+                    (user_message, limit * RETRIEVAL_CANDIDATE_FACTOR),
+                )
 
-            # Get relevant historical context based on embedding similarity
-            historical_context = self._get_historical_context(user_message, limit)
+            # Fan out to every source at once and keep what returns in time
+            results = self._fan_out(sources)
+            recent_context = results["recent_context"] or []
+            # Drop what recent context already holds, fuse and diversify the rest
+            historical_context, timings = retrieval_pipeline.run(
+                {
+                    "dense": results["historical_context"] or [],
+                    "lexical": results.get("lexical_context") or [],
+                },
+                exclude=recent_context,
+                limit=limit,
+            )
+            print(
+                "Retrieval pipeline ms:",
+                {stage: round(ms, 2) for stage, ms in timings.items()},
+            )
+            print("Recent context count:", len(recent_context))
             print("Historical context count:", len(historical_context))
 
             # Generate conversation summary
@@ -598,8 +843,44 @@ class ContextRetriever:
                 "conversation_summary": "",
             }
 
-    def _get_recent_context(self, limit: int) -> List[Dict]:
-        """Get recent conversation context"""
+    def _fan_out(
+        self, sources: Dict[str, tuple], deadline: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Run retrieval sources concurrently; sources that miss their timeout yield None"""
+        deadline = RETRIEVAL_DEADLINE if deadline is None else deadline
+        started = time.monotonic()
+
+        futures = {
+            name: _retrieval_executor.submit(bind_app_context(fn), *args)
+            for name, (fn, args) in sources.items()
+        }
+
+        results = {}
+        for name, future in futures.items():
+            timeout = min(RETRIEVAL_SOURCE_TIMEOUTS.get(name, deadline), deadline)
+            remaining = max(0.0, timeout - (time.monotonic() - started))
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                future.cancel()
+                print(f"Retrieval source {name} missed its {timeout:.2f}s deadline")
+                results[name] = None
+            except Exception as e:
+                print(f"Retrieval source {name} failed: {e}")
+                results[name] = None
+
+        print(
+            f"Context fan-out finished in {(time.monotonic() - started) * 1000:.0f} ms"
+        )
+        return results
+
+    def _get_recent_context(
+        self, limit: int, conversation_id: Optional[str] = None
+    ) -> List[Dict]:
+        """Get recent conversation context, newest first"""
+        if conversation_id:
+            return self._get_session_context(limit, conversation_id)
+
         try:
             yesterday = datetime.now() - timedelta(days=1)
             response = (
@@ -618,115 +899,115 @@ class ContextRetriever:
             print(f"Error getting recent context: {e}")
             return []
 
-    def _get_historical_context(self, user_message: str, limit: int) -> List[Dict]:
-        """Get historically relevant context based on recency (embeddings disabled)"""
-        try:
-            print("\n=== DEBUG: HISTORICAL CONTEXT SEARCH (EMBEDDINGS DISABLED) ===")
+    def _get_session_context(self, limit: int, conversation_id: str) -> List[Dict]:
+        """Get the latest turns of one conversation from the session cache"""
+        turns = session_cache.get(conversation_id)
+        if turns is None:
+            # Cold session: one indexed query, plus this worker's turns that are
+            # still queued for writing (read first, so none is in neither place)
+            pending = write_behind_queue.pending(
+                self.memory_table, conversation_id=conversation_id
+            )
+            try:
+                response = (
+                    supabase_extension.client.table(self.memory_table)
+                    .select("*")
+                    .eq("conversation_id", conversation_id)
+                    .order("created_at", desc=True)
+                    .limit(session_cache.max_turns)
+                    .execute()
+                )
+                stored = {
+                    round(parse_timestamp(turn.get("created_at")), 3): turn
+                    for turn in response.data
+                }
+                for turn in pending:
+                    stored.setdefault(
+                        round(parse_timestamp(turn.get("created_at")), 3), turn
+                    )
+                turns = [stored[key] for key in sorted(stored)]
+                session_cache.load(conversation_id, turns)
+                print(f"Rehydrated session {conversation_id} with {len(turns)} turns")
+            except Exception as e:
+                print(f"Error rehydrating session context: {e}")
+                return []
 
-            # DISABLED: Embedding-based retrieval
-            # query_embedding = generate_embedding(user_message)
+        print("\n=== DEBUG: SESSION CONTEXT ===")
+        print(f"Found {len(turns)} cached turns")
+        return list(reversed(turns))[:limit]
 
-            # Get recent memories, sorted by creation date
-            response = (
-                supabase_extension.client.table(self.memory_table)
-                .select("*")
-                .order("created_at", desc=True)
-                .limit(limit)
-                .execute()
-            )
+    def _get_historical_context(self, user_message: str, limit: int) -> List[Dict]:
+        """Get historically relevant context ranked by semantic similarity"""
+        try:
+            print("\n=== DEBUG: HISTORICAL CONTEXT SEARCH ===")
+
+            query_vector = get_embedding_model().embed(user_message)
+            if self.retrieval_mode == "rpc":
+                matched = match_rows("match_memories", query_vector, limit)
+                if matched is not None:
+                    print(f"Matched {len(matched)} historical memories in the database")
+                    return [
+                        dict(memory, retrieval_score=memory["score"])
+                        for memory in matched
+                    ]
+
+            scored = memory_cache.search(query_vector, limit)
+            if scored is None:
+                # Cache still loading: rank the latest memories fetched directly
+                response = (
+                    supabase_extension.client.table(self.memory_table)
+                    .select("*")
+                    .order("created_at", desc=True)
+                    .limit(HISTORICAL_CANDIDATES)
+                    .execute()
+                )
+                scored = memory_cache.score_rows(
+                    query_vector, response.data or [], limit
+                )
 
-            if not response.data:
+            if not scored:
                 return []
 
-            # Return most recent memories (without semantic similarity)
-            print(f"Found {len(response.data)} recent historical items")
-            return response.data
+            results = [
+                dict(memory, similarity=similarity, retrieval_score=score)
+                for memory, score, similarity in scored
+            ]
+            print(
+                f"Returning {len(results)} historical memories "
+                f"(top similarity {results[0]['similarity']:.3f})"
+            )
+            return results
 
         except Exception as e:
             print(f"Error getting historical context: {e}")
             return []
 
-    def _extract_keywords(self, text: str) -> List[str]:
-        """Extract meaningful keywords from text"""
-        # Remove common stop words
-        stop_words = {
-            "the",
-            "a",
-            "an",
-            "and",
-            "or",
-            "but",
-            "in",
-            "on",
-            "at",
-            "to",
-            "for",
-            "of",
-            "with",
-            "by",
-            "is",
-            "are",
-            "was",
-            "were",
-            "be",
-            "been",
-            "have",
-            "has",
-            "had",
-            "do",
-            "does",
-            "did",
-            "will",
-            "would",
-            "could",
-            "should",
-            "may",
-            "might",
-            "can",
-            "this",
-            "that",
-            "these",
-            "those",
-            "i",
-            "you",
-            "he",
-            "she",
-            "it",
-            "we",
-            "they",
-            "me",
-            "him",
-            "her",
-            "us",
-            "them",
-        }
-
-        # Split into words and filter
-        words = text.split()
-        keywords = [
-            word for word in words if word.lower() not in stop_words and len(word) > 2
-        ]
-
-        return keywords[:5]  # Limit to top 5 keywords
+    def _get_lexical_context(self, user_message: str, limit: int) -> List[Dict]:
+        """Get memories matching the message's words (BM25), best first"""
+        matches = memory_cache.lexical_search(user_message, limit)
+        if not matches:
+            return []
+        print(f"Found {len(matches)} keyword matches")
+        return [dict(memory, lexical_score=score) for memory, score in matches]
 
     def _generate_summary(self, context_items: List[Dict]) -> str:
         """Generate a summary of the context"""
         if not context_items:
             return ""
 
-        # Extract topics and themes
-        topics = set()
+        # Weigh topics and each item's precomputed top terms (by rank)
+        weights = {}
         for item in context_items:
-            if item.get("conversation_topic"):
-                topics.add(item["conversation_topic"])
+            topic = item.get("conversation_topic")
+            if topic and topic != "general":
+                weights[topic] = weights.get(topic, 0.0) + 1.0
 
-            # Extract potential topics from content
-            content = f"{item.get('user_message', '')} {item.get('agent_response', '')}"
-            keywords = self._extract_keywords(content.lower())
-            topics.update(keywords)
+            for rank, term in enumerate(memory_top_terms(item)):
+                weights[term] = weights.get(term, 0.0) + 1.0 / (rank + 1)
 
         # Format summary
-        topics_list = list(topics)[:3]  # Take top 3 topics
+        ranked = sorted(weights, key=lambda topic: (-weights[topic], topic))
+        topics_list = ranked[:3]  # Take top 3 topics
         if topics_list:
             return f"Previous discussions about: {', '.join(topics_list)}"
         return ""
@@ -773,29 +1054,12 @@ class SpeechStyleRetriever:
         # Simple classification logic
         recent_context = context.get("recent_context", [])
 
-        keywords = {
-            "academic": ["research", "study", "paper", "analysis", "methodology"],
-            "technical": [
-                "code",
-                "programming",
-                "algorithm",
-                "system",
-                "implementation",
-            ],
-            "emotional": ["feel", "emotion", "sad", "happy", "excited", "worried"],
-            "casual": ["hello", "how are you", "nice", "good", "great"],
-        }
-
         # Count keyword matches
-        scores = {k: 0 for k in keywords.keys()}
+        scores = dict.fromkeys(KEYWORD_TAXONOMIES["style_type"], 0)
         for item in recent_context:
-            text = (
-                item.get("user_message", "") + " " + item.get("agent_response", "")
-            ).lower()
-            for conv_type, words in keywords.items():
-                for word in words:
-                    if word in text:
-                        scores[conv_type] += 1
+            text = item.get("user_message", "") + " " + item.get("agent_response", "")
+            for conv_type, count in keyword_matcher.match(text)["style_type"].items():
+                scores[conv_type] += count
 
         # Return type with highest score
         return (
@@ -807,16 +1071,17 @@ class SpeechStyleRetriever:
     def _get_patterns_by_type(self, conversation_type: str) -> Dict[str, Any]:
         """Get speech patterns for specific conversation type"""
         try:
-            response = (
-                supabase_extension.client.table(self.table_name)
-                .select("*")
-                .eq("conversation_type", conversation_type)
-                .order("effectiveness_score", desc=True)
-                .limit(1)
-                .execute()
+            patterns = reference_data.get(self.table_name).where(
+                conversation_type=conversation_type
+            )
+            if not patterns:
+                return {}
+            return dict(
+                max(
+                    patterns,
+                    key=lambda pattern: pattern.get("effectiveness_score") or 0.0,
+                )
             )
-
-            return response.data[0] if response.data else {}
         except Exception as e:
             print(f"Error getting patterns: {e}")
             return {}
@@ -824,17 +1089,18 @@ class SpeechStyleRetriever:
     def _get_effective_patterns(self, conversation_type: str) -> List[Dict]:
         """Get most effective patterns for conversation type"""
         try:
-            response = (
-                supabase_extension.client.table(self.table_name)
-                .select("*")
-                .eq("conversation_type", conversation_type)
-                .gte("effectiveness_score", 0.7)
-                .order("usage_count", desc=True)
-                .limit(3)
-                .execute()
+            patterns = [
+                pattern
+                for pattern in reference_data.get(self.table_name).where(
+                    conversation_type=conversation_type
+                )
+                if (pattern.get("effectiveness_score") or 0.0) >= 0.7
+            ]
+            patterns.sort(
+                key=lambda pattern: pattern.get("usage_count") or 0, reverse=True
             )
 
-            return response.data
+            return [dict(pattern) for pattern in patterns[:3]]
         except Exception as e:
             print(f"Error getting effective patterns: {e}")
             return []
@@ -893,34 +1159,29 @@ class EmotionalStateTracker:
 
     def _analyze_emotional_triggers(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze conversation for emotional triggers"""
-        try:
-            # Get all triggers
-            response = (
-                supabase_extension.client.table(self.triggers_table)
-                .select("*")
-                .execute()
-            )
+        # Check recent context for triggers
+        recent_context = context.get("recent_context", [])
+        return self.detect_triggers(
+            [
+                item.get("user_message", "") + " " + item.get("agent_response", "")
+                for item in recent_context
+            ]
+        )
 
-            triggers = response.data
-            detected_triggers = []
-
-            # Check recent context for triggers
-            recent_context = context.get("recent_context", [])
-            for item in recent_context:
-                text = (
-                    item.get("user_message", "") + " " + item.get("agent_response", "")
-                ).lower()
-
-                for trigger in triggers:
-                    if trigger["trigger_value"].lower() in text:
-                        detected_triggers.append(
-                            {
-                                "trigger": trigger["trigger_value"],
-                                "emotion": trigger["emotion_induced"],
-                                "intensity_change": trigger["intensity_change"],
-                                "confidence": trigger["confidence_score"],
-                            }
-                        )
+    def detect_triggers(self, texts: List[str]) -> Dict[str, Any]:
+        """Find emotional triggers in texts, matched against the cached trigger table"""
+        try:
+            detected_triggers = [
+                {
+                    "trigger": trigger["trigger_value"],
+                    "emotion": trigger["emotion_induced"],
+                    "intensity_change": trigger["intensity_change"],
+                    "confidence": trigger["confidence_score"],
+                }
+                for trigger in match_triggers(
+                    reference_data.get(self.triggers_table), texts
+                )
+            ]
 
             return {
                 "detected_triggers": detected_triggers,
@@ -1007,49 +1268,16 @@ class EmotionalStateTracker:
 
 
 def format_context_for_prompt(context: Dict[str, Any]) -> str:
-    """Format context data for inclusion in LLM prompt"""
+    """Format context data for inclusion in LLM prompt, within the section token budgets"""
     if not context:
         return ""
 
-    context_parts = []
-
-    # Add recent context if available
-    recent_context = context.get("recent_context", [])
-    if recent_context:
-        context_parts.append("Recent conversation context:")
-        for item in recent_context[-3:]:  # Last 3 items
-            if isinstance(item, dict):
-                user_msg = item.get("user_message", "")
-                agent_msg = item.get("agent_response", "")
-                if user_msg or agent_msg:
-                    if user_msg:
-                        context_parts.append(f"User: {user_msg}")
-                    if agent_msg:
-                        context_parts.append(f"Assistant: {agent_msg}")
-        context_parts.append("")
-
-    # Add historical context if available
-    historical_context = context.get("historical_context", [])
-    if historical_context:
-        context_parts.append("Relevant historical context:")
-        for item in historical_context[:3]:  # First 3 items
-            if isinstance(item, dict):
-                user_msg = item.get("user_message", "")
-                agent_msg = item.get("agent_response", "")
-                if user_msg or agent_msg:
-                    if user_msg:
-                        context_parts.append(f"User: {user_msg}")
-                    if agent_msg:
-                        context_parts.append(f"Charlotte: {agent_msg}")
-        context_parts.append("")
-
-    # Add summary if available
-    summary = context.get("conversation_summary", "")  # Updated key name
-    if summary:
-        context_parts.append(f"Context summary: {summary}")
-        context_parts.append("")
-
-    return "\n".join(context_parts)
+    packed = context_packer.pack(context)
+    print(
+        f"Packed context: {packed.total_tokens} tokens {packed.tokens}, "
+        f"{packed.truncated} truncated, {packed.dropped} dropped"
+    )
+    return packed.text
 
 
 class AutoObserver:
@@ -1058,80 +1286,43 @@ class AutoObserver:
     def __init__(self):
         self.observation_count = 0
 
-    def observe_conversation(self, conversation_data: List[Dict]) -> Dict[str, Any]:
+    def observe_conversation(
+        self, conversation_data: List[Dict], quality_score: Optional[float] = None
+    ) -> Dict[str, Any]:
         """Analyze conversation and return insights"""
         self.observation_count += 1
+        features = conversation_features.get(conversation_data)
 
         insights = {
-            "conversation_length": len(conversation_data),
-            "user_message_count": sum(
-                1 for msg in conversation_data if msg.get("sender") == "user"
-            ),
-            "bot_message_count": sum(
-                1 for msg in conversation_data if msg.get("sender") == "bot"
-            ),
-            "average_message_length": self._calculate_average_length(conversation_data),
-            "conversation_topics": self._extract_topics(conversation_data),
-            "emotional_tone": self._analyze_emotional_tone(conversation_data),
+            "conversation_length": features.message_count,
+            "user_message_count": features.user_message_count,
+            "bot_message_count": features.bot_message_count,
+            "average_message_length": self._calculate_average_length(features),
+            "conversation_topics": self._extract_topics(features),
+            "emotional_tone": self._analyze_emotional_tone(features),
+            "quality_score": quality_score,
             "observation_id": self.observation_count,
         }
 
         return insights
 
-    def _calculate_average_length(self, conversation_data: List[Dict]) -> float:
+    def _calculate_average_length(self, features: ConversationFeatures) -> float:
         """Calculate average message length"""
-        if not conversation_data:
-            return 0.0
-
-        total_length = sum(len(msg.get("text", "")) for msg in conversation_data)
-        return total_length / len(conversation_data)
+        return features.average_length
 
-    def _extract_topics(self, conversation_data: List[Dict]) -> List[str]:
+    def _extract_topics(self, features: ConversationFeatures) -> List[str]:
         """Extract conversation topics"""
         # Simple keyword-based topic extraction
-        text = " ".join([msg.get("text", "") for msg in conversation_data]).lower()
-
-        topics = []
-        topic_keywords = {
-            "technology": ["code", "programming", "software", "computer", "tech"],
-            "academic": ["research", "study", "paper", "analysis", "academic"],
-            "personal": ["feel", "think", "believe", "experience", "life"],
-            "casual": ["hello", "how", "nice", "good", "thanks"],
-        }
-
-        for topic, keywords in topic_keywords.items():
-            if any(keyword in text for keyword in keywords):
-                topics.append(topic)
+        topics = features.categories("observed_topic")
 
         return topics if topics else ["general"]
 
-    def _analyze_emotional_tone(self, conversation_data: List[Dict]) -> str:
+    def _analyze_emotional_tone(self, features: ConversationFeatures) -> str:
         """Analyze emotional tone of conversation"""
-        text = " ".join([msg.get("text", "") for msg in conversation_data]).lower()
-
-        positive_words = [
-            "happy",
-            "excited",
-            "great",
-            "wonderful",
-            "amazing",
-            "love",
-            "enjoy",
-        ]
-        negative_words = [
-            "sad",
-            "angry",
-            "frustrated",
-            "worried",
-            "hate",
-            "terrible",
-            "awful",
-        ]
-        neutral_words = ["okay", "fine", "alright", "neutral", "normal"]
-
-        positive_count = sum(1 for word in positive_words if word in text)
-        negative_count = sum(1 for word in negative_words if word in text)
-        neutral_count = sum(1 for word in neutral_words if word in text)
+        hits = features.keyword_hits["observed_tone"]
+        positive_count = hits["positive"]
+        negative_count = hits["negative"]
+        neutral_count = hits["neutral"]
 
         if positive_count > negative_count and positive_count > neutral_count:
             return "positive"
@@ -1186,29 +1377,29 @@ def populate_initial_data():
 def analyze_conversation_for_save(conversation_data: List[Dict]) -> Dict[str, Any]:
     """Analyze conversation and return metadata for saving"""
     try:
-        # Extract text content
-        text = " ".join([msg.get("text", "") for msg in conversation_data]).lower()
+        # Counts and keyword hits, computed once (and reused by /save)
+        features = conversation_features.get(conversation_data)
 
         # Generate title based on content
         title = _generate_title(conversation_data)
 
         # Generate description
-        description = _generate_description(conversation_data)
+        description = _generate_description(features)
 
         # Calculate quality score
-        quality_score = _calculate_quality_score(conversation_data)
+        quality_score = _calculate_quality_score(features)
 
         # Analyze conversation type
-        conversation_type = _classify_conversation_type(conversation_data)
+        conversation_type = _classify_conversation_type(features)
 
         # Extract topics
-        topics = _extract_conversation_topics(conversation_data)
+        topics = _extract_conversation_topics(features)
 
         # Analyze emotional tone
-        emotional_tone = _analyze_conversation_tone(conversation_data)
+        emotional_tone = _analyze_conversation_tone(features)
 
         # Assess conversation depth
-        conversation_depth = _assess_conversation_depth(conversation_data)
+        conversation_depth = _assess_conversation_depth(features)
 
         return {
             "title": title,
@@ -1233,75 +1424,69 @@ def analyze_conversation_for_save(conversation_data: List[Dict]) -> Dict[str, An
         }
 
 
-# DISABLED: Embedding functionality commented out to avoid large model dependency
-# def populate_embeddings_for_existing_memories():
-#     """Populate embeddings for existing memories in the database"""
-#     try:
-#         print("\n=== POPULATING EMBEDDINGS FOR EXISTING MEMORIES ===")
-#
-#         # Get all memories without embeddings from both tables
-#         memory_response = (
-#             supabase_extension.client.table("memory_stream")
-#             .select("*")
-#             .is_("embedding", "null")
-#             .execute()
-#         )
-#
-#         conversations_response = (
-#             supabase_extension.client.table("saved_conversations")
-#             .select("*")
-#             .is_("embedding", "null")
-#             .execute()
-#         )
-#
-#         updated_count = 0
-#
-#         # Update memory_stream embeddings
-#         for memory in memory_response.data:
-#             try:
-#                 # Generate embedding for the conversation context
-#                 memory_text = f"{memory.get('user_message', '')} {memory.get('agent_response', '')}"
-#                 embedding = generate_embedding(memory_text)
-#
-#                 # Update the memory with the embedding
-#                 supabase_extension.client.table("memory_stream").update(
-#                     {"embedding": embedding}
-#                 ).eq("id", memory["id"]).execute()
-#
-#                 updated_count += 1
-#                 print(f"Updated memory {memory['id']} with embedding")
-#             except Exception as e:
-#                 print(f"Error updating memory {memory['id']}: {e}")
-#                 continue
-#
-#         # Update saved_conversations embeddings
-#         for conv in conversations_response.data:
-#             try:
-#                 # Generate embedding for the entire conversation
-#                 conv_text = " ".join(
-#                     [
-#                         f"{msg.get('text', '')} {msg.get('user_message', '')} {msg.get('agent_response', '')}"
-#                         for msg in conv.get("conversation_data", [])
-#                     ]
-#                 )
-#                 embedding = generate_embedding(conv_text)
-#
-#                 # Update the conversation with the embedding
-#                 supabase_extension.client.table("saved_conversations").update(
-#                     {"embedding": embedding}
-#                 ).eq("id", conv["id"]).execute()
-#
-#                 updated_count += 1
-#                 print(f"Updated conversation {conv['id']} with embedding")
-#             except Exception as e:
-#                 print(f"Error updating conversation {conv['id']}: {e}")
-#                 continue
-#
-#         print(f"\nPopulated embeddings for {updated_count} items")
-#
-#     except Exception as e:
-#         print(f"Error populating embeddings: {e}")
-#         raise
+def populate_embeddings_for_existing_memories():
+    """Populate embeddings for existing memories in the database"""
+    try:
+        print("\n=== POPULATING EMBEDDINGS FOR EXISTING MEMORIES ===")
+
+        # Get all memories without embeddings from both tables
+        memory_response = (
+            supabase_extension.client.table("memory_stream")
+            .select("id, user_message, agent_response")
+            .is_("embedding", "null")
+            .execute()
+        )
+
+        conversations_response = (
+            supabase_extension.client.table("saved_conversations")
+            .select("id, conversation_data")
+            .is_("embedding", "null")
+            .execute()
+        )
+
+        updated_count = 0
+
+        # Update memory_stream embeddings, encoding all rows in one batch
+        memories = memory_response.data or []
+        vectors = generate_embeddings([memory_text(memory) for memory in memories])
+        for memory, vector in zip(memories, vectors):
+            try:
+                supabase_extension.client.table("memory_stream").update(
+                    {"embedding": to_pg_vector(vector)}
+                ).eq("id", memory["id"]).execute()
+
+                updated_count += 1
+                print(f"Updated memory {memory['id']} with embedding")
+            except Exception as e:
+                print(f"Error updating memory {memory['id']}: {e}")
+                continue
+
+        # Update saved_conversations embeddings
+        conversations = conversations_response.data or []
+        vectors = generate_embeddings(
+            [
+                conversation_text(conv.get("conversation_data") or [])
+                for conv in conversations
+            ]
+        )
+        for conv, vector in zip(conversations, vectors):
+            try:
+                supabase_extension.client.table("saved_conversations").update(
+                    {"embedding": to_pg_vector(vector)}
+                ).eq("id", conv["id"]).execute()
+
+                updated_count += 1
+                print(f"Updated conversation {conv['id']} with embedding")
+            except Exception as e:
+                print(f"Error updating conversation {conv['id']}: {e}")
+                continue
+
+        print(f"\nPopulated embeddings for {updated_count} items")
+        return updated_count
+
+    except Exception as e:
+        print(f"Error populating embeddings: {e}")
+        raise
 
 
 # Helper functions for conversation analysis
@@ -1325,86 +1510,51 @@ def _generate_title(conversation_data: List[Dict]) -> str:
     return f"Conversation {datetime.now().strftime('%Y-%m-%d %H:%M')}"
 
 
-def _generate_description(conversation_data: List[Dict]) -> str:
+def _generate_description(features: ConversationFeatures) -> str:
     """Generate a description for the conversation"""
-    if not conversation_data:
+    if not features.message_count:
         return "No conversation content available"
 
-    # Count messages by sender
-    user_messages = [msg for msg in conversation_data if msg.get("sender") == "user"]
-    bot_messages = [msg for msg in conversation_data if msg.get("sender") == "bot"]
-
     # Extract topics
-    topics = _extract_conversation_topics(conversation_data)
+    topics = _extract_conversation_topics(features)
 
-    description = f"Conversation with {len(user_messages)} user messages and {len(bot_messages)} responses"
+    description = f"Conversation with {features.user_message_count} user messages and {features.bot_message_count} responses"
     if topics:
         description += f" about {', '.join(topics[:3])}"
 
     return description
 
 
-def _calculate_quality_score(conversation_data: List[Dict]) -> float:
+def _calculate_quality_score(features: ConversationFeatures) -> float:
     """Calculate quality score for the conversation"""
-    if not conversation_data:
+    if not features.message_count:
         return 0.0
 
     score = 0.5  # Base score
 
     # Factors that increase score
-    if len(conversation_data) >= 4:
+    if features.message_count >= 4:
         score += 0.2  # Longer conversations
 
     # Check for meaningful content
-    total_length = sum(len(msg.get("text", "")) for msg in conversation_data)
-    if total_length > 200:
+    if features.total_length > 200:
         score += 0.1  # Substantial content
 
     # Check for balanced conversation
-    user_messages = [msg for msg in conversation_data if msg.get("sender") == "user"]
-    bot_messages = [msg for msg in conversation_data if msg.get("sender") == "bot"]
-    if len(user_messages) > 0 and len(bot_messages) > 0:
+    if features.user_message_count > 0 and features.bot_message_count > 0:
         score += 0.1  # Balanced exchange
 
     # Check for specific topics (indicates focused conversation)
-    topics = _extract_conversation_topics(conversation_data)
+    topics = _extract_conversation_topics(features)
     if len(topics) > 1:
         score += 0.1  # Multiple topics discussed
 
     return min(1.0, score)
 
 
-def _classify_conversation_type(conversation_data: List[Dict]) -> str:
+def _classify_conversation_type(features: ConversationFeatures) -> str:
     """Classify the type of conversation"""
-    text = " ".join([msg.get("text", "") for msg in conversation_data]).lower()
-
-    type_keywords = {
-        "academic": [
-            "research",
-            "study",
-            "paper",
-            "analysis",
-            "methodology",
-            "academic",
-        ],
-        "technical": ["code", "programming", "algorithm", "system", "implementation"],
-        "emotional": ["feel", "emotion", "sad", "happy", "excited", "worried"],
-        "casual": ["hello", "how are you", "nice", "good", "thanks", "thank you"],
-        "philosophical": [
-            "think",
-            "believe",
-            "philosophy",
-            "meaning",
-            "purpose",
-            "existence",
-        ],
-    }
-
-    scores = {conv_type: 0 for conv_type in type_keywords.keys()}
-    for conv_type, keywords in type_keywords.items():
-        for keyword in keywords:
-            if keyword in text:
-                scores[conv_type] += 1
+    scores = features.keyword_hits["conversation_type"]
 
     # Return the type with highest score
     if scores:
@@ -1416,53 +1566,18 @@ def _classify_conversation_type(conversation_data: List[Dict]) -> str:
     return "general"
 
 
-def _extract_conversation_topics(conversation_data: List[Dict]) -> List[str]:
+def _extract_conversation_topics(features: ConversationFeatures) -> List[str]:
     """Extract topics from conversation"""
-    text = " ".join([msg.get("text", "") for msg in conversation_data]).lower()
-
-    topics = []
-    topic_keywords = {
-        "AI": ["ai", "artificial intelligence", "machine learning", "neural network"],
-        "research": ["research", "study", "experiment", "analysis", "methodology"],
-        "technology": ["technology", "tech", "software", "computer", "digital"],
-        "philosophy": ["philosophy", "ethics", "morality", "meaning", "purpose"],
-        "personal": ["personal", "life", "experience", "feelings", "emotions"],
-        "academic": ["academic", "university", "education", "learning", "knowledge"],
-    }
-
-    for topic, keywords in topic_keywords.items():
-        if any(keyword in text for keyword in keywords):
-            topics.append(topic)
+    topics = features.categories("conversation_topic")
 
     return topics if topics else ["general"]
 
 
-def _analyze_conversation_tone(conversation_data: List[Dict]) -> str:
+def _analyze_conversation_tone(features: ConversationFeatures) -> str:
     """Analyze the emotional tone of the conversation"""
-    text = " ".join([msg.get("text", "") for msg in conversation_data]).lower()
-
-    positive_words = [
-        "happy",
-        "excited",
-        "great",
-        "wonderful",
-        "amazing",
-        "love",
-        "enjoy",
-    ]
-    negative_words = [
-        "sad",
-        "angry",
-        "frustrated",
-        "worried",
-        "hate",
-        "terrible",
-        "awful",
-        "bad",
-    ]
-
-    positive_count = sum(1 for word in positive_words if word in text)
-    negative_count = sum(1 for word in negative_words if word in text)
+    hits = features.keyword_hits["conversation_tone"]
+    positive_count = hits["positive"]
+    negative_count = hits["negative"]
 
     if positive_count > negative_count:
         return "positive"
@@ -1472,30 +1587,27 @@ def _analyze_conversation_tone(conversation_data: List[Dict]) -> str:
         return "neutral"
 
 
-def _assess_conversation_depth(conversation_data: List[Dict]) -> str:
+def _assess_conversation_depth(features: ConversationFeatures) -> str:
     """Assess the depth of the conversation"""
-    if not conversation_data:
+    if not features.message_count:
         return "shallow"
 
     # Factors indicating depth
-    total_length = sum(len(msg.get("text", "")) for msg in conversation_data)
-    avg_length = total_length / len(conversation_data)
+    avg_length = features.average_length
 
     # Check for complex topics
-    topics = _extract_conversation_topics(conversation_data)
+    topics = _extract_conversation_topics(features)
     has_complex_topics = any(
         topic in ["AI", "research", "philosophy", "academic"] for topic in topics
     )
 
     # Check for longer messages (indicating thoughtful responses)
-    long_messages = sum(
-        1 for msg in conversation_data if len(msg.get("text", "")) > 100
-    )
+    long_messages = features.long_message_count
 
     if (
         avg_length > 80
         and has_complex_topics
-        and long_messages > len(conversation_data) / 2
+        and long_messages > features.message_count / 2
     ):
         return "deep"
     elif avg_length > 50 or has_complex_topics:
@@ -0,0 +1,253 @@
+import os
+import tempfile
+import math
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import numpy as np
+from app.utils.text_processing import tokenize
+
+# Bump when the persisted layout or the tokenizer changes
+BM25_FORMAT_VERSION = 2
+
+
+class BM25Index:
+    """Incremental Okapi BM25 inverted index.
+
+    Documents are numbered in insertion order (like MemoryIndex) so ids line
+    up with ColumnarStore positions. Postings are per-term id/frequency lists;
+    a query only touches the postings of its own terms. Removed documents are
+    tombstoned: never returned, but (as in Lucene) still counted in document
+    frequencies until the index is rebuilt or reloaded.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}  # term -> ([doc ids], [term frequencies])
+        self._arrays = {}  # term -> cached (ids, tfs) arrays
+        self._size = 0
+        self._doc_lengths = np.zeros(1024, dtype=np.float32)
+        self._alive = np.zeros(1024, dtype=bool)
+        self._live_count = 0
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._live_count
+
+    def add(self, texts: Sequence[str]) -> None:
+        self.add_tokens([tokenize(text or "") for text in texts])
+
+    def add_tokens(self, documents: Sequence[List[str]]) -> None:
+        with self._lock:
+            for tokens in documents:
+                if self._size == len(self._alive):
+                    self._doc_lengths = _grown(self._doc_lengths)
+                    self._alive = _grown(self._alive)
+                self._size += 1
+                self._index(self._size - 1, tokens)
+
+    def remove(self, ids: Sequence[int]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                doc_id = int(doc_id)
+                if not (0 <= doc_id < self._size) or not self._alive[doc_id]:
+                    continue
+                self._alive[doc_id] = False
+                self._live_count -= 1
+                self._total_length -= self._doc_lengths[doc_id]
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, scores) of the k best-matching live documents, best first"""
+        terms = set(tokenize(query or ""))
+        with self._lock:
+            if not terms or not self._live_count:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            n = self._live_count
+            average_length = self._total_length / n or 1.0
+            doc_lengths, alive = self._doc_lengths, self._alive
+            matched = [
+                self._postings_arrays(term) for term in terms if term in self._postings
+            ]
+        if not matched:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        all_ids, all_scores = [], []
+        for ids, tfs in matched:
+            df = min(len(ids), n)
+            idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * doc_lengths[ids] / average_length)
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+        ids = np.concatenate(all_ids)
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        scores[~alive[unique_ids]] = 0.0
+
+        k = min(k, int((scores > 0).sum()))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(k)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return unique_ids[top], scores[top].astype(np.float32)
+
+    def top_terms(self, text: str, limit: int) -> List[str]:
+        """The limit terms of text with the highest TF-IDF against the indexed documents.
+
+        Ties break alphabetically so the result is deterministic. With nothing
+        indexed every idf is 1 and terms rank by frequency alone.
+        """
+        counts = Counter(tokenize(text or ""))
+        if not counts:
+            return []
+        with self._lock:
+            # Same document count as the postings, which keep tombstoned documents
+            n = self._size
+            df = {
+                term: len(self._postings[term][0]) if term in self._postings else 0
+                for term in counts
+            }
+        total = sum(counts.values())
+        scores = {
+            term: count / total * (math.log((1.0 + n) / (1.0 + df[term])) + 1.0)
+            for term, count in counts.items()
+        }
+        return sorted(scores, key=lambda term: (-scores[term], term))[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "documents": self._live_count,
+                "terms": len(self._postings),
+                "tombstones": self._size - self._live_count,
+            }
+
+    def save(self, path: str, keys: List[Any]) -> None:
+        """Persist the postings; keys[i] identifies document i (e.g. its row id)"""
+        with self._lock:
+            terms = list(self._postings)
+            lengths = [len(self._postings[term][0]) for term in terms]
+            ids = [doc_id for term in terms for doc_id in self._postings[term][0]]
+            tfs = [tf for term in terms for tf in self._postings[term][1]]
+            doc_lengths = self._doc_lengths[: self._size].astype(np.int32)
+            alive = self._alive[: self._size].copy()
+        # Postings are stored CSR-style: term t owns ids/tfs[offsets[t]:offsets[t + 1]]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # A unique temp file, so workers saving at once never share one
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".", suffix=".npz"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    version=np.array(BM25_FORMAT_VERSION),
+                    params=np.array([self.k1, self.b], dtype=np.float64),
+                    keys=np.array(
+                        [str(key) if key is not None else "" for key in keys]
+                    ),
+                    has_key=np.array([key is not None for key in keys], dtype=bool),
+                    terms=np.array(terms, dtype=str),
+                    offsets=offsets,
+                    ids=np.array(ids, dtype=np.int32),
+                    tfs=np.array(tfs, dtype=np.int32),
+                    doc_lengths=doc_lengths,
+                    alive=alive,
+                )
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str, keys: List[Any]) -> Tuple["BM25Index", List[int]]:
+        """Rebuild an index whose document i is keys[i] from persisted postings.
+
+        Returns the index and the positions of keys that were not persisted
+        (new rows), which are left empty for the caller to fill(). Persisted
+        documents that are no longer in keys are dropped.
+        """
+        with np.load(path) as data:
+            if "version" not in data or int(data["version"]) != BM25_FORMAT_VERSION:
+                raise ValueError("Incompatible BM25 index format")
+            state = {name: data[name] for name in data.files}
+
+        position_of = {str(key): i for i, key in enumerate(keys) if key is not None}
+        # Old document id -> new position, or -1 if the row is gone or tombstoned
+        mapping = np.array(
+            [
+                position_of.get(key, -1) if has_key and alive else -1
+                for key, has_key, alive in zip(
+                    state["keys"].tolist(), state["has_key"], state["alive"]
+                )
+            ],
+            dtype=np.int64,
+        )
+
+        k1, b = state["params"].tolist()
+        index = cls(k1=k1, b=b)
+        doc_lengths = np.zeros(max(1, len(keys)), dtype=np.float32)
+        covered = np.zeros(max(1, len(keys)), dtype=bool)
+        kept = mapping >= 0
+        doc_lengths[mapping[kept]] = state["doc_lengths"][kept]
+        covered[mapping[kept]] = True
+
+        offsets, all_ids, all_tfs = state["offsets"], state["ids"], state["tfs"]
+        for t, term in enumerate(state["terms"].tolist()):
+            ids = all_ids[offsets[t] : offsets[t + 1]]
+            tfs = all_tfs[offsets[t] : offsets[t + 1]]
+            new_ids = mapping[ids]
+            keep = new_ids >= 0
+            if not keep.any():
+                continue
+            order = np.argsort(new_ids[keep], kind="stable")
+            index._postings[term] = (
+                new_ids[keep][order].tolist(),
+                tfs[keep][order].tolist(),
+            )
+
+        index._size = len(keys)
+        index._doc_lengths = doc_lengths
+        index._alive = covered
+        index._live_count = int(covered.sum())
+        index._total_length = int(doc_lengths.sum())
+        return index, np.flatnonzero(~covered[: len(keys)]).tolist()
+
+    def fill(self, doc_id: int, text: str) -> None:
+        """Index text for a document id left empty by load()"""
+        with self._lock:
+            if self._alive[doc_id] or self._doc_lengths[doc_id]:
+                return
+            self._index(doc_id, tokenize(text or ""))
+
+    def _postings_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            ids, tfs = self._postings[term]
+            arrays = (
+                np.asarray(ids, dtype=np.int64),
+                np.asarray(tfs, dtype=np.float32),
+            )
+            self._arrays[term] = arrays
+        return arrays
+
+    def _index(self, doc_id: int, tokens: List[str]) -> None:
+        for term, tf in Counter(tokens).items():
+            ids, tfs = self._postings.setdefault(term, ([], []))
+            ids.append(doc_id)
+            tfs.append(tf)
+            self._arrays.pop(term, None)
+        self._doc_lengths[doc_id] = len(tokens)
+        self._alive[doc_id] = True
+        self._live_count += 1
+        self._total_length += len(tokens)
+
+
+def _grown(array: np.ndarray) -> np.ndarray:
+    grown = np.zeros(2 * len(array), dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
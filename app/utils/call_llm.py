@@ -6,33 +6,37 @@ from app.utils.agent_components import (
     ContextRetriever,
     format_context_for_prompt,
 )
+from app.utils.response_cache import response_cache, fingerprint_context
+from app.utils.context_packer import context_packer
+from app.utils.llm_router import LLMRouter, Provider
+import os
 import json
 import re
+import threading
 
-client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
-client_openai = OpenAI(api_key=OPENAI_API_KEY, base_url="https://api.openai.com/v1")
+client = OpenAI(
+    api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com", timeout=60.0
+)
+client_openai = OpenAI(
+    api_key=OPENAI_API_KEY, base_url="https://api.openai.com/v1", timeout=60.0
+)
 
+# DeepSeek is preferred; OpenAI serves hedged and failover requests
+llm_router = LLMRouter(
+    [
+        Provider("deepseek", client, "deepseek-chat"),
+        Provider(
+            "openai", client_openai, os.environ.get("OPENAI_CHAT_MODEL", "gpt-4o-mini")
+        ),
+    ],
+    hedging=os.environ.get("LLM_HEDGING", "1") != "0",
+)
 
-def deepseek_request(
-    user_message: str,
-    prompt: str = "You are a helpful assistant.",  # Prompt for task definition.
-    model: str = "deepseek-chat",
-    max_tokens: int = 1500,
-) -> dict:
-    """System prompt for character definition."""
-    instruction = "You are going to roleplay as Charlotte. Keep your response short, concise, and casual. Follow the content and response style in the appeneded context and extra information. Avoid using dash or emoji."
-    more_info = read_txt_file_from_directory()
 
-    # Get relevant context from database
-    context_retriever = ContextRetriever()
-    context = context_retriever.retrieve_relevant_context(user_message)
-    context_prompt = format_context_for_prompt(context)
-
-    # Combine prompts
-    system_prompt = instruction + "\n\n" + context_prompt + "\n\n" + more_info
+INSTRUCTION = "You are going to roleplay as Charlotte. Keep your response short, concise, and casual. Follow the content and response style in the appeneded context and extra information. Avoid using dash or emoji."
 
-    # Add emotional state instruction to the prompt
-    emotional_instruction = """
+# Emotional state instruction appended to the prompt
+EMOTIONAL_INSTRUCTION = """
     
     IMPORTANT: At the end of your response, include your current emotional state in this exact format:
     [EMOTION: emotion_name]
@@ -45,64 +49,264 @@ def deepseek_request(
     Valid emotions: nervous, sad, happy, calm, excited, angry, relaxed, fearful, enthusiastic, satisfied, bored, lonely
     """
 
-    final_prompt = system_prompt + emotional_instruction
-    print("\n=== DEBUG: FINAL PROMPT ===")
-    print(final_prompt)
+prompt_registry = PromptRegistry()
+
+# Pre-assembled static prefix, keyed by the persona content hash
+_static_prefix_cache = {}
+
+# Running totals of provider-side prompt cache usage
+_prompt_cache_stats = {
+    "requests": 0,
+    "prompt_tokens": 0,
+    "cache_hit_tokens": 0,
+    "cache_miss_tokens": 0,
+}
+_prompt_cache_stats_lock = threading.Lock()
+
+
+def _get_static_prefix() -> str:
+    """Return the byte-stable system prompt shared by every request.
+
+    The provider caches prompts by prefix, so everything that does not change per
+    turn (instruction, persona, emotion instructions) lives here and per-turn context
+    is sent after it as a separate message.
+    """
+    more_info, version = prompt_registry.get_with_version("charlotte.txt")
+    prefix = _static_prefix_cache.get(version)
+    if prefix is None:
+        more_info = context_packer.pack_persona(more_info)
+        prefix = INSTRUCTION + "\n\n" + more_info + EMOTIONAL_INSTRUCTION
+        _static_prefix_cache.clear()
+        _static_prefix_cache[version] = prefix
+    return prefix
+
+
+def _build_messages(user_message: str, conversation_id: str = None) -> list:
+    """Lay out the chat messages: static prefix first, dynamic context last"""
+    messages = [{"role": "system", "content": _get_static_prefix()}]
+
+    # Get relevant context from database
+    context_retriever = ContextRetriever()
+    context = context_retriever.retrieve_relevant_context(
+        user_message, conversation_id=conversation_id
+    )
+    context_prompt = format_context_for_prompt(context)
+
+    if context_prompt.strip():
+        messages.append(
+            {
+                "role": "system",
+                "content": "Context for this conversation turn:\n\n" + context_prompt,
+            }
+        )
+    messages.append({"role": "user", "content": user_message})
+
+    print("\n=== DEBUG: CONTEXT PROMPT ===")
+    print(context_prompt)
     print("\n=== DEBUG: USER MESSAGE ===")
     print(user_message)
 
+    return messages
+
+
+def _context_fingerprint(messages: list) -> str:
+    """Fingerprint of everything injected ahead of the user message"""
+    return fingerprint_context(*(message["content"] for message in messages[:-1]))
+
+
+def _record_prompt_cache_usage(usage) -> dict:
+    """Extract prompt cache hit/miss tokens from an API usage object and add them to the totals"""
+    if usage is None:
+        return {}
+
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    # DeepSeek reports hits and misses directly
+    hit_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+    miss_tokens = getattr(usage, "prompt_cache_miss_tokens", None)
+    if hit_tokens is None:
+        # OpenAI reports cached tokens under prompt_tokens_details
+        details = getattr(usage, "prompt_tokens_details", None)
+        hit_tokens = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        miss_tokens = prompt_tokens - hit_tokens
+    hit_tokens = hit_tokens or 0
+    miss_tokens = miss_tokens or 0
+
+    with _prompt_cache_stats_lock:
+        _prompt_cache_stats["requests"] += 1
+        _prompt_cache_stats["prompt_tokens"] += prompt_tokens
+        _prompt_cache_stats["cache_hit_tokens"] += hit_tokens
+        _prompt_cache_stats["cache_miss_tokens"] += miss_tokens
+
+    usage_data = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cache_hit_tokens": hit_tokens,
+        "cache_miss_tokens": miss_tokens,
+    }
+    print("\n=== DEBUG: PROMPT CACHE USAGE ===")
+    print(usage_data)
+    return usage_data
+
+
+def get_prompt_cache_stats() -> dict:
+    """Cumulative provider-side prompt cache usage for this process"""
+    with _prompt_cache_stats_lock:
+        stats = dict(_prompt_cache_stats)
+    total = stats["cache_hit_tokens"] + stats["cache_miss_tokens"]
+    stats["hit_rate"] = stats["cache_hit_tokens"] / total if total else 0.0
+    return stats
+
+
+def _finalize_response(response_content: str) -> dict:
+    """Split a raw completion into the clean reply and its emotional state"""
+    # Check if response content exists
+    if not response_content:
+        print("DEBUG: No response content generated")
+        return {
+            "reply": "No response generated",
+            "emotion": "neutral",
+            "intensity": 0.5,
+        }
+
+    # Parse emotional state from response
+    emotion_data = parse_emotional_state(response_content)
+    print("\n=== DEBUG: PARSED EMOTION DATA ===")
+    print(emotion_data)
+
+    # Remove emotional state markers from the response
+    clean_response = remove_emotional_markers(response_content)
+    print("\n=== DEBUG: CLEAN RESPONSE ===")
+    print(clean_response)
+
+    return {
+        "reply": clean_response,
+        "emotion": emotion_data["emotion"],
+        "intensity": emotion_data["intensity"],
+    }
+
+
+def deepseek_request(
+    user_message: str,
+    prompt: str = "You are a helpful assistant.",  # Prompt for task definition.
+    model: str = "deepseek-chat",
+    max_tokens: int = 1500,
+    conversation_id: str = None,
+) -> dict:
+    """System prompt for character definition."""
+    messages = _build_messages(user_message, conversation_id)
+    fingerprint = _context_fingerprint(messages)
+
+    # Repeated openers under the same context reuse an earlier completion
+    cached_content = response_cache.get(user_message, fingerprint)
+    if cached_content is not None:
+        print("\n=== DEBUG: RESPONSE CACHE HIT ===")
+        return {**_finalize_response(cached_content), "usage": {}}
+
     """Make a request to LLM with a system prompt."""
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": final_prompt},
-                {"role": "user", "content": user_message},
-            ],
-            stream=False,
+        # Get the response content from whichever provider answers first
+        response_content, usage = llm_router.complete(
+            messages,
+            stream_options={"include_usage": True},
             max_tokens=max_tokens,
             temperature=0.1,
         )
 
-        # Get the response content
-        response_content = response.choices[0].message.content
-
         print("\n=== DEBUG: RAW RESPONSE ===")
         print(response_content)
 
-        # Check if response content exists
-        if not response_content:
-            print("DEBUG: No response content generated")
-            return {
-                "reply": "No response generated",
-                "emotion": "neutral",
-                "intensity": 0.5,
-            }
-
-        # Parse emotional state from response
-        emotion_data = parse_emotional_state(response_content)
-        print("\n=== DEBUG: PARSED EMOTION DATA ===")
-        print(emotion_data)
+        usage = _record_prompt_cache_usage(usage)
+        response_cache.put(user_message, fingerprint, response_content)
 
-        # Remove emotional state markers from the response
-        clean_response = remove_emotional_markers(response_content)
-        print("\n=== DEBUG: CLEAN RESPONSE ===")
-        print(clean_response)
+        return {**_finalize_response(response_content), "usage": usage}
 
+    except Exception as e:
+        print(f"\n=== DEBUG: ERROR IN DEEPSEEK REQUEST ===")
+        print(f"Error: {str(e)}")
         return {
-            "reply": clean_response,
-            "emotion": emotion_data["emotion"],
-            "intensity": emotion_data["intensity"],
+            "reply": f"GENERATION ERROR: {str(e)}",
+            "emotion": "neutral",
+            "intensity": 0.5,
+        }
+
+
+def deepseek_request_stream(
+    user_message: str,
+    prompt: str = "You are a helpful assistant.",
+    model: str = "deepseek-chat",
+    max_tokens: int = 1500,
+    conversation_id: str = None,
+):
+    """Streaming counterpart of deepseek_request.
+
+    Yields {"type": "token", "text": ...} events as the completion arrives, holding
+    back only the trailing [EMOTION]/[INTENSITY] block, then a final
+    {"type": "done", "reply", "emotion", "intensity"} event with the clean reply.
+    Closing the generator early (e.g. the client disconnected) aborts the LLM call.
+    """
+    messages = _build_messages(user_message, conversation_id)
+    fingerprint = _context_fingerprint(messages)
+
+    cached_content = response_cache.get(user_message, fingerprint)
+    if cached_content is not None:
+        print("\n=== DEBUG: RESPONSE CACHE HIT ===")
+        result = _finalize_response(cached_content)
+        yield {"type": "token", "text": result["reply"]}
+        yield {"type": "done", **result, "usage": {}}
+        return
+
+    marker_filter = EmotionMarkerFilter()
+    usage = None
+    stream = None
+
+    try:
+        stream = llm_router.stream(
+            messages,
+            stream_options={"include_usage": True},
+            max_tokens=max_tokens,
+            temperature=0.1,
+        )
+
+        for chunk in stream:
+            # The usage-only chunk at the end of the stream has no choices
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            text = marker_filter.feed(delta)
+            if text:
+                yield {"type": "token", "text": text}
+
+        tail = marker_filter.finish()
+        if tail:
+            yield {"type": "token", "text": tail}
+
+        print("\n=== DEBUG: RAW STREAMED RESPONSE ===")
+        print(marker_filter.raw)
+        response_cache.put(user_message, fingerprint, marker_filter.raw)
+
+        yield {
+            "type": "done",
+            **_finalize_response(marker_filter.raw),
+            "usage": _record_prompt_cache_usage(usage),
         }
 
     except Exception as e:
-        print(f"\n=== DEBUG: ERROR IN DEEPSEEK REQUEST ===")
+        print(f"\n=== DEBUG: ERROR IN DEEPSEEK STREAM ===")
         print(f"Error: {str(e)}")
-        return {
+        yield {
+            "type": "done",
             "reply": f"GENERATION ERROR: {str(e)}",
             "emotion": "neutral",
             "intensity": 0.5,
         }
+    finally:
+        # Closing the router stream cancels the in-flight provider requests
+        if stream is not None:
+            stream.close()
 
 
 def parse_emotional_state(response: str) -> dict:
@@ -192,3 +396,58 @@ def remove_emotional_markers(response: str) -> str:
     response = response.strip()
 
     return response
+
+
+# Markers the model appends after its reply; see the emotional instruction above
+_MARKER_PREFIXES = ("[EMOTION:", "[INTENSITY:")
+
+
+class EmotionMarkerFilter:
+    """Incrementally strips emotional state markers from a streamed response.
+
+    Text is forwarded as soon as it cannot be the start of a marker. Once a marker
+    begins, everything after it is held back and only released (cleaned) by finish().
+    """
+
+    def __init__(self):
+        self.raw = ""  # Full raw completion, markers included
+        self._emitted = 0  # Length of raw already forwarded
+        self._holding = False  # A marker has started
+
+    def feed(self, text: str) -> str:
+        """Add a streamed chunk and return the part that is safe to show"""
+        self.raw += text
+        if self._holding:
+            return ""
+
+        pending = self.raw[self._emitted :]
+        safe_length = self._safe_length(pending)
+        self._emitted += safe_length
+        return pending[:safe_length]
+
+    def finish(self) -> str:
+        """Return any held-back text that turned out not to be a marker"""
+        tail = self.raw[self._emitted :]
+        self._emitted = len(self.raw)
+        cleaned = remove_emotional_markers(tail)
+        if not cleaned:
+            return ""
+        leading_whitespace = tail[: len(tail) - len(tail.lstrip())]
+        return leading_whitespace + cleaned
+
+    def _safe_length(self, pending: str) -> int:
+        """Length of the pending prefix that cannot belong to a marker"""
+        upper = pending.upper()
+        index = upper.find("[")
+        while index != -1:
+            candidate = upper[index:]
+            if candidate.startswith(_MARKER_PREFIXES):
+                self._holding = True
+                return len(pending[:index].rstrip())
+            if any(prefix.startswith(candidate) for prefix in _MARKER_PREFIXES):
+                # Could still become a marker once more tokens arrive
+                return len(pending[:index].rstrip())
+            index = upper.find("[", index + 1)
+
+        # Hold trailing whitespace so the reply never ends with a dangling newline
+        return len(pending.rstrip())
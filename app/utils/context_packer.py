@@ -0,0 +1,226 @@
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+# Token budget per prompt section; items beyond a budget are truncated or dropped
+DEFAULT_TOKEN_BUDGETS = {
+    "persona": 1500,
+    "recent": 450,
+    "historical": 450,
+    "conversations": 500,
+    "summary": 60,
+}
+
+# Longest a single message may be inside the context, in tokens
+MAX_MESSAGE_TOKENS = 160
+
+# Words, numbers and individual punctuation marks
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local estimate of the number of BPE tokens in text.
+
+    Each punctuation mark counts as one token and each word as one token per
+    started 6 characters, which tracks common tokenizers closely enough to budget with.
+    """
+    if not text:
+        return 0
+    return sum(1 + (len(piece) - 1) // 6 for piece in _TOKEN_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text at a word boundary so that it fits within max_tokens"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    used = 0
+    end = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        cost = 1 + (len(match.group()) - 1) // 6
+        if used + cost > max_tokens - 3:  # Leave room for the ellipsis
+            break
+        used += cost
+        end = match.end()
+    return text[:end].rstrip() + "..."
+
+
+class PackedContext:
+    """Result of packing context sections into the prompt"""
+
+    def __init__(self, text: str, tokens: Dict[str, int], dropped: int, truncated: int):
+        self.text = text
+        self.tokens = tokens  # Section name -> packed token count
+        self.dropped = dropped  # Items left out because their section was full
+        self.truncated = truncated  # Items shortened to fit
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.tokens.values())
+
+
+class ContextPacker:
+    """Fits retrieved context into a fixed token budget per prompt section.
+
+    Items are taken in priority order; an item that does not fit is shortened if
+    enough budget remains, otherwise it and everything after it are dropped.
+    """
+
+    def __init__(
+        self,
+        budgets: Optional[Dict[str, int]] = None,
+        max_message_tokens: int = MAX_MESSAGE_TOKENS,
+        min_item_tokens: int = 24,
+    ):
+        self.budgets = dict(DEFAULT_TOKEN_BUDGETS)
+        if budgets:
+            self.budgets.update(budgets)
+        self.max_message_tokens = max_message_tokens
+        self.min_item_tokens = min_item_tokens
+        self._lock = threading.Lock()
+        self._stats = {
+            "packs": 0,
+            "total_tokens": 0,
+            "max_tokens": 0,
+            "dropped_items": 0,
+            "truncated_items": 0,
+        }
+
+    def pack_persona(self, persona: str) -> str:
+        """Bound the static persona text (deterministic, so the prompt prefix stays stable)"""
+        return truncate_to_tokens(persona, self.budgets["persona"])
+
+    def pack_section(
+        self, section: str, items: List[List[Tuple[str, str]]]
+    ) -> Tuple[List[List[str]], int, int, int]:
+        """Pack items (each a list of (speaker, text) lines) in priority order.
+
+        Returns the packed items as lists of lines, tokens used, items dropped and
+        items truncated.
+        """
+        budget = self.budgets.get(section, 0)
+        packed, used, dropped, truncated = [], 0, 0, 0
+
+        items = [item for item in items if any(text for _, text in item)]
+        for index, item in enumerate(items):
+            remaining = budget - used
+            if remaining < self.min_item_tokens:
+                dropped += len(items) - index
+                break
+
+            lines, item_tokens, was_truncated = self._pack_item(item, remaining)
+            if not lines:
+                dropped += len(items) - index
+                break
+
+            packed.append(lines)
+            used += item_tokens
+            truncated += was_truncated
+
+        return packed, used, dropped, truncated
+
+    def pack(self, context: Dict[str, Any]) -> PackedContext:
+        """Format and pack a retrieved context dict into prompt text"""
+        context_parts = []
+        tokens, dropped, truncated = {}, 0, 0
+
+        # Recent context: newest turns have priority, shown oldest first
+        recent_items = [
+            [
+                ("User", item.get("user_message", "")),
+                ("Assistant", item.get("agent_response", "")),
+            ]
+            for item in context.get("recent_context", [])
+            if isinstance(item, dict)
+        ]
+        packed_items, tokens["recent"], d, t = self.pack_section("recent", recent_items)
+        dropped, truncated = dropped + d, truncated + t
+        if packed_items:
+            context_parts.append("Recent conversation context:")
+            for lines in reversed(packed_items):
+                context_parts.extend(lines)
+            context_parts.append("")
+
+        # Historical context: keep retrieval rank order
+        historical_items = [
+            [
+                ("User", item.get("user_message", "")),
+                ("Charlotte", item.get("agent_response", "")),
+            ]
+            for item in context.get("historical_context", [])
+            if isinstance(item, dict)
+        ]
+        packed_items, tokens["historical"], d, t = self.pack_section(
+            "historical", historical_items
+        )
+        dropped, truncated = dropped + d, truncated + t
+        if packed_items:
+            context_parts.append("Relevant historical context:")
+            for lines in packed_items:
+                context_parts.extend(lines)
+            context_parts.append("")
+
+        summary = context.get("conversation_summary", "")
+        if summary:
+            summary = truncate_to_tokens(summary, self.budgets["summary"])
+            tokens["summary"] = estimate_tokens(summary)
+            context_parts.append(f"Context summary: {summary}")
+            context_parts.append("")
+
+        packed = PackedContext("\n".join(context_parts), tokens, dropped, truncated)
+        self._record(packed)
+        return packed
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_tokens"] = (
+            stats["total_tokens"] / stats["packs"] if stats["packs"] else 0.0
+        )
+        stats["budgets"] = dict(self.budgets)
+        return stats
+
+    def _pack_item(
+        self, item: List[Tuple[str, str]], remaining: int
+    ) -> Tuple[List[str], int, bool]:
+        """Format one item, shortening its messages to fit the remaining budget"""
+        messages = [(speaker, text) for speaker, text in item if text]
+        if not messages:
+            return [], 0, False
+
+        # Short messages take only what they need; the rest is shared by longer ones
+        fitted_texts = [None] * len(messages)
+        order = sorted(range(len(messages)), key=lambda k: len(messages[k][1]))
+        budget_left, was_truncated = remaining, False
+        for position, index in enumerate(order):
+            speaker, text = messages[index]
+            share = budget_left // (len(order) - position)
+            allowance = min(self.max_message_tokens, share) - estimate_tokens(
+                f"{speaker}:"
+            )
+            fitted = truncate_to_tokens(text, allowance)
+            if not fitted:
+                return [], 0, False
+            was_truncated = was_truncated or fitted != text
+            fitted_texts[index] = fitted
+            budget_left -= estimate_tokens(f"{speaker}: {fitted}")
+
+        lines = [
+            f"{speaker}: {fitted}"
+            for (speaker, _), fitted in zip(messages, fitted_texts)
+        ]
+        return lines, remaining - budget_left, was_truncated
+
+    def _record(self, packed: PackedContext) -> None:
+        total = packed.total_tokens
+        with self._lock:
+            self._stats["packs"] += 1
+            self._stats["total_tokens"] += total
+            self._stats["max_tokens"] = max(self._stats["max_tokens"], total)
+            self._stats["dropped_items"] += packed.dropped
+            self._stats["truncated_items"] += packed.truncated
+
+
+context_packer = ContextPacker()
@@ -0,0 +1,106 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any
+from app.utils.context_packer import estimate_tokens
+from app.utils.keyword_matcher import KeywordMatcher
+
+# Messages longer than this (in characters) count as long, thoughtful ones
+LONG_MESSAGE_LENGTH = 100
+
+
+def conversation_hash(conversation_data: List[Dict]) -> str:
+    """Fingerprint of a conversation's senders and texts (timestamps are ignored)"""
+    digest = hashlib.sha1()
+    for msg in conversation_data:
+        digest.update(str(msg.get("sender", "")).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(str(msg.get("text", "")).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ConversationFeatures:
+    """Counts, lengths and keyword hits of a conversation, computed in one pass.
+
+    Each message is tokenized and matched once; the conversation-wide keyword
+    hits are the union of the messages' keywords, and bot messages keep their
+    own response_emotion hits for the emotional arc.
+    """
+
+    def __init__(self, conversation_data: List[Dict], matcher: KeywordMatcher):
+        self.message_count = len(conversation_data)
+        self.user_message_count = 0
+        self.bot_message_count = 0
+        self.total_length = 0
+        self.long_message_count = 0
+        self.token_count = 0
+        self.response_emotions = []  # response_emotion hits per bot message
+
+        keywords = set()
+        for msg in conversation_data:
+            text = msg.get("text", "")
+            sender = msg.get("sender")
+            if sender == "user":
+                self.user_message_count += 1
+            elif sender == "bot":
+                self.bot_message_count += 1
+            self.total_length += len(text)
+            if len(text) > LONG_MESSAGE_LENGTH:
+                self.long_message_count += 1
+            self.token_count += estimate_tokens(text)
+
+            found = matcher.keywords(text)
+            keywords |= found
+            if sender == "bot":
+                self.response_emotions.append(matcher.count(found)["response_emotion"])
+
+        self.average_length = (
+            self.total_length / self.message_count if self.message_count else 0.0
+        )
+        self.keyword_hits = matcher.count(keywords)
+
+    def categories(self, taxonomy: str) -> List[str]:
+        """Categories of taxonomy with at least one keyword hit, in taxonomy order"""
+        return [
+            category for category, count in self.keyword_hits[taxonomy].items() if count
+        ]
+
+
+class ConversationFeatureCache:
+    """LRU cache of ConversationFeatures keyed by conversation_hash"""
+
+    def __init__(self, matcher: KeywordMatcher, max_entries: int = 256):
+        self.matcher = matcher
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # conversation hash -> ConversationFeatures
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, conversation_data: List[Dict]) -> ConversationFeatures:
+        key = conversation_hash(conversation_data)
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return features
+            self._stats["misses"] += 1
+
+        # Computed outside the lock; a concurrent miss on the same key is harmless
+        features = ConversationFeatures(conversation_data, self.matcher)
+        with self._lock:
+            self._entries[key] = features
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return features
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,192 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import List, Dict, Any, Sequence
+import numpy as np
+from app.utils.embeddings import EmbeddingBackend
+
+# Upper bound on cached vectors; least recently used ones are evicted beyond it
+# (768 float32 dimensions is ~3KB per entry)
+EMBEDDING_CACHE_MAX_ENTRIES = int(
+    os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000")
+)
+# Fraction of max_entries kept after an eviction, so eviction runs in batches
+EVICTION_TARGET = 0.9
+# SQLite bound-parameter limit is 999 on older builds
+_MAX_PARAMS = 900
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a text for cache keys: NFC, collapsed whitespace"""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def cache_key(model_id: str, text: str) -> str:
+    return hashlib.sha256(
+        f"{model_id}\0{normalize_text(text)}".encode("utf-8")
+    ).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk embedding store keyed by (model id, SHA-256 of the normalized text).
+
+    Backed by SQLite in WAL mode, so the app and the backfill script can share
+    one file from several processes. Entries carry a last-used timestamp and the
+    least recently used are evicted once max_entries is exceeded. Vectors of a
+    different model id never match, so switching models only encodes misses.
+    """
+
+    def __init__(self, path: str, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model_id TEXT NOT NULL, dim INTEGER NOT NULL, "
+            "vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[
+            0
+        ]
+
+    def get_many(self, model_id: str, dim: int, texts: Sequence[str]) -> List:
+        """Cached vectors for texts, None where missing; marks hits as used"""
+        keys = [cache_key(model_id, text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                chunk = list(set(keys[start : start + _MAX_PARAMS]))
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings "
+                    f"WHERE key IN ({placeholders}) AND dim = ?",
+                    chunk + [dim],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+
+            results = [
+                np.frombuffer(found[key], dtype=np.float32) if key in found else None
+                for key in keys
+            ]
+            hits = sum(vector is not None for vector in results)
+            self._stats["hits"] += hits
+            self._stats["misses"] += len(keys) - hits
+        return results
+
+    def put_many(
+        self, model_id: str, texts: Sequence[str], vectors: np.ndarray
+    ) -> None:
+        now = time.time()
+        rows = [
+            (
+                cache_key(model_id, text),
+                model_id,
+                len(vector),
+                np.asarray(vector, dtype=np.float32).tobytes(),
+                now,
+            )
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings "
+                "(key, model_id, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._stats["writes"] += len(rows)
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._count
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _evict(self) -> None:
+        # Other processes write the same file, so recount before evicting
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[
+            0
+        ]
+        excess = self._count - int(self.max_entries * EVICTION_TARGET)
+        if self._count <= self.max_entries or excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._conn.commit()
+        self._count -= excess
+        self._stats["evictions"] += excess
+        print(f"Evicted {excess} least recently used cached embeddings")
+
+
+class CachedEmbedding(EmbeddingBackend):
+    """Wraps a backend so repeated texts are read from an EmbeddingCache.
+
+    Only cache misses reach the wrapped backend, in one batch, and a text
+    repeated within a batch is encoded once.
+    """
+
+    def __init__(self, backend: EmbeddingBackend, cache: EmbeddingCache):
+        self.backend = backend
+        self.cache = cache
+        self.model_id = backend.model_id
+        self.dim = backend.dim
+        self.expensive = backend.expensive
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        try:
+            cached = self.cache.get_many(self.model_id, self.dim, texts)
+        except sqlite3.Error as e:
+            print(f"Embedding cache read failed, encoding directly: {e}")
+            return self.backend.embed_batch(texts)
+
+        missing = {}
+        for i, (text, vector) in enumerate(zip(texts, cached)):
+            if vector is None:
+                missing.setdefault(normalize_text(text), []).append(i)
+        if not missing:
+            return np.stack(cached) if cached else np.zeros((0, self.dim), np.float32)
+
+        # Encode one original text per normalized form
+        to_encode = [texts[positions[0]] for positions in missing.values()]
+        encoded = self.backend.embed_batch(to_encode)
+        for positions, vector in zip(missing.values(), encoded):
+            for i in positions:
+                cached[i] = vector
+        try:
+            self.cache.put_many(self.model_id, to_encode, encoded)
+        except sqlite3.Error as e:
+            print(f"Embedding cache write failed: {e}")
+        return np.stack(cached).astype(np.float32, copy=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.cache.stats(), model_id=self.model_id)
@@ -0,0 +1,164 @@
+import re
+import json
+import zlib
+import functools
+from typing import List, Optional, Sequence
+import numpy as np
+
+# Dimension of the embedding columns (see sqls/update_embeddings_to_768.sql)
+EMBEDDING_DIM = 768
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class EmbeddingBackend:
+    """Interface for text encoders used by retrieval.
+
+    Implementations return L2-normalized float32 vectors of size `dim` so cosine
+    similarity is a plain dot product. `model_id` identifies the vector space:
+    vectors from different model ids must never be compared.
+    """
+
+    model_id = "base"
+    dim = EMBEDDING_DIM
+    # Whether encoding is costly enough to be worth caching results
+    expensive = False
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_batch([text])[0]
+
+
+class HashingEmbedding(EmbeddingBackend):
+    """Dependency-free encoder based on the hashing trick.
+
+    Word unigrams, word bigrams and character n-grams (within word boundaries)
+    are hashed with CRC32 into `dim` signed buckets, counts are log-scaled and
+    the vector is L2-normalized. Deterministic across processes and restarts,
+    no model download, and roughly tens of microseconds per short message.
+    """
+
+    expensive = False
+
+    def __init__(
+        self,
+        dim: int = EMBEDDING_DIM,
+        char_ngrams: tuple = (3, 5),
+        char_weight: float = 0.5,
+        bigram_weight: float = 0.8,
+    ):
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+        self.char_weight = char_weight
+        self.bigram_weight = bigram_weight
+        self.model_id = f"hashing-v1-{dim}-c{char_ngrams[0]}{char_ngrams[1]}"
+        # Per-word features are cached; conversational vocabulary repeats a lot
+        self._word_features = functools.lru_cache(maxsize=65536)(
+            self._features_for_word
+        )
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        rows, columns, weights = [], [], []
+        for row, text in enumerate(texts):
+            words = _WORD_PATTERN.findall((text or "").lower())
+            for word in words:
+                word_columns, word_weights = self._word_features(word)
+                columns.extend(word_columns)
+                weights.extend(word_weights)
+                rows.extend([row] * len(word_columns))
+            for first, second in zip(words, words[1:]):
+                column, sign = self._bucket(f"{first} {second}")
+                columns.append(column)
+                weights.append(sign * self.bigram_weight)
+                rows.append(row)
+
+        matrix = np.zeros(len(texts) * self.dim, dtype=np.float32)
+        if columns:
+            flat = np.asarray(rows, dtype=np.int64) * self.dim + np.asarray(
+                columns, dtype=np.int64
+            )
+            matrix = np.bincount(
+                flat, weights=weights, minlength=len(texts) * self.dim
+            ).astype(np.float32)
+        matrix = matrix.reshape(len(texts), self.dim)
+
+        # Dampen repeated features, then normalize
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        return _normalize_rows(matrix)
+
+    def _features_for_word(self, word: str) -> tuple:
+        columns, weights = [], []
+        column, sign = self._bucket(word)
+        columns.append(column)
+        weights.append(float(sign))
+
+        padded = f"<{word}>"
+        low, high = self.char_ngrams
+        for n in range(low, high + 1):
+            for start in range(0, len(padded) - n + 1):
+                column, sign = self._bucket("#" + padded[start : start + n])
+                columns.append(column)
+                weights.append(sign * self.char_weight)
+        return columns, weights
+
+    def _bucket(self, feature: str) -> tuple:
+        digest = zlib.crc32(feature.encode("utf-8"))
+        return digest % self.dim, 1 if (digest // self.dim) & 1 else -1
+
+
+class SentenceTransformerEmbedding(EmbeddingBackend):
+    """intfloat/multilingual-e5-base via sentence-transformers (optional, ~500MB model)"""
+
+    expensive = True
+
+    def __init__(self, model_name: str = "intfloat/multilingual-e5-base"):
+        # Imported lazily so the dependency stays optional
+        from sentence_transformers import SentenceTransformer
+
+        self.model_id = model_name
+        self._model = SentenceTransformer(model_name)
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        # E5 models require a "query: " prefix for optimal performance
+        prefixed = [f"query: {text}" for text in texts]
+        vectors = self._model.encode(
+            prefixed, convert_to_numpy=True, normalize_embeddings=True
+        )
+        return vectors.astype(np.float32)
+
+
+def create_embedding_backend(name: str = "hashing") -> EmbeddingBackend:
+    """Build a backend by name: "hashing" (default) or "e5" """
+    if name == "e5":
+        return SentenceTransformerEmbedding()
+    if name == "hashing":
+        return HashingEmbedding()
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+
+def parse_embedding(value) -> Optional[np.ndarray]:
+    """Parse an embedding as returned by PostgREST (list or '[...]' string) into float32"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    if not value:
+        return None
+    return np.asarray(value, dtype=np.float32)
+
+
+def to_pg_vector(vector: np.ndarray, decimals: int = 5) -> List[float]:
+    """Convert a vector to a compact list for a pgvector column"""
+    return np.round(vector.astype(np.float64), decimals).tolist()
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
@@ -2,6 +2,9 @@ import os
 import re
 import json
 import html
+import time
+import hashlib
+import threading
 
 
 # --- File Loading Utilities ---
@@ -29,6 +32,68 @@ def read_txt_file_from_directory(
     return content
 
 
+class PromptRegistry:
+    """
+    In-memory cache of prompt files under directory_path (relative to this module).
+    Each file is read once and re-read only when its mtime or size changes; these
+    are checked at most every check_interval seconds, so most lookups touch no files.
+    Call reload() to force a re-read, e.g. after deploying new prompt text.
+    """
+
+    def __init__(self, directory_path="system_prompts", check_interval=2.0):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.directory = os.path.join(base_dir, directory_path)
+        self.check_interval = check_interval
+        self._entries = {}  # filename -> (content, version, stat, last_checked)
+        self._lock = threading.Lock()
+
+    def get(self, filename="charlotte.txt"):
+        """Return the cached content of filename, loading it if needed."""
+        return self.get_with_version(filename)[0]
+
+    def get_with_version(self, filename="charlotte.txt"):
+        """
+        Return (content, version) for filename. The version is a hash of the content,
+        so callers can key derived caches on it and never pair them with other text.
+        Raises FileNotFoundError if the file does not exist.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(filename)
+        if entry is not None and now - entry[3] < self.check_interval:
+            return entry[0], entry[1]
+
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and now - entry[3] < self.check_interval:
+                return entry[0], entry[1]
+
+            file_path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"The file {file_path} does not exist.")
+            stat = (stat.st_mtime_ns, stat.st_size)
+
+            if entry is not None and entry[2] == stat:
+                content, version = entry[0], entry[1]
+            else:
+                print(f"loading prompt file {filename}...")
+                with open(file_path, "r", encoding="utf-8") as file:
+                    content = file.read()
+                version = hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+            self._entries[filename] = (content, version, stat, now)
+            return content, version
+
+    def reload(self, filename=None):
+        """Drop cached content for filename (or every file) so the next lookup re-reads it."""
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(filename, None)
+
+
 def load_all_json_from_folder(folder_path):
     """
     Load and return a list of all JSON objects from .json files in the given folder_path.
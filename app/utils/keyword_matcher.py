@@ -0,0 +1,74 @@
+import re
+from typing import List, Dict, Set, Tuple
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Single-word keywords at least this long also match as a word prefix
+# ("research" matches "researchers"); shorter ones only take a suffix below
+PREFIX_MIN_LENGTH = 4
+_SUFFIXES = ("ing", "es", "ed", "ly", "s")
+
+
+class KeywordMatcher:
+    """Counts keyword hits for several taxonomies in one scan of a text.
+
+    Keywords (words or phrases) are compiled once into a table from token
+    tuples to the (taxonomy, category) pairs they count for. match() tokenizes
+    the text once, looks up each distinct word and the phrase windows starting
+    at a phrase's first word, so its cost is linear in the text whatever the
+    number of keywords. Matches start at a word boundary: phrases match whole
+    words, single words of PREFIX_MIN_LENGTH letters or more match any word
+    they start, shorter ones a whole word or one with a trailing s/es/ed/ing/ly.
+    """
+
+    def __init__(self, taxonomies: Dict[str, Dict[str, List[str]]]):
+        self.taxonomies = taxonomies
+        self._table = {}  # Token tuple -> [(taxonomy, category)]
+        for taxonomy, categories in taxonomies.items():
+            for category, keywords in categories.items():
+                for keyword in keywords:
+                    tokens = tuple(_WORD_PATTERN.findall(keyword.lower()))
+                    self._table.setdefault(tokens, []).append((taxonomy, category))
+        self._max_length = max((len(tokens) for tokens in self._table), default=1)
+        self._phrase_starts = {tokens[0] for tokens in self._table if len(tokens) > 1}
+
+    def keywords(self, text: str) -> Set[Tuple[str, ...]]:
+        """Distinct keywords (as token tuples) occurring in text"""
+        tokens = _WORD_PATTERN.findall((text or "").lower())
+        table, found = self._table, set()
+        # Single-word matches depend only on the word, so check each distinct word once
+        for token in set(tokens):
+            if (token,) in table:
+                found.add((token,))
+            for length in range(PREFIX_MIN_LENGTH, len(token)):
+                if (token[:length],) in table:
+                    found.add((token[:length],))
+            for suffix in _SUFFIXES:
+                stem = token[: -len(suffix)]
+                if (
+                    token.endswith(suffix)
+                    and 2 <= len(stem) < PREFIX_MIN_LENGTH
+                    and (stem,) in table
+                ):
+                    found.add((stem,))
+        for i, token in enumerate(tokens):
+            if token in self._phrase_starts:
+                for length in range(2, self._max_length + 1):
+                    key = tuple(tokens[i : i + length])
+                    if key in table:
+                        found.add(key)
+        return found
+
+    def match(self, text: str) -> Dict[str, Dict[str, int]]:
+        """Per taxonomy, the number of distinct keywords of each category in text"""
+        return self.count(self.keywords(text))
+
+    def count(self, keywords: Set[Tuple[str, ...]]) -> Dict[str, Dict[str, int]]:
+        """Per taxonomy, the number of keywords of each category among keywords"""
+        counts = {
+            taxonomy: dict.fromkeys(categories, 0)
+            for taxonomy, categories in self.taxonomies.items()
+        }
+        for key in keywords:
+            for taxonomy, category in self._table[key]:
+                counts[taxonomy][category] += 1
+        return counts
@@ -0,0 +1,357 @@
+import time
+import queue
+import bisect
+import threading
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is open-ended)
+LATENCY_BUCKETS_MS = [
+    50,
+    100,
+    200,
+    350,
+    500,
+    750,
+    1000,
+    1500,
+    2000,
+    3000,
+    5000,
+    8000,
+    13000,
+    20000,
+    30000,
+]
+
+
+class LatencyHistogram:
+    """Bucketed latency histogram plus a sliding window of samples for percentiles"""
+
+    def __init__(self, window: int = 500):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        ms = seconds * 1000
+        with self._lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """q-quantile (0-1) of recent samples in seconds, or None without samples"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def sample_count(self) -> int:
+        return len(self._samples)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = list(self.counts)
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS]
+        labels.append(f">{LATENCY_BUCKETS_MS[-1]}ms")
+        return {
+            "count": sum(counts),
+            "p50_ms": _to_ms(self.percentile(0.5)),
+            "p95_ms": _to_ms(self.percentile(0.95)),
+            "p99_ms": _to_ms(self.percentile(0.99)),
+            "buckets": dict(zip(labels, counts)),
+        }
+
+
+def _to_ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class Provider:
+    """An OpenAI-compatible chat completion endpoint the router can send requests to"""
+
+    def __init__(
+        self,
+        name: str,
+        client,
+        model: str,
+        max_consecutive_failures: int = 3,
+        cooldown: float = 30.0,
+    ):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.max_consecutive_failures = max_consecutive_failures
+        self.cooldown = cooldown
+        self.time_to_first_token = LatencyHistogram()
+        self.total_latency = LatencyHistogram()
+        self.consecutive_failures = 0
+        self.last_failure = 0.0
+        self.stats = {
+            "attempts": 0,
+            "wins": 0,
+            "failures": 0,
+            "cancelled": 0,
+            "hedges": 0,
+        }
+
+    def is_healthy(self) -> bool:
+        if self.consecutive_failures < self.max_consecutive_failures:
+            return True
+        return time.monotonic() - self.last_failure > self.cooldown
+
+    def record_failure(self) -> None:
+        self.stats["failures"] += 1
+        self.consecutive_failures += 1
+        self.last_failure = time.monotonic()
+
+
+class _Attempt:
+    """One in-flight streaming request to a provider"""
+
+    def __init__(self, provider: Provider):
+        self.provider = provider
+        self.started = time.monotonic()
+        self.cancelled = threading.Event()
+        self.stream = None
+        self.buffer = []  # Chunks received before the attempt won
+        self.failed = False
+        self.ended = False  # Finished without content while another attempt ran
+        self._first_token_lock = threading.Lock()
+        self._first_token_recorded = False
+
+    def record_first_token(self) -> None:
+        """Record time to first token once, whether or not this attempt wins"""
+        with self._first_token_lock:
+            if self._first_token_recorded:
+                return
+            self._first_token_recorded = True
+        self.provider.time_to_first_token.record(time.monotonic() - self.started)
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+class LLMRouter:
+    """Routes chat completions across providers with hedged requests.
+
+    Every request streams from the preferred healthy provider. If it has not
+    produced a first token within that provider's recent p95 time-to-first-token
+    (clamped to [min_hedge_delay, max_hedge_delay]), the same request is sent to
+    the next provider; whichever produces content first wins and the other stream
+    is closed. A provider that fails outright is failed over to immediately.
+
+    Time to first token is recorded for every attempt that produces content,
+    winner or not. An attempt cancelled before its first token records its
+    elapsed time as a lower bound, so a provider's slow requests stay in its
+    percentile instead of being censored whenever a hedge beats them.
+    """
+
+    def __init__(
+        self,
+        providers: List[Provider],
+        hedging: bool = True,
+        hedge_quantile: float = 0.95,
+        default_hedge_delay: float = 2.5,
+        min_hedge_delay: float = 0.5,
+        max_hedge_delay: float = 8.0,
+        min_samples: int = 20,
+        request_timeout: float = 60.0,
+    ):
+        self.providers = providers
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.min_samples = min_samples
+        self.request_timeout = request_timeout
+        self._lock = threading.Lock()
+
+    def select_providers(self) -> List[Provider]:
+        """Providers in the order to try them: healthy ones first, keeping preference order"""
+        return sorted(self.providers, key=lambda provider: not provider.is_healthy())
+
+    def hedge_delay(self, provider: Provider) -> float:
+        """How long to wait for the first token before sending a hedge request"""
+        if provider.time_to_first_token.sample_count() < self.min_samples:
+            return self.default_hedge_delay
+        delay = provider.time_to_first_token.percentile(self.hedge_quantile)
+        return max(self.min_hedge_delay, min(self.max_hedge_delay, delay))
+
+    def stream(self, messages: List[Dict], **params):
+        """Yield completion chunks from whichever provider answers first"""
+        candidates = self.select_providers()
+        if not candidates:
+            raise RuntimeError("No LLM providers configured")
+
+        events = queue.Queue()
+        attempts = [self._launch(candidates[0], messages, params, events)]
+        backups = candidates[1:]
+        hedge_at = attempts[0].started + self.hedge_delay(candidates[0])
+        winner = None
+        last_error = None
+
+        try:
+            while True:
+                may_hedge = winner is None and backups and self.hedging
+                timeout = (
+                    max(0.0, hedge_at - time.monotonic())
+                    if may_hedge
+                    else self.request_timeout
+                )
+                try:
+                    attempt, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    if may_hedge:
+                        provider = backups.pop(0)
+                        print(f"Hedging LLM request to {provider.name}")
+                        with self._lock:
+                            provider.stats["hedges"] += 1
+                        attempts.append(
+                            self._launch(provider, messages, params, events)
+                        )
+                        hedge_at = time.monotonic() + self.hedge_delay(provider)
+                        continue
+                    raise TimeoutError("LLM request timed out")
+
+                if winner is not None and attempt is not winner:
+                    continue  # Late output from a cancelled attempt
+
+                if kind == "chunk":
+                    if winner is None:
+                        attempt.buffer.append(payload)
+                        if not _has_content(payload):
+                            continue
+                        winner = self._declare_winner(attempt, attempts)
+                        yield from attempt.buffer
+                        attempt.buffer = []
+                    else:
+                        yield payload
+
+                elif kind == "end":
+                    attempt.provider.total_latency.record(
+                        time.monotonic() - attempt.started
+                    )
+                    attempt.provider.consecutive_failures = 0
+                    if winner is None:
+                        if self._in_flight(attempts, attempt):
+                            # Empty answer: keep it only if the hedge has nothing either
+                            attempt.ended = True
+                            continue
+                        # Finished without any content: still a valid (empty) answer
+                        winner = self._declare_winner(attempt, attempts)
+                        yield from attempt.buffer
+                    return
+
+                elif kind == "error":
+                    last_error = payload
+                    attempt.failed = True
+                    with self._lock:
+                        attempt.provider.record_failure()
+                    print(f"LLM provider {attempt.provider.name} failed: {payload}")
+                    if winner is attempt:
+                        raise payload
+                    if not self._in_flight(attempts):
+                        empty = next((a for a in attempts if a.ended), None)
+                        if empty is not None:
+                            # An attempt already finished with an empty answer
+                            self._declare_winner(empty, attempts)
+                            yield from empty.buffer
+                            return
+                        if not backups:
+                            raise last_error
+                        # Fail over immediately instead of waiting for the hedge delay
+                        attempts.append(
+                            self._launch(backups.pop(0), messages, params, events)
+                        )
+        finally:
+            # Closes losers, and the winner too if the consumer stopped early
+            for attempt in attempts:
+                attempt.cancel()
+
+    def complete(self, messages: List[Dict], **params) -> Tuple[str, Any]:
+        """Non-streaming convenience wrapper: returns (content, usage)"""
+        parts, usage = [], None
+        for chunk in self.stream(messages, **params):
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+        return "".join(parts), usage
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            provider.name: {
+                **provider.stats,
+                "healthy": provider.is_healthy(),
+                "hedge_delay_ms": round(self.hedge_delay(provider) * 1000, 1),
+                "time_to_first_token": provider.time_to_first_token.summary(),
+                "total_latency": provider.total_latency.summary(),
+            }
+            for provider in self.providers
+        }
+
+    def _launch(self, provider: Provider, messages, params, events) -> _Attempt:
+        attempt = _Attempt(provider)
+        with self._lock:
+            provider.stats["attempts"] += 1
+        thread = threading.Thread(
+            target=self._run_attempt,
+            args=(attempt, messages, params, events),
+            name=f"llm-{provider.name}",
+            daemon=True,
+        )
+        thread.start()
+        return attempt
+
+    def _run_attempt(self, attempt: _Attempt, messages, params, events) -> None:
+        provider = attempt.provider
+        try:
+            attempt.stream = provider.client.chat.completions.create(
+                model=provider.model, messages=messages, stream=True, **params
+            )
+            if attempt.cancelled.is_set():
+                return
+            for chunk in attempt.stream:
+                if attempt.cancelled.is_set():
+                    return
+                if _has_content(chunk):
+                    attempt.record_first_token()
+                events.put((attempt, "chunk", chunk))
+            events.put((attempt, "end", None))
+        except Exception as e:
+            if not attempt.cancelled.is_set():
+                events.put((attempt, "error", e))
+        finally:
+            if attempt.cancelled.is_set():
+                attempt.cancel()
+
+    def _declare_winner(self, winner: _Attempt, attempts: List[_Attempt]) -> _Attempt:
+        with self._lock:
+            winner.provider.stats["wins"] += 1
+        for attempt in attempts:
+            if attempt is not winner and not attempt.failed and not attempt.ended:
+                # No-op if its first token arrived; otherwise a censored sample
+                attempt.record_first_token()
+                attempt.cancel()
+                with self._lock:
+                    attempt.provider.stats["cancelled"] += 1
+        return winner
+
+    def _in_flight(
+        self, attempts: List[_Attempt], exclude: Optional[_Attempt] = None
+    ) -> bool:
+        """Whether any attempt other than exclude may still produce content"""
+        return any(a is not exclude and not a.failed and not a.ended for a in attempts)
+
+
+def _has_content(chunk) -> bool:
+    return bool(chunk.choices and chunk.choices[0].delta.content)
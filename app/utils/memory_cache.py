@@ -0,0 +1,908 @@
+import os
+import time
+import hashlib
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Tuple
+import numpy as np
+from flask import current_app
+from app import supabase_extension
+from app.utils.embeddings import parse_embedding
+from app.utils.memory_index import IVFPQIndex, IVFPQ_TRAIN_SIZE
+from app.utils.bm25_index import BM25Index
+from app.utils.minhash import MinHashLSH
+from app.utils.vector_store import MappedVectorStore, current_generation
+
+# Retrain a restored index once the table has grown this much since training
+INDEX_RETRAIN_GROWTH = 4.0
+# Rewrite a shared vector file at load once it holds this many times the vectors
+# still in use, and at least VECTOR_COMPACT_MIN_ROWS unused ones
+VECTOR_COMPACT_RATIO = 1.5
+VECTOR_COMPACT_MIN_ROWS = 1000
+
+# Recency multiplier by age: (maximum age in seconds, boost); older rows get 1.0
+RECENCY_STEPS = ((24 * 3600, 1.5), (7 * 24 * 3600, 1.2))
+
+
+def parse_timestamp(value) -> float:
+    """Epoch seconds of an ISO timestamp, or 0.0 if it cannot be parsed"""
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except (ValueError, TypeError):
+        return 0.0
+
+
+class ColumnarStore:
+    """Rows of one table held as contiguous columns for vectorized scoring.
+
+    Embeddings live in a single float32 matrix next to parallel arrays for the
+    creation time, quality and importance of each row, so a query scores every
+    row in one pass. Capacity doubles as rows are appended. With an attached
+    MemoryIndex (kept aligned with row positions) only the index's nearest
+    candidates are scored; an attached BM25Index answers lexical queries and an
+    attached MinHashLSH near-duplicate lookups.
+
+    With a MappedVectorStore the embeddings stay in its shared int8 file and
+    the store only keeps each position's row in that file.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        capacity: int = 1024,
+        vector_store: Optional[MappedVectorStore] = None,
+    ):
+        self.dim = dim
+        self.index = None
+        self.lexical = None
+        self.duplicates = None
+        self.vector_store = vector_store
+        self._size = 0
+        self._vectors = (
+            np.zeros((capacity, dim), dtype=np.float32)
+            if vector_store is None
+            else None
+        )
+        self._vector_rows = np.zeros(capacity, dtype=np.int64)
+        self._created = np.zeros(capacity, dtype=np.float64)
+        self._quality = np.ones(capacity, dtype=np.float32)
+        self._importance = np.ones(capacity, dtype=np.float32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._rows = []
+        self._positions = {}  # Row id -> position
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def extend(
+        self,
+        rows: List[Dict],
+        vectors: np.ndarray,
+        created: np.ndarray,
+        quality: np.ndarray,
+        importance: np.ndarray,
+        texts: Optional[List[str]] = None,
+        keys: Optional[List[str]] = None,
+    ) -> None:
+        count = len(rows)
+        if not count:
+            return
+        with self._lock:
+            start, end = self._size, self._size + count
+            if end > len(self._created):
+                self._grow(end)
+            if self.vector_store is not None:
+                self._vector_rows[start:end] = self.vector_store.append(keys, vectors)
+            else:
+                self._vectors[start:end] = vectors
+            self._created[start:end] = created
+            self._quality[start:end] = quality
+            self._importance[start:end] = importance
+            self._alive[start:end] = True
+            self._rows.extend(rows)
+            for position, row in enumerate(rows, start):
+                if row.get("id") is not None:
+                    self._positions[row["id"]] = position
+            if self.index is not None:
+                self.index.add(vectors)
+            if self.lexical is not None:
+                self.lexical.add(texts)
+            if self.duplicates is not None:
+                self.duplicates.add(self.duplicates.signatures(texts))
+            self._size = end
+
+    def remove(self, row_ids: List[Any]) -> None:
+        """Tombstone rows by id so they are no longer returned"""
+        with self._lock:
+            positions = [
+                self._positions.pop(row_id)
+                for row_id in row_ids
+                if row_id in self._positions
+            ]
+            self._alive[positions] = False
+            if self.index is not None and positions:
+                self.index.remove(positions)
+            if self.lexical is not None and positions:
+                self.lexical.remove(positions)
+            if self.duplicates is not None and positions:
+                self.duplicates.remove(positions)
+
+    def attach_index(self, index) -> None:
+        """Use index (already holding every row, in position order) for search"""
+        with self._lock:
+            self.index = index
+
+    def attach_lexical(self, lexical: BM25Index) -> None:
+        """Use lexical (already holding every row, in position order) for lexical_search"""
+        with self._lock:
+            self.lexical = lexical
+
+    def attach_duplicates(self, duplicates: MinHashLSH) -> None:
+        """Use duplicates (already holding every row, in position order) for find_duplicate"""
+        with self._lock:
+            self.duplicates = duplicates
+
+    def find_duplicate(
+        self, text: str, threshold: float, where: Optional[Dict[str, Any]] = None
+    ) -> Optional[int]:
+        """Position of a live row whose text nearly duplicates text, if any, among
+        the rows whose columns equal where"""
+        duplicates = self.duplicates
+        if duplicates is None:
+            return None
+        rows = self._rows
+        accept = (
+            (
+                lambda position: all(
+                    rows[position].get(column) == value
+                    for column, value in where.items()
+                )
+            )
+            if where
+            else None
+        )
+        match = duplicates.query(duplicates.signature(text), threshold, accept)
+        return match[0] if match is not None else None
+
+    def reinforce(
+        self, position: int, increment: float, column: Optional[str] = None
+    ) -> Dict:
+        """Raise a row's importance by increment (capped at 1) and return the row"""
+        with self._lock:
+            importance = min(1.0, float(self._importance[position]) + increment)
+            self._importance[position] = importance
+            row = self._rows[position]
+            if column:
+                row[column] = importance
+            return row
+
+    def lexical_search(self, query: str, limit: int) -> List[Tuple[Dict, float]]:
+        """(row, BM25 score) of the best lexical matches, best first"""
+        lexical = self.lexical
+        if lexical is None:
+            return []
+        positions, scores = lexical.search(query, limit)
+        return [
+            (self._rows[position], float(score))
+            for position, score in zip(positions, scores)
+            if self._alive[position]
+        ]
+
+    def rows(self) -> List[Dict]:
+        return self._rows[: self._size]
+
+    def vectors(self, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """Float32 vectors of positions (all rows if None)"""
+        if positions is None:
+            positions = np.arange(self._size)
+        if self.vector_store is not None:
+            return self.vector_store.vectors(self._vector_rows[positions])
+        return self._vectors[positions]
+
+    def row_ids(self) -> List[Any]:
+        return [row.get("id") for row in self._rows[: self._size]]
+
+    def compact_vectors(self, ratio: float, min_rows: int) -> bool:
+        """Move to a compacted copy of the shared vector file if enough of it is
+        unused by live rows; True if the store switched to the copy"""
+        with self._lock:
+            vector_store = self.vector_store
+            if vector_store is None:
+                return False
+            used = np.unique(self._vector_rows[: self._size][self._alive[: self._size]])
+            unused = len(vector_store) - len(used)
+            if unused < min_rows or len(vector_store) < ratio * len(used):
+                return False
+            compacted, mapping = vector_store.compact(used)
+            if mapping is None:
+                return False
+            # Dead rows are never scored; point them at row 0 rather than -1
+            self._vector_rows[: self._size] = np.maximum(
+                mapping[self._vector_rows[: self._size]], 0
+            )
+            self.vector_store = compacted
+            return True
+
+    def positions_of(self, row_ids: List[Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices into row_ids, positions) of the ids held by live rows"""
+        found, positions = [], []
+        with self._lock:
+            for i, row_id in enumerate(row_ids):
+                position = self._positions.get(row_id) if row_id is not None else None
+                if position is not None and self._alive[position]:
+                    found.append(i)
+                    positions.append(position)
+        return np.array(found, dtype=np.int64), np.array(positions, dtype=np.int64)
+
+    def stored_count(self) -> int:
+        """Live rows that came from the table (rows added locally have no id yet)"""
+        return len(self._positions)
+
+    def missing(self, rows: List[Dict]) -> List[Dict]:
+        """The rows not held yet, matched by id or else by creation time (to the ms).
+
+        Held rows added locally without an id take the id of the row they match.
+        """
+        if not rows:
+            return []
+        created_at = [round(parse_timestamp(row.get("created_at")), 3) for row in rows]
+        with self._lock:
+            created = self._created[: self._size]
+            recent = np.flatnonzero(created >= min(created_at) - 0.001)
+            held = dict(zip(np.round(created[recent], 3).tolist(), recent.tolist()))
+            new = []
+            for row, created in zip(rows, created_at):
+                if row.get("id") in self._positions:
+                    continue
+                position = held.get(created)
+                if position is None:
+                    new.append(row)
+                elif self._rows[position].get("id") is None and self._alive[position]:
+                    self._rows[position]["id"] = row.get("id")
+                    self._positions[row.get("id")] = position
+            return new
+
+    def dead_positions(self) -> np.ndarray:
+        return np.flatnonzero(~self._alive[: self._size])
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        limit: int,
+        now: Optional[float] = None,
+        recency_steps: Tuple = RECENCY_STEPS,
+        candidates: int = 10,
+    ) -> List[Tuple[Dict, float, float]]:
+        """Top rows by relevance x recency x quality x importance.
+
+        With an index, the limit x candidates nearest rows are re-scored exactly.
+        Returns (row, score, similarity) tuples, best first.
+        """
+        with self._lock:
+            size = self._size
+            # Views stay valid: appends only write past size, growth allocates new arrays
+            vectors = self._vectors[:size] if self._vectors is not None else None
+            vector_rows = self._vector_rows[:size]
+            vector_store = self.vector_store
+            created = self._created[:size]
+            quality = self._quality[:size]
+            importance = self._importance[:size]
+            alive = self._alive[:size]
+            rows = self._rows
+            index = self.index
+        if size == 0 or limit <= 0:
+            return []
+
+        if index is not None:
+            positions, _ = index.search(query_vector, limit * candidates)
+            positions = positions[positions < size]
+            created = created[positions]
+            quality, importance = quality[positions], importance[positions]
+            alive = alive[positions]
+            if vector_store is not None:
+                similarity = vector_store.similarity(
+                    query_vector, vector_rows[positions]
+                )
+            else:
+                similarity = vectors[positions] @ query_vector
+        else:
+            positions = np.arange(size)
+            if vector_store is not None:
+                similarity = vector_store.similarity(query_vector)[vector_rows]
+            else:
+                similarity = vectors @ query_vector
+
+        now = time.time() if now is None else now
+        bounds = np.array([bound for bound, _ in recency_steps], dtype=np.float64)
+        boosts = np.array(
+            [boost for _, boost in recency_steps] + [1.0], dtype=np.float32
+        )
+        recency = boosts[np.searchsorted(bounds, now - created, side="right")]
+        scores = np.maximum(similarity, 0.0) * recency * quality * importance
+        scores[~alive] = -1.0
+
+        k = min(limit, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(k)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            (rows[positions[i]], float(scores[i]), float(similarity[i]))
+            for i in top
+            if alive[i]
+        ]
+
+    def _grow(self, needed: int) -> None:
+        capacity = max(needed, 2 * len(self._created))
+        if self._vectors is not None:
+            self._vectors = _resized(self._vectors, (capacity, self.dim), 0.0)
+        self._vector_rows = _resized(self._vector_rows, (capacity,), 0)
+        self._created = _resized(self._created, (capacity,), 0.0)
+        self._quality = _resized(self._quality, (capacity,), 1.0)
+        self._importance = _resized(self._importance, (capacity,), 1.0)
+        self._alive = _resized(self._alive, (capacity,), False)
+
+
+def _resized(array: np.ndarray, shape: tuple, fill: float) -> np.ndarray:
+    grown = np.full(shape, fill, dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+class CachedTable:
+    """Columnar cache of a Supabase table used for retrieval scoring.
+
+    The table is paged into a ColumnarStore by a background thread on first use;
+    until then search() returns None and callers fall back to querying the
+    database. Once older than max_age the cache is brought up to date in the
+    background: only rows created since the newest one it holds are fetched,
+    plus a row count that reveals deletions. The whole table is fetched again
+    only after invalidate(), when rows were deleted or deactivated, or when the
+    index must be (re)trained. Rows written by this process are appended with
+    add() so they are searchable immediately.
+
+    With index_params the store is searched through an IVFPQIndex built (or
+    restored from index_dir) at load time once the table has train_size rows;
+    smaller tables are scanned exactly, straight from the store's vectors, so no
+    process keeps a second copy of them. Rows that no longer match the filters,
+    e.g. deactivated conversations, are tombstoned.
+
+    With mapped_vectors the embeddings are kept in a MappedVectorStore under
+    index_dir (int8, shared by every worker process) keyed by a hash of each
+    row's text, instead of a float32 matrix per process. A load that finds the
+    file mostly unused (deleted or edited rows) compacts it.
+
+    With near_duplicates (a Jaccard threshold) a MinHashLSH over row texts is
+    kept so absorb_duplicate() can fold a repeated row into the existing one.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        columns: str,
+        text_fn: Callable[[Dict], str],
+        encoder: Callable[[List[str]], np.ndarray],
+        quality_column: Optional[str] = None,
+        importance_column: Optional[str] = None,
+        default_importance: float = 0.5,
+        filters: Optional[Dict[str, Any]] = None,
+        page_size: int = 1000,
+        max_age: float = 900,
+        index_params: Optional[Dict[str, Any]] = None,
+        index_dir: Optional[str] = None,
+        candidates: int = 10,
+        lexical: bool = False,
+        mapped_vectors: bool = False,
+        near_duplicates: Optional[float] = None,
+    ):
+        self.table = table
+        self.columns = columns
+        self.text_fn = text_fn
+        self.encoder = encoder
+        self.quality_column = quality_column
+        self.importance_column = importance_column
+        self.default_importance = default_importance
+        self.filters = filters or {}
+        self.page_size = page_size
+        self.max_age = max_age
+        self.index_params = index_params
+        self.index_dir = index_dir
+        self.candidates = candidates
+        self.lexical = lexical
+        self.mapped_vectors = mapped_vectors and bool(index_dir)
+        self.near_duplicates = near_duplicates
+        self._vector_store = None
+        self._store = None
+        self._loaded_at = 0.0
+        self._cursor = None  # created_at of the newest row fetched from the table
+        self._full_reload = True
+        self._loading = False
+        self._pending = []  # Rows added while a load is running
+        self._lock = threading.Lock()
+        self._stats = {
+            "loads": 0,
+            "refreshes": 0,
+            "searches": 0,
+            "fallbacks": 0,
+            "search_ms": 0.0,
+            "lexical_searches": 0,
+            "lexical_ms": 0.0,
+            "duplicates_absorbed": 0,
+        }
+
+    def search(
+        self, query_vector: np.ndarray, limit: int
+    ) -> Optional[List[Tuple[Dict, float, float]]]:
+        """Score all cached rows, or return None while the cache is not loaded"""
+        store = self._store
+        if (
+            store is None
+            or time.monotonic() - self._loaded_at > self.max_age
+            # Enough rows were appended to train the index: rebuild off the request path
+            or self._index_due(store)
+        ):
+            self._start_load()
+        if store is None:
+            with self._lock:
+                self._stats["fallbacks"] += 1
+            return None
+
+        started = time.perf_counter()
+        results = store.search(query_vector, limit, candidates=self.candidates)
+        with self._lock:
+            self._stats["searches"] += 1
+            self._stats["search_ms"] += (time.perf_counter() - started) * 1000
+        return results
+
+    def lexical_search(
+        self, query: str, limit: int
+    ) -> Optional[List[Tuple[Dict, float]]]:
+        """BM25 matches over cached rows, or None while the cache is not loaded"""
+        store = self._store
+        if store is None:
+            self._start_load()
+            return None
+        started = time.perf_counter()
+        results = store.lexical_search(query, limit)
+        with self._lock:
+            self._stats["lexical_searches"] += 1
+            self._stats["lexical_ms"] += (time.perf_counter() - started) * 1000
+        return results
+
+    def score_rows(
+        self, query_vector: np.ndarray, rows: List[Dict], limit: int
+    ) -> List[Tuple[Dict, float, float]]:
+        """Score rows fetched outside the cache with the same vectorized pass"""
+        store = ColumnarStore(len(query_vector), capacity=max(1, len(rows)))
+        self._append(store, rows)
+        return store.search(query_vector, limit)
+
+    def vectors_for(self, rows: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+        """Cached vectors of rows: (indices into rows that the cache holds, vectors).
+
+        Rows are matched by id, so rows this process appended before they had
+        one, or any rows while the cache is not loaded, are not found.
+        """
+        store = self._store
+        if store is None:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+        found, positions = store.positions_of([row.get("id") for row in rows])
+        return found, store.vectors(positions)
+
+    def add(self, rows: List[Dict]) -> None:
+        """Make rows written by this process searchable without a reload"""
+        with self._lock:
+            if self._loading:
+                self._pending.extend(rows)
+            store = self._store
+        if store is not None:
+            try:
+                self._append(store, rows)
+            except Exception as e:
+                # E.g. another process compacted the vector file: reload on next search
+                print(f"Error adding to {self.table} cache: {e}")
+                self._loaded_at = 0.0
+
+    def top_terms(self, text: str, limit: int) -> List[str]:
+        """Highest TF-IDF terms of text, using the lexical index's document frequencies.
+
+        Until the cache has loaded (or without lexical=True) terms rank by
+        frequency alone.
+        """
+        store = self._store
+        lexical = store.lexical if store is not None else None
+        return (lexical or BM25Index()).top_terms(text, limit)
+
+    def absorb_duplicate(
+        self, row: Dict, increment: float, same: Tuple[str, ...] = ()
+    ) -> Optional[Dict]:
+        """Fold row into a cached near-duplicate by raising that row's importance.
+
+        Only duplicates with the same values as row in the columns same (e.g.
+        conversation_id) are considered. Returns the cached row with its new importance,
+        or None if row is new or the cache is not loaded (the caller then stores
+        row as usual).
+        """
+        store = self._store
+        if store is None or self.near_duplicates is None:
+            return None
+        position = store.find_duplicate(
+            self.text_fn(row),
+            self.near_duplicates,
+            {column: row.get(column) for column in same},
+        )
+        if position is None:
+            return None
+        with self._lock:
+            self._stats["duplicates_absorbed"] += 1
+        return store.reinforce(position, increment, self.importance_column)
+
+    def invalidate(self) -> None:
+        """Fetch the whole table again on the next search (e.g. after rows were edited)"""
+        with self._lock:
+            self._full_reload = True
+            self._loaded_at = 0.0
+
+    def remove(self, row_ids: List[Any]) -> None:
+        """Tombstone rows (e.g. deleted or deactivated) so they are no longer returned"""
+        store = self._store
+        if store is not None:
+            store.remove(row_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        store = self._store
+        stats["rows"] = len(store) if store is not None else 0
+        stats["loaded"] = store is not None
+        if store is not None and store.index is not None:
+            stats["index"] = store.index.stats()
+        if store is not None and store.lexical is not None:
+            stats["lexical"] = store.lexical.stats()
+        if store is not None and store.duplicates is not None:
+            stats["duplicates"] = store.duplicates.stats()
+        if store is not None and store.vector_store is not None:
+            stats["vector_store"] = store.vector_store.stats()
+        stats["avg_lexical_ms"] = (
+            round(stats.pop("lexical_ms") / stats["lexical_searches"], 3)
+            if stats["lexical_searches"]
+            else 0.0
+        )
+        stats["avg_search_ms"] = (
+            round(stats.pop("search_ms") / stats["searches"], 3)
+            if stats["searches"]
+            else 0.0
+        )
+        return stats
+
+    def _start_load(self) -> None:
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+            self._pending = []
+        app = current_app._get_current_object()
+        threading.Thread(
+            target=self._load, args=(app,), name=f"cache-{self.table}", daemon=True
+        ).start()
+
+    def _load(self, app) -> None:
+        store = self._store
+        if store is None or self._full_reload or self._index_due(store):
+            self._load_all(app)
+        else:
+            self._load_since(app, store)
+
+    def _load_since(self, app, store: ColumnarStore) -> None:
+        """Append rows created since the last fetch; reload all if any were deleted"""
+        started = time.monotonic()
+        try:
+            with app.app_context():
+                rows = self._fetch_all(since=self._cursor)
+                stored = self._count_rows()
+            if rows:
+                self._cursor = rows[-1].get("created_at")
+            new = store.missing(rows)
+            self._append(store, new)
+            if stored is not None and stored < store.stored_count():
+                # Rows this cache holds were deleted or stopped matching the filters
+                print(f"{self.table} rows were removed; reloading the whole table")
+                self._load_all(app)
+                return
+            with self._lock:
+                self._loaded_at = time.monotonic()
+                self._stats["refreshes"] += 1
+            print(
+                f"Refreshed {self.table} columnar cache with {len(new)} new rows "
+                f"in {(time.monotonic() - started) * 1000:.0f} ms"
+            )
+        except Exception as e:
+            print(f"Error refreshing {self.table} cache: {e}")
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def _load_all(self, app) -> None:
+        started = time.monotonic()
+        try:
+            with self._lock:
+                self._full_reload = False
+            with app.app_context():
+                rows = self._fetch_all()
+            self._cursor = rows[-1].get("created_at") if rows else None
+            dim = self._dim()
+            store = ColumnarStore(
+                dim,
+                capacity=max(1024, len(rows)),
+                vector_store=self._get_vector_store(dim),
+            )
+            # In pages, so only one page of float32 vectors exists at a time
+            for start in range(0, len(rows), self.page_size):
+                self._append(store, rows[start : start + self.page_size])
+            if store.compact_vectors(VECTOR_COMPACT_RATIO, VECTOR_COMPACT_MIN_ROWS):
+                self._vector_store = store.vector_store
+            if self.index_params is not None:
+                self._build_index(store)
+            if self.lexical:
+                self._build_lexical(store)
+            if self.near_duplicates is not None:
+                duplicates = MinHashLSH()
+                duplicates.add(
+                    duplicates.signatures([self.text_fn(row) for row in store.rows()])
+                )
+                duplicates.remove(store.dead_positions())
+                store.attach_duplicates(duplicates)
+
+            with self._lock:
+                # Rows added during the load that it did not pick up from the database
+                loaded = set(np.round(store._created[: len(store)], 3).tolist())
+                pending = [
+                    row
+                    for row in self._pending
+                    if round(parse_timestamp(row.get("created_at")), 3) not in loaded
+                ]
+                self._pending = []
+                self._store = store
+                self._loaded_at = time.monotonic()
+                self._stats["loads"] += 1
+            self._append(store, pending)
+            print(
+                f"Loaded {len(store)} {self.table} rows into the columnar cache "
+                f"in {(time.monotonic() - started) * 1000:.0f} ms"
+            )
+        except Exception as e:
+            print(f"Error loading {self.table} cache: {e}")
+            with self._lock:
+                self._full_reload = True
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def _fetch_all(self, since: Optional[str] = None) -> List[Dict]:
+        """Rows matching the filters (created at or after since, if given), oldest first"""
+        rows, start = [], 0
+        while True:
+            query = supabase_extension.client.table(self.table).select(self.columns)
+            for column, value in self.filters.items():
+                query = query.eq(column, value)
+            if since is not None:
+                query = query.gte("created_at", since)
+            response = (
+                query.order("created_at")
+                .order("id")
+                .range(start, start + self.page_size - 1)
+                .execute()
+            )
+            rows.extend(response.data)
+            if len(response.data) < self.page_size:
+                return rows
+            start += self.page_size
+
+    def _count_rows(self) -> Optional[int]:
+        """Number of rows matching the filters, from a one-row query"""
+        query = supabase_extension.client.table(self.table).select("id", count="exact")
+        for column, value in self.filters.items():
+            query = query.eq(column, value)
+        return query.limit(1).execute().count
+
+    def _append(self, store: ColumnarStore, rows: List[Dict]) -> None:
+        matches = [
+            all(
+                row.get(column, value) == value
+                for column, value in self.filters.items()
+            )
+            for row in rows
+        ]
+        # Rows that stopped matching (e.g. is_active=false) are tombstoned
+        excluded = [
+            row["id"]
+            for row, match in zip(rows, matches)
+            if not match and row.get("id") is not None
+        ]
+        if excluded:
+            store.remove(excluded)
+        rows = [row for row, match in zip(rows, matches) if match]
+        if not rows:
+            return
+
+        vectors = np.zeros((len(rows), store.dim), dtype=np.float32)
+        missing = []
+        embeddings = [row.get("embedding") for row in rows]
+        # Cached rows do not keep their (large) serialized embedding
+        rows = [{k: v for k, v in row.items() if k != "embedding"} for row in rows]
+        for i, embedding in enumerate(embeddings):
+            vector = parse_embedding(embedding)
+            if vector is not None and vector.shape == (store.dim,):
+                vectors[i] = vector
+            else:
+                missing.append(i)
+        texts = (
+            [self.text_fn(row) for row in rows]
+            if store.lexical is not None
+            or store.duplicates is not None
+            or store.vector_store is not None
+            else None
+        )
+        if missing:
+            vectors[missing] = self.encoder(
+                [texts[i] if texts else self.text_fn(rows[i]) for i in missing]
+            )
+        # Stored vectors are rounded, so renormalize before taking dot products
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors /= norms
+
+        store.extend(
+            rows,
+            vectors,
+            np.fromiter(
+                (parse_timestamp(row.get("created_at")) for row in rows),
+                dtype=np.float64,
+                count=len(rows),
+            ),
+            self._column(rows, self.quality_column, 1.0),
+            self._column(rows, self.importance_column, self.default_importance),
+            texts,
+            (
+                [hashlib.sha1(text.encode("utf-8")).hexdigest() for text in texts]
+                if store.vector_store is not None
+                else None
+            ),
+        )
+
+    def _column(
+        self, rows: List[Dict], column: Optional[str], default: float
+    ) -> np.ndarray:
+        if column is None:
+            return np.ones(len(rows), dtype=np.float32)
+        return np.fromiter(
+            (float(row.get(column) or default) for row in rows),
+            dtype=np.float32,
+            count=len(rows),
+        )
+
+    def _dim(self) -> int:
+        return self.encoder([""]).shape[1]
+
+    def _build_index(self, store: ColumnarStore) -> None:
+        """Build the ANN index for a freshly loaded store, reusing persisted codes"""
+        keys = store.row_ids()
+        path = self._index_path()
+        index = None
+        if path and os.path.exists(path):
+            try:
+                index, encoded = IVFPQIndex.load(path, **self._index_options())
+                if len(keys) > INDEX_RETRAIN_GROWTH * index.trained_size:
+                    index = None  # Grown too much; quantizers no longer fit
+                else:
+                    self._restore_codes(index, encoded, store, keys)
+            except Exception as e:
+                print(f"Error restoring {self.table} index: {e}")
+                index = None
+
+        if index is None:
+            if len(store) < self._train_size():
+                # The store's own exact scan is used until there is enough to train on
+                return
+            index = IVFPQIndex(store.dim, **self.index_params)
+            index.train(store.vectors())
+
+        index.remove(store.dead_positions())
+        store.attach_index(index)
+        if path and index.trained:
+            try:
+                index.save(path, keys)
+            except Exception as e:
+                print(f"Error saving {self.table} index: {e}")
+
+    def _train_size(self) -> int:
+        return self.index_params.get("train_size", IVFPQ_TRAIN_SIZE)
+
+    def _index_due(self, store: ColumnarStore) -> bool:
+        """True once the store has outgrown exact search (or its untrained index)"""
+        if store.index is not None:
+            return store.index.needs_training
+        return self.index_params is not None and len(store) >= self._train_size()
+
+    def _build_lexical(self, store: ColumnarStore) -> None:
+        """Build the BM25 index for a freshly loaded store, reusing persisted postings"""
+        rows, keys = store.rows(), store.row_ids()
+        path = (
+            os.path.join(self.index_dir, f"{self.table}-bm25.npz")
+            if self.index_dir
+            else None
+        )
+        lexical = None
+        if path and os.path.exists(path):
+            try:
+                lexical, missing = BM25Index.load(path, keys)
+                for position in missing:
+                    lexical.fill(position, self.text_fn(rows[position]))
+                print(
+                    f"Restored {self.table} BM25 index, indexed {len(missing)} new rows"
+                )
+            except Exception as e:
+                print(f"Error restoring {self.table} BM25 index: {e}")
+                lexical = None
+
+        if lexical is None:
+            lexical = BM25Index()
+            lexical.add([self.text_fn(row) for row in rows])
+
+        lexical.remove(store.dead_positions())
+        store.attach_lexical(lexical)
+        if path:
+            try:
+                lexical.save(path, keys)
+            except Exception as e:
+                print(f"Error saving {self.table} BM25 index: {e}")
+
+    def _restore_codes(self, index, encoded, store, keys) -> None:
+        lists = np.zeros(len(keys), dtype=np.int32)
+        codes = np.zeros((len(keys), index.n_subvectors), dtype=np.uint8)
+        missing = []
+        for i, key in enumerate(keys):
+            hit = encoded.get(str(key)) if key is not None else None
+            if hit is None:
+                missing.append(i)
+            else:
+                lists[i], codes[i] = hit
+        if missing:
+            lists[missing], codes[missing] = index.encode(
+                store.vectors(np.array(missing))
+            )
+        index.add_encoded(lists, codes)
+        print(f"Restored {self.table} index, encoded {len(missing)} new rows")
+
+    def _index_options(self) -> Dict[str, Any]:
+        # Quantizer shapes come from the file; only search/training knobs apply
+        return {
+            key: value
+            for key, value in self.index_params.items()
+            if key not in ("n_lists", "n_subvectors")
+        }
+
+    def _index_path(self) -> Optional[str]:
+        if not self.index_dir:
+            return None
+        return os.path.join(self.index_dir, f"{self.table}-{self._signature()}.npz")
+
+    def _get_vector_store(self, dim: int) -> Optional[MappedVectorStore]:
+        """The table's shared vector file, opened once per process"""
+        if not self.mapped_vectors:
+            return None
+        base = os.path.join(self.index_dir, f"{self.table}-{self._signature()}")
+        if (
+            self._vector_store is None
+            or self._vector_store.base != base
+            # Another process compacted the file: switch with this load
+            or self._vector_store.generation != current_generation(base)
+        ):
+            self._vector_store = MappedVectorStore(base, dim)
+        return self._vector_store
+
+    def _signature(self) -> str:
+        # Vectors from a different encoder cannot reuse persisted codes or vectors
+        probe = self.encoder(["memory index signature"])[0]
+        return hashlib.sha1(np.round(probe, 4).tobytes()).hexdigest()[:10]
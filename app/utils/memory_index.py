@@ -0,0 +1,427 @@
+import os
+import tempfile
+import time
+import threading
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import numpy as np
+
+# Items an IVFPQIndex needs before it trains; below this, search stays exact
+IVFPQ_TRAIN_SIZE = 10000
+
+
+class MemoryIndex:
+    """Nearest-neighbour index over unit vectors, scored by inner product.
+
+    Items are numbered in insertion order (0, 1, 2, ...) so their ids line up
+    with positions in a ColumnarStore. Removed items are tombstoned: they stay
+    numbered but are never returned.
+    """
+
+    dim = 0
+
+    def add(self, vectors: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def remove(self, ids: Sequence[int]) -> None:
+        raise NotImplementedError
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, similarities) of up to k nearest live items, best first"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"type": type(self).__name__, "items": len(self)}
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = (
+        np.argpartition(-scores, k - 1)[:k]
+        if k < len(scores)
+        else np.arange(len(scores))
+    )
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class ExactIndex(MemoryIndex):
+    """Brute-force index: exact, and fastest below a few thousand items"""
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self._size = 0
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._alive = np.zeros(capacity, dtype=bool)
+
+    def add(self, vectors: np.ndarray) -> None:
+        count = len(vectors)
+        end = self._size + count
+        if end > len(self._alive):
+            capacity = max(end, 2 * len(self._alive))
+            vectors_grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            vectors_grown[: self._size] = self._vectors[: self._size]
+            alive_grown = np.zeros(capacity, dtype=bool)
+            alive_grown[: self._size] = self._alive[: self._size]
+            self._vectors, self._alive = vectors_grown, alive_grown
+        self._vectors[self._size : end] = vectors
+        self._alive[self._size : end] = True
+        self._size = end
+
+    def remove(self, ids: Sequence[int]) -> None:
+        ids = np.asarray(ids, dtype=np.int64)
+        self._alive[ids[(ids >= 0) & (ids < self._size)]] = False
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self._vectors[: self._size] @ query
+        scores[~self._alive[: self._size]] = -np.inf
+        top = _top_k(scores, min(k, len(self)))
+        return top, scores[top]
+
+    def vectors(self) -> np.ndarray:
+        return self._vectors[: self._size]
+
+    def __len__(self) -> int:
+        return int(self._alive[: self._size].sum())
+
+
+def _kmeans(
+    data: np.ndarray, k: int, iterations: int, rng: np.random.Generator, spherical: bool
+) -> np.ndarray:
+    """Lloyd's k-means; spherical mode assigns by inner product and keeps unit centroids"""
+    centroids = data[rng.choice(len(data), size=k, replace=len(data) < k)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(data, centroids, spherical)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters from random points
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+        if spherical:
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+    return centroids.astype(np.float32)
+
+
+def _nearest(
+    data: np.ndarray, centroids: np.ndarray, spherical: bool, chunk: int = 8192
+) -> np.ndarray:
+    """Index of the nearest centroid for every row, computed in chunks"""
+    assignments = np.empty(len(data), dtype=np.int64)
+    centroid_norms = (centroids**2).sum(axis=1)
+    for start in range(0, len(data), chunk):
+        products = data[start : start + chunk] @ centroids.T
+        if spherical:
+            assignments[start : start + chunk] = products.argmax(axis=1)
+        else:
+            # ||x - c||^2 up to the constant ||x||^2
+            assignments[start : start + chunk] = (centroid_norms - 2 * products).argmin(
+                axis=1
+            )
+    return assignments
+
+
+class IVFPQIndex(MemoryIndex):
+    """Inverted-file index with product-quantized residuals, in NumPy.
+
+    Vectors are assigned to the nearest of n_lists coarse centroids and the
+    residual is compressed to n_subvectors one-byte codes (48 bytes per 768-dim
+    vector). A query scores only the nprobe closest lists, using one lookup
+    table per query, so latency grows with list size rather than corpus size.
+    nprobe is the recall/latency knob.
+
+    Until train_size items have been added the index searches exactly; train()
+    then builds the quantizers (callers run it off the request path).
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        n_lists: Optional[int] = None,
+        n_subvectors: int = 48,
+        nprobe: int = 16,
+        train_size: int = IVFPQ_TRAIN_SIZE,
+        max_train_samples: int = 20000,
+        iterations: int = 10,
+        seed: int = 0,
+    ):
+        if dim % n_subvectors:
+            raise ValueError(f"dim {dim} is not divisible by {n_subvectors} subvectors")
+        self.dim = dim
+        self.n_lists = n_lists
+        self.n_subvectors = n_subvectors
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.max_train_samples = max_train_samples
+        self.iterations = iterations
+        self.seed = seed
+        self.trained_size = 0
+        self._exact = ExactIndex(dim)  # Used until the index is trained
+        self._coarse = None  # (n_lists, dim) unit centroids
+        self._codebooks = None  # (n_subvectors, 256, dim // n_subvectors)
+        self._size = 0
+        self._codes = np.zeros((0, n_subvectors), dtype=np.uint8)
+        self._lists = np.zeros(0, dtype=np.int32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._members = []  # Per list: ids in that list
+        self._member_arrays = []  # Per list: cached np.array of _members, or None
+        self._lock = threading.Lock()
+
+    @property
+    def trained(self) -> bool:
+        return self._coarse is not None
+
+    @property
+    def needs_training(self) -> bool:
+        exact = self._exact
+        return exact is not None and exact._size >= self.train_size
+
+    def train(self, vectors: Optional[np.ndarray] = None) -> None:
+        """Fit the coarse and product quantizers and encode the indexed items.
+
+        Without vectors, the items added so far are encoded; otherwise vectors
+        become the indexed items, numbered in order.
+        """
+        pending = self._exact.vectors() if vectors is None else vectors
+        if len(pending) == 0:
+            return
+        started = time.monotonic()
+        rng = np.random.default_rng(self.seed)
+        n_lists = self.n_lists or int(np.clip(4 * np.sqrt(len(pending)), 16, 4096))
+        sample = pending
+        if len(pending) > self.max_train_samples:
+            sample = pending[
+                rng.choice(len(pending), self.max_train_samples, replace=False)
+            ]
+
+        coarse = _kmeans(sample, n_lists, self.iterations, rng, spherical=True)
+        residuals = sample - coarse[_nearest(sample, coarse, spherical=True)]
+        sub_dim = self.dim // self.n_subvectors
+        codebooks = np.stack(
+            [
+                _kmeans(
+                    np.ascontiguousarray(residuals[:, j * sub_dim : (j + 1) * sub_dim]),
+                    256,
+                    self.iterations,
+                    rng,
+                    spherical=False,
+                )
+                for j in range(self.n_subvectors)
+            ]
+        )
+
+        lists, codes = self._encode_with(coarse, codebooks, pending)
+        alive = (
+            self._exact._alive[: self._exact._size].copy() if vectors is None else None
+        )
+        with self._lock:
+            self.n_lists = n_lists
+            self._coarse, self._codebooks = coarse, codebooks
+            self._reset_lists()
+            self._append_codes(lists, codes)
+            if alive is not None:
+                self._alive[: len(alive)] &= alive
+            self._exact = None
+            self.trained_size = len(pending)
+        print(
+            f"Trained IVF-PQ index on {len(pending)} vectors ({n_lists} lists) "
+            f"in {(time.monotonic() - started):.1f} s"
+        )
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(list assignments, PQ codes) of vectors under the trained quantizers"""
+        return self._encode_with(self._coarse, self._codebooks, vectors)
+
+    def add(self, vectors: np.ndarray) -> None:
+        if len(vectors) == 0:
+            return
+        with self._lock:
+            # Re-checked under the lock: a concurrent train() drops _exact
+            if not self.trained:
+                self._exact.add(vectors)
+                return
+            coarse, codebooks = self._coarse, self._codebooks
+        lists, codes = self._encode_with(coarse, codebooks, vectors)
+        with self._lock:
+            self._append_codes(lists, codes)
+
+    def add_encoded(self, lists: np.ndarray, codes: np.ndarray) -> None:
+        """Append items that were encoded earlier (e.g. restored from disk)"""
+        with self._lock:
+            self._append_codes(lists, codes)
+
+    def remove(self, ids: Sequence[int]) -> None:
+        with self._lock:
+            if not self.trained:
+                self._exact.remove(ids)
+                return
+            ids = np.asarray(ids, dtype=np.int64)
+            self._alive[ids[(ids >= 0) & (ids < self._size)]] = False
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Quantizers, lists and codes are read together so a concurrent train()
+        # cannot swap them (or drop _exact) halfway through
+        with self._lock:
+            if not self.trained:
+                return self._exact.search(query, k)
+            codebooks = self._codebooks
+            coarse_scores = self._coarse @ query
+            probe = _top_k(coarse_scores, self.nprobe)
+            members = [self._member_array(int(list_id)) for list_id in probe]
+            codes, alive = self._codes, self._alive
+        ids = np.concatenate(members) if members else np.zeros(0, dtype=np.int64)
+        if len(ids) == 0:
+            return ids, np.zeros(0, dtype=np.float32)
+
+        # Inner product = q . centroid + sum over subspaces of q_j . codeword_j
+        sub_dim = self.dim // self.n_subvectors
+        table = np.einsum(
+            "mkd,md->mk",
+            codebooks,
+            query.reshape(self.n_subvectors, sub_dim),
+        )
+        list_scores = np.repeat(coarse_scores[probe], [len(m) for m in members])
+        scores = list_scores + table[np.arange(self.n_subvectors), codes[ids]].sum(
+            axis=1
+        )
+        scores[~alive[ids]] = -np.inf
+        top = _top_k(scores, k)
+        top = top[np.isfinite(scores[top])]
+        return ids[top], scores[top].astype(np.float32)
+
+    def codes_for(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(list assignments, codes) of existing items, for persistence"""
+        return self._lists[ids], self._codes[ids]
+
+    def __len__(self) -> int:
+        with self._lock:
+            if not self.trained:
+                return len(self._exact)
+            return int(self._alive[: self._size].sum())
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update(
+            {
+                "trained": self.trained,
+                "n_lists": self.n_lists,
+                "nprobe": self.nprobe,
+                "tombstones": (self._size - len(self)) if self.trained else 0,
+            }
+        )
+        return stats
+
+    def save(self, path: str, keys: List[str]) -> None:
+        """Persist quantizers and codes; keys[i] identifies item i (e.g. its row id)"""
+        if not self.trained:
+            return
+        with self._lock:
+            size = self._size
+            alive = self._alive[:size].copy()
+            lists, codes = self._lists[:size].copy(), self._codes[:size].copy()
+        keep = alive & np.array([key is not None for key in keys[:size]], dtype=bool)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # A unique temp file, so workers saving at once never share one
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".", suffix=".npz"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    coarse=self._coarse,
+                    codebooks=self._codebooks,
+                    lists=lists[keep],
+                    codes=codes[keep],
+                    keys=np.array([str(key) for key, k in zip(keys, keep) if k]),
+                    trained_size=np.array(self.trained_size),
+                )
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(
+        cls, path: str, **params
+    ) -> Tuple["IVFPQIndex", Dict[str, Tuple[int, np.ndarray]]]:
+        """Restore quantizers from path; returns the empty index and key -> (list, codes)"""
+        with np.load(path) as data:
+            coarse, codebooks = data["coarse"], data["codebooks"]
+            index = cls(
+                coarse.shape[1],
+                n_lists=coarse.shape[0],
+                n_subvectors=codebooks.shape[0],
+                **params,
+            )
+            index._coarse, index._codebooks = coarse, codebooks
+            index._exact = None
+            index.trained_size = int(data["trained_size"])
+            index._reset_lists()
+            encoded = {
+                key: (int(list_id), code)
+                for key, list_id, code in zip(
+                    data["keys"].tolist(), data["lists"], data["codes"]
+                )
+            }
+        return index, encoded
+
+    def _encode_with(
+        self, coarse: np.ndarray, codebooks: np.ndarray, vectors: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        lists = _nearest(vectors, coarse, spherical=True)
+        residuals = vectors - coarse[lists]
+        sub_dim = self.dim // self.n_subvectors
+        codes = np.empty((len(vectors), self.n_subvectors), dtype=np.uint8)
+        for j in range(self.n_subvectors):
+            codes[:, j] = _nearest(
+                np.ascontiguousarray(residuals[:, j * sub_dim : (j + 1) * sub_dim]),
+                codebooks[j],
+                spherical=False,
+            )
+        return lists.astype(np.int32), codes
+
+    def _reset_lists(self) -> None:
+        self._size = 0
+        self._codes = np.zeros((0, self.n_subvectors), dtype=np.uint8)
+        self._lists = np.zeros(0, dtype=np.int32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._members = [[] for _ in range(self.n_lists)]
+        self._member_arrays = [None] * self.n_lists
+
+    def _append_codes(self, lists: np.ndarray, codes: np.ndarray) -> None:
+        count = len(lists)
+        start, end = self._size, self._size + count
+        if end > len(self._alive):
+            capacity = max(end, 2 * len(self._alive), 1024)
+            self._codes = _grown(self._codes, capacity)
+            self._lists = _grown(self._lists, capacity)
+            self._alive = _grown(self._alive, capacity)
+        self._codes[start:end] = codes
+        self._lists[start:end] = lists
+        self._alive[start:end] = True
+        for item_id, list_id in zip(range(start, end), lists.tolist()):
+            self._members[list_id].append(item_id)
+            self._member_arrays[list_id] = None
+        self._size = end
+
+    def _member_array(self, list_id: int) -> np.ndarray:
+        members = self._member_arrays[list_id]
+        if members is None:
+            members = np.array(self._members[list_id], dtype=np.int64)
+            self._member_arrays[list_id] = members
+        return members
+
+
+def _grown(array: np.ndarray, capacity: int) -> np.ndarray:
+    grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
@@ -0,0 +1,120 @@
+import re
+import zlib
+import threading
+from typing import List, Dict, Any, Callable, Optional, Sequence, Tuple
+import numpy as np
+
+# Mersenne prime for the universal hash family; products stay below 2**62
+_PRIME = (1 << 31) - 1
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def normalize(text: str) -> str:
+    """Lowercase text with punctuation removed and whitespace collapsed"""
+    return " ".join(_NON_WORD.sub(" ", (text or "").lower()).split())
+
+
+class MinHashLSH:
+    """MinHash signatures of character shingles with banded LSH buckets.
+
+    Documents are numbered in insertion order (like BM25Index) so ids line up
+    with ColumnarStore positions. A query only compares the signature against
+    documents sharing at least one band bucket; with 16 bands of 8 rows a pair
+    with Jaccard similarity 0.9 collides with probability ~0.9999, at 0.8 with
+    ~0.95 and at 0.5 with ~0.06. Removed documents are tombstoned.
+    """
+
+    def __init__(
+        self, num_perm: int = 128, bands: int = 16, shingle_size: int = 4, seed: int = 1
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(bands)]  # Band bytes -> [doc ids]
+        self._signatures = np.zeros((1024, num_perm), dtype=np.uint32)
+        self._alive = np.zeros(1024, dtype=bool)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return int(self._alive[: self._size].sum())
+
+    def signature(self, text: str) -> np.ndarray:
+        text = normalize(text)
+        n = self.shingle_size
+        shingles = {text[i : i + n] for i in range(max(1, len(text) - n + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) % _PRIME for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        permuted = (hashes[None, :] * self._a[:, None] + self._b[:, None]) % _PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.num_perm), dtype=np.uint32)
+        return np.stack([self.signature(text) for text in texts])
+
+    def add(self, signatures: np.ndarray) -> None:
+        with self._lock:
+            for signature in signatures:
+                if self._size == len(self._alive):
+                    self._signatures = np.concatenate(
+                        [self._signatures, np.zeros_like(self._signatures)]
+                    )
+                    self._alive = np.concatenate(
+                        [self._alive, np.zeros_like(self._alive)]
+                    )
+                doc_id = self._size
+                self._signatures[doc_id] = signature
+                self._alive[doc_id] = True
+                for band, key in enumerate(self._band_keys(signature)):
+                    self._buckets[band].setdefault(key, []).append(doc_id)
+                self._size += 1
+
+    def remove(self, ids: Sequence[int]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                if 0 <= int(doc_id) < self._size:
+                    self._alive[int(doc_id)] = False
+
+    def query(
+        self,
+        signature: np.ndarray,
+        threshold: float,
+        accept: Optional[Callable[[int], bool]] = None,
+    ) -> Optional[Tuple[int, float]]:
+        """(id, estimated Jaccard similarity) of the closest live document at or above
+        threshold, among the documents accept(id) allows if given"""
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                candidates.update(self._buckets[band].get(key, ()))
+            candidates = [
+                doc_id
+                for doc_id in candidates
+                if self._alive[doc_id] and (accept is None or accept(doc_id))
+            ]
+            if not candidates:
+                return None
+            similarity = (self._signatures[candidates] == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] < threshold:
+            return None
+        return candidates[best], float(similarity[best])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "documents": int(self._alive[: self._size].sum()),
+                "buckets": sum(len(buckets) for buckets in self._buckets),
+            }
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [band.tobytes() for band in np.split(signature, self.bands)]
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+from types import MappingProxyType
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+
+class ReferenceSnapshot:
+    """Immutable copy of a table: read-only rows plus an optional derived index"""
+
+    def __init__(self, rows: List[Dict], fingerprint: Optional[str], index: Any = None):
+        self.rows = tuple(MappingProxyType(dict(row)) for row in rows)
+        self.fingerprint = fingerprint
+        self.index = index
+        self.loaded_at = time.time()
+
+    def where(self, **columns) -> List:
+        """Rows whose columns equal the given values"""
+        return [
+            row
+            for row in self.rows
+            if all(row.get(column) == value for column, value in columns.items())
+        ]
+
+
+class ReferenceTable:
+    """One cached table. Readers take `snapshot` without locking; refreshes
+    build a new ReferenceSnapshot and swap the reference (copy-on-write)."""
+
+    def __init__(
+        self,
+        name: str,
+        build: Optional[Callable[[Tuple], Any]] = None,
+        version_column: str = "created_at",
+    ):
+        self.name = name
+        self.build = build
+        self.version_column = version_column
+        self.snapshot = ReferenceSnapshot([], None, build(()) if build else None)
+        self.version = None  # (row count, newest version_column) at the last fetch
+        self.checked_at = None  # time.time() of the last successful probe or fetch
+        self.attempted_at = None  # time.monotonic() of the last fetch attempt
+        self.fetched_at = None  # time.monotonic() of the last successful fetch
+        self.stats = {
+            "checks": 0,
+            "fetches": 0,
+            "reloads": 0,
+            "errors": 0,
+            "last_error": None,
+        }
+
+    @property
+    def loaded(self) -> bool:
+        return self.snapshot.fingerprint is not None
+
+
+class ReferenceDataCache:
+    """In-memory snapshots of small, rarely changing Supabase tables.
+
+    Each registered table is fetched whole and kept as an immutable snapshot,
+    so lookups are plain reads of Python objects instead of HTTP round trips.
+    Every refresh_interval seconds a background thread probes each table with
+    a one-row query for its row count and newest version_column, and fetches
+    the table again only when that changed (or immediately after invalidate()).
+    Edits that touch neither are picked up by a full fetch at least every
+    full_refresh_interval seconds. A new snapshot is swapped in only when the
+    content changed. A table nobody has loaded yet is fetched on first read.
+    Like WriteBehindQueue, the thread starts lazily in each process.
+    """
+
+    def __init__(
+        self,
+        supabase,
+        app=None,
+        refresh_interval: float = 60,
+        full_refresh_interval: float = 3600,
+    ):
+        self.supabase = supabase
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.app = None
+        self._tables = {}
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pending = set()  # Tables invalidated since the last refresh
+        self._pending_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["reference_data"] = self
+        atexit.register(self.close)
+
+    def register(
+        self,
+        name: str,
+        build: Optional[Callable[[Tuple], Any]] = None,
+        version_column: str = "created_at",
+    ) -> ReferenceTable:
+        """Cache table name; build(rows) derives an index stored on each snapshot.
+
+        version_column is a timestamp that changes with every insert (and, if
+        the table has one, every update) and is used to detect changes.
+        """
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = ReferenceTable(name, build, version_column)
+        return table
+
+    def get(self, name: str) -> ReferenceSnapshot:
+        """Current snapshot of a registered table, loading it on first use"""
+        table = self._tables[name]
+        self._ensure_worker()
+        if not table.loaded and (
+            table.attempted_at is None
+            or time.monotonic() - table.attempted_at >= self.refresh_interval
+        ):
+            self.refresh(name)
+        return table.snapshot
+
+    def invalidate(self, name: Optional[str] = None) -> List[str]:
+        """Schedule an immediate background reload of one table (or all of them)"""
+        names = [name] if name else list(self._tables)
+        unknown = [n for n in names if n not in self._tables]
+        if unknown:
+            raise KeyError(f"Unknown reference table: {unknown[0]}")
+        with self._pending_lock:
+            self._pending.update(names)
+        self._ensure_worker()
+        self._wake.set()
+        return names
+
+    def check(self, name: str) -> bool:
+        """Probe a table and fetch it only if it changed; True if its snapshot changed"""
+        table = self._tables[name]
+        if (
+            table.fetched_at is not None
+            and time.monotonic() - table.fetched_at < self.full_refresh_interval
+        ):
+            table.stats["checks"] += 1
+            try:
+                version = self._probe(table)
+            except Exception as e:
+                table.stats["errors"] += 1
+                table.stats["last_error"] = str(e)
+                print(f"Error checking {name}: {e}")
+                return False
+            if version == table.version:
+                table.checked_at = time.time()
+                return False
+        return self.refresh(name)
+
+    def refresh(self, name: str) -> bool:
+        """Fetch a table now; True if its snapshot changed"""
+        table = self._tables[name]
+        with self._refresh_lock:
+            table.attempted_at = time.monotonic()
+            table.stats["fetches"] += 1
+            try:
+                # Probed first: a change landing between the two is seen next check
+                version = self._probe(table)
+            except Exception as e:
+                # Without a version every check fails, so only full refreshes apply
+                version = None
+                print(f"Error checking {name}: {e}")
+            try:
+                rows = self.supabase.client.table(name).select("*").execute().data or []
+            except Exception as e:
+                table.stats["errors"] += 1
+                table.stats["last_error"] = str(e)
+                print(f"Error refreshing {name}: {e}")
+                return False
+
+            table.version = version
+            table.fetched_at = time.monotonic()
+            table.checked_at = time.time()
+            fingerprint = hashlib.sha1(
+                json.dumps(rows, sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest()
+            if fingerprint == table.snapshot.fingerprint:
+                return False
+            snapshot = ReferenceSnapshot(rows, fingerprint)
+            if table.build:
+                snapshot.index = table.build(snapshot.rows)
+            table.snapshot = snapshot
+            table.stats["reloads"] += 1
+            print(f"✓ Loaded {len(rows)} rows of {name}")
+            return True
+
+    def _probe(self, table: ReferenceTable) -> Tuple[Optional[int], Any]:
+        """(row count, newest version_column) of a table, from a one-row query"""
+        response = (
+            self.supabase.client.table(table.name)
+            .select(table.version_column, count="exact")
+            .order(table.version_column, desc=True)
+            .limit(1)
+            .execute()
+        )
+        newest = response.data[0][table.version_column] if response.data else None
+        return response.count, newest
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        stats = {}
+        for name, table in self._tables.items():
+            snapshot = table.snapshot
+            stats[name] = dict(
+                table.stats,
+                rows=len(snapshot.rows),
+                loaded=table.loaded,
+                # Age of the data readers see, and time since content last changed
+                stale_seconds=now - table.checked_at if table.checked_at else None,
+                unchanged_seconds=now - snapshot.loaded_at if table.loaded else None,
+            )
+        return stats
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self.app is None:
+                raise RuntimeError("ReferenceDataCache.init_app() has not been called")
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="reference-data", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        with self.app.app_context():
+            while not self._stop.is_set():
+                woken = self._wake.wait(self.refresh_interval)
+                self._wake.clear()
+                if self._stop.is_set():
+                    return
+                if woken:
+                    with self._pending_lock:
+                        names, self._pending = self._pending, set()
+                    for name in names:
+                        self.refresh(name)
+                else:
+                    for name in list(self._tables):
+                        self.check(name)
@@ -0,0 +1,151 @@
+import re
+import time
+import hashlib
+import difflib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivial variants share a key"""
+    text = re.sub(r"[^\w\s']", " ", text.lower())
+    return " ".join(text.split())
+
+
+def fingerprint_context(*parts: str) -> str:
+    """Stable fingerprint of the prompt content a reply was generated from"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of raw LLM completions keyed by (context fingerprint, message).
+
+    Lookups first try the exact normalized message; if near-duplicate matching is
+    enabled they then compare against other messages cached under the same context
+    fingerprint using a cheap character similarity ratio.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl: float = 600,
+        near_duplicates: bool = True,
+        similarity_threshold: float = 0.9,
+        max_near_candidates: int = 64,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.similarity_threshold = similarity_threshold
+        self.max_near_candidates = max_near_candidates
+        self._entries = OrderedDict()  # (fingerprint, message) -> (response, stored_at)
+        self._by_fingerprint = {}  # fingerprint -> set of cached messages
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "near_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def get(self, message: str, fingerprint: str) -> Optional[str]:
+        """Return a cached raw response for message under fingerprint, if any"""
+        normalized = normalize_message(message)
+        now = time.monotonic()
+
+        with self._lock:
+            response = self._lookup((fingerprint, normalized), now)
+            if response is not None:
+                self._stats["hits"] += 1
+                return response
+
+            if self.near_duplicates and normalized:
+                match = self._find_near_duplicate(fingerprint, normalized)
+                if match is not None:
+                    response = self._lookup((fingerprint, match), now)
+                    if response is not None:
+                        self._stats["near_hits"] += 1
+                        return response
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, message: str, fingerprint: str, response: str) -> None:
+        normalized = normalize_message(message)
+        if not normalized or not response:
+            return
+
+        key = (fingerprint, normalized)
+        with self._lock:
+            self._entries[key] = (response, time.monotonic())
+            self._entries.move_to_end(key)
+            self._by_fingerprint.setdefault(fingerprint, set()).add(normalized)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._forget(old_key)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_fingerprint.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["near_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["hits"] + stats["near_hits"]) / lookups if lookups else 0.0
+        )
+        return stats
+
+    def _lookup(self, key: tuple, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, stored_at = entry
+        if now - stored_at > self.ttl:
+            del self._entries[key]
+            self._forget(key)
+            self._stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def _find_near_duplicate(self, fingerprint: str, normalized: str) -> Optional[str]:
+        candidates = self._by_fingerprint.get(fingerprint)
+        if not candidates:
+            return None
+
+        matcher = difflib.SequenceMatcher(autojunk=False)
+        matcher.set_seq2(normalized)
+        best, best_ratio = None, self.similarity_threshold
+        for i, candidate in enumerate(candidates):
+            if i >= self.max_near_candidates:
+                break
+            matcher.set_seq1(candidate)
+            # quick_ratio is an upper bound, so skip the full comparison when it cannot win
+            if matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = candidate, ratio
+        return best
+
+    def _forget(self, key: tuple) -> None:
+        fingerprint, normalized = key
+        messages = self._by_fingerprint.get(fingerprint)
+        if messages is not None:
+            messages.discard(normalized)
+            if not messages:
+                del self._by_fingerprint[fingerprint]
+
+
+response_cache = ResponseCache()
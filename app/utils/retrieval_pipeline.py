@@ -0,0 +1,167 @@
+import time
+import threading
+from typing import List, Dict, Any, Callable, Optional, Tuple
+import numpy as np
+from app.utils.memory_cache import parse_timestamp
+
+# Stages timed by RetrievalPipeline, in order
+PIPELINE_STAGES = ("dedupe", "fuse", "mmr")
+
+
+def row_key(row: Dict) -> Tuple[float, str]:
+    """Identity of a memory across sources.
+
+    Rows appended by this process have no database id yet, so rows are matched
+    on creation time (to the millisecond) and message instead.
+    """
+    return (
+        round(parse_timestamp(row.get("created_at")), 3),
+        row.get("user_message", ""),
+    )
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Dict[str, List[Dict]],
+    k: int = 60,
+    weights: Optional[Dict[str, float]] = None,
+) -> List[Tuple[Dict, float]]:
+    """Fuse ranked lists: each item scores sum(weight / (k + rank)) over the lists it is in"""
+    fused, items = {}, {}
+    for source, rows in ranked_lists.items():
+        weight = (weights or {}).get(source, 1.0)
+        for rank, row in enumerate(rows, 1):
+            key = row_key(row)
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+            items.setdefault(key, row)
+    return sorted(
+        ((items[key], score) for key, score in fused.items()),
+        key=lambda pair: pair[1],
+        reverse=True,
+    )
+
+
+def mmr_select(
+    relevance: np.ndarray, vectors: np.ndarray, limit: int, diversity: float = 0.5
+) -> List[int]:
+    """Maximal marginal relevance: greedily pick relevant items unlike those already picked"""
+    if len(relevance) == 0:
+        return []
+    relevance = relevance / (relevance.max() or 1.0)
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    # Highest similarity of every candidate to anything selected so far
+    redundancy = similarity[selected[0]].copy()
+    while len(selected) < min(limit, len(relevance)):
+        scores = (1 - diversity) * relevance - diversity * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+class RetrievalPipeline:
+    """Turns per-source candidate lists into one fixed-size, diverse context set.
+
+    Stages: dedupe (drop candidates already in recent context and repeats
+    across sources), fuse (reciprocal-rank fusion of the ranked sources) and
+    mmr (diversity). Each stage is timed per call and in aggregate.
+
+    MMR takes candidate vectors from vector_lookup (e.g. CachedTable.vectors_for)
+    where it has them and only encodes the rest.
+    """
+
+    def __init__(
+        self,
+        encoder: Callable[[List[str]], np.ndarray],
+        text_fn: Callable[[Dict], str],
+        rrf_k: int = 60,
+        diversity: float = 0.5,
+        weights: Optional[Dict[str, float]] = None,
+        vector_lookup: Optional[
+            Callable[[List[Dict]], Tuple[np.ndarray, np.ndarray]]
+        ] = None,
+    ):
+        self.encoder = encoder
+        self.text_fn = text_fn
+        self.rrf_k = rrf_k
+        self.diversity = diversity
+        self.weights = weights
+        self.vector_lookup = vector_lookup
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "duplicates_removed": 0,
+            "vectors_reused": 0,
+            "vectors_encoded": 0,
+        }
+        self._stage_ms = dict.fromkeys(PIPELINE_STAGES, 0.0)
+
+    def run(
+        self, ranked_lists: Dict[str, List[Dict]], exclude: List[Dict], limit: int
+    ) -> Tuple[List[Dict], Dict[str, float]]:
+        """Return up to limit fused, diverse rows and the per-stage timings in ms"""
+        timings = {}
+
+        started = time.perf_counter()
+        excluded = {row_key(row) for row in exclude}
+        candidates = {
+            source: [row for row in rows if row_key(row) not in excluded]
+            for source, rows in ranked_lists.items()
+        }
+        removed = sum(len(rows) for rows in ranked_lists.values()) - sum(
+            len(rows) for rows in candidates.values()
+        )
+        timings["dedupe"] = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        fused = reciprocal_rank_fusion(candidates, self.rrf_k, self.weights)
+        timings["fuse"] = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        if len(fused) > limit:
+            vectors = self._vectors([row for row, _ in fused])
+            relevance = np.array([score for _, score in fused], dtype=np.float32)
+            picked = mmr_select(relevance, vectors, limit, self.diversity)
+            fused = [fused[i] for i in picked]
+        results = [dict(row, fused_score=score) for row, score in fused]
+        timings["mmr"] = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["duplicates_removed"] += removed
+            for stage, ms in timings.items():
+                self._stage_ms[stage] += ms
+        return results, timings
+
+    def _vectors(self, rows: List[Dict]) -> np.ndarray:
+        """Vectors of rows, looked up where possible and encoded otherwise"""
+        found = np.zeros(0, dtype=np.int64)
+        if self.vector_lookup is not None:
+            try:
+                found, cached = self.vector_lookup(rows)
+            except Exception as e:
+                print(f"Error looking up candidate vectors: {e}")
+                found = np.zeros(0, dtype=np.int64)
+        missing = np.setdiff1d(np.arange(len(rows)), found)
+        with self._lock:
+            self._stats["vectors_reused"] += len(found)
+            self._stats["vectors_encoded"] += len(missing)
+        if not len(found):
+            return self.encoder([self.text_fn(row) for row in rows])
+
+        vectors = np.empty((len(rows), cached.shape[1]), dtype=np.float32)
+        vectors[found] = cached
+        if len(missing):
+            vectors[missing] = self.encoder([self.text_fn(rows[i]) for i in missing])
+        return vectors
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            runs = stats["runs"]
+            stats["avg_stage_ms"] = {
+                stage: round(ms / runs, 3) if runs else 0.0
+                for stage, ms in self._stage_ms.items()
+            }
+        return stats
@@ -0,0 +1,102 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from typing import List, Dict, Optional
+
+# Seconds a session buffer is trusted after it was rehydrated. Other workers may
+# have stored turns of the same conversation meanwhile, so a buffer older than
+# this is re-read from memory_stream. It must outlast the gap between a person's
+# messages for the cache to save reads; lower it when requests of one
+# conversation spread across workers, raise it with sticky routing
+SESSION_MAX_AGE = float(os.environ.get("SESSION_MAX_AGE", "300"))
+
+
+def parse_conversation_id(value) -> Optional[str]:
+    """Return value as a canonical UUID string, or None if it is not a valid UUID"""
+    if not value:
+        return None
+    try:
+        return str(uuid.UUID(str(value)))
+    except (ValueError, TypeError):
+        return None
+
+
+class ConversationSessionCache:
+    """In-process ring buffers holding the latest turns of each conversation.
+
+    Sessions are evicted least-recently-used once max_sessions is reached, and
+    expire after ttl seconds without activity or max_age seconds after they were
+    loaded, whichever comes first; max_age bounds how long turns stored by other
+    workers can be missing. A session that is not cached is "cold" and should be
+    rehydrated from memory_stream by its conversation_id.
+    """
+
+    def __init__(
+        self,
+        max_turns: int = 10,
+        max_sessions: int = 1000,
+        ttl: float = 3600,
+        max_age: float = SESSION_MAX_AGE,
+    ):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_age = max_age
+        # conversation_id -> (deque of turns, last_used, loaded_at)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: str) -> Optional[List[Dict]]:
+        """Return the cached turns (oldest first), or None if the session is cold"""
+        with self._lock:
+            entry = self._sessions.get(conversation_id)
+            if entry is None:
+                return None
+            turns, last_used, loaded_at = entry
+            now = time.monotonic()
+            if now - last_used > self.ttl or now - loaded_at > self.max_age:
+                del self._sessions[conversation_id]
+                return None
+            self._sessions[conversation_id] = (turns, now, loaded_at)
+            self._sessions.move_to_end(conversation_id)
+            return list(turns)
+
+    def load(self, conversation_id: str, turns: List[Dict]) -> None:
+        """Warm a session with turns rehydrated from the database (oldest first)"""
+        with self._lock:
+            now = time.monotonic()
+            self._sessions[conversation_id] = (
+                deque(turns[-self.max_turns :], maxlen=self.max_turns),
+                now,
+                now,
+            )
+            self._sessions.move_to_end(conversation_id)
+            self._evict()
+
+    def append(self, conversation_id: str, turn: Dict) -> None:
+        """Record a new turn for a warm session; cold sessions rehydrate on next read"""
+        with self._lock:
+            entry = self._sessions.get(conversation_id)
+            if entry is None:
+                return
+            turns, _, loaded_at = entry
+            turns.append(turn)
+            self._sessions[conversation_id] = (turns, time.monotonic(), loaded_at)
+            self._sessions.move_to_end(conversation_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "max_age": self.max_age,
+            }
+
+    def _evict(self) -> None:
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+
+session_cache = ConversationSessionCache()
@@ -0,0 +1,77 @@
+import re
+from typing import List
+
+# Common English words that carry no topical meaning
+STOP_WORDS = frozenset(
+    {
+        "the",
+        "a",
+        "an",
+        "and",
+        "or",
+        "but",
+        "in",
+        "on",
+        "at",
+        "to",
+        "for",
+        "of",
+        "with",
+        "by",
+        "is",
+        "are",
+        "was",
+        "were",
+        "be",
+        "been",
+        "have",
+        "has",
+        "had",
+        "do",
+        "does",
+        "did",
+        "will",
+        "would",
+        "could",
+        "should",
+        "may",
+        "might",
+        "can",
+        "this",
+        "that",
+        "these",
+        "those",
+        "i",
+        "you",
+        "he",
+        "she",
+        "it",
+        "we",
+        "they",
+        "me",
+        "him",
+        "her",
+        "us",
+        "them",
+    }
+)
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens of text without stop words or words of two letters or less"""
+    return [
+        word
+        for word in _WORD_PATTERN.findall(text.lower())
+        if len(word) > 2 and word not in STOP_WORDS
+    ]
+
+
+def extract_keywords(text: str, limit: int) -> List[str]:
+    """First `limit` whitespace-separated words of text that are not stop words"""
+    words = text.split()
+    keywords = [
+        word for word in words if word.lower() not in STOP_WORDS and len(word) > 2
+    ]
+    return keywords[:limit]
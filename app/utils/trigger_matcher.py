@@ -0,0 +1,69 @@
+from collections import deque
+from typing import List, Dict, Set
+
+
+class TriggerAutomaton:
+    """Aho-Corasick automaton finding every pattern occurring in a text in one pass.
+
+    Matching is case-insensitive substring matching, the same as
+    `pattern.lower() in text.lower()` for each pattern, but the cost is linear
+    in the text whatever the number of patterns.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self._goto = [{}]  # State -> {char: next state}
+        self._fail = [0]
+        self._output = [[]]  # State -> indices of patterns ending here
+        for index, pattern in enumerate(patterns):
+            pattern = (pattern or "").lower()
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(index)
+
+        # Breadth-first so each state's failure link is final before its children's
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = (
+                    self._output[child] + self._output[self._fail[child]]
+                )
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def search(self, text: str) -> Set[int]:
+        """Indices of the patterns occurring in text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found, state = set(), 0
+        for char in (text or "").lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+def match_triggers(snapshot, texts: List[str]) -> List[Dict]:
+    """Rows of an emotional_triggers snapshot (index: TriggerAutomaton) found in texts"""
+    return [
+        snapshot.rows[index]
+        for text in texts
+        for index in sorted(snapshot.index.search(text))
+    ]
@@ -0,0 +1,214 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows: single-process use only
+    fcntl = None
+
+# Rows dequantized per block while scoring, bounding the float32 scratch memory
+SCORE_BLOCK_ROWS = 2048
+
+
+def quantize(vectors: np.ndarray):
+    """Symmetric per-vector int8 quantization: vector ~= codes * scale"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class MappedVectorStore:
+    """Append-only int8 vector file shared by processes through the page cache.
+
+    Three files share a prefix: `.i8` holds the quantized vectors (dim bytes a
+    row), `.scale` one float32 scale per row and `.keys` one key per line. Every
+    process maps the same files read-only, so gunicorn workers hold one copy of
+    the corpus between them. Appends take an exclusive file lock, pick up rows
+    other processes appended and reuse the row of a key that is already stored.
+
+    Rows are never removed in place. compact() copies the rows still in use into
+    a new generation of files and points `base.current` at it; processes switch
+    on their next reload, and meanwhile keep reading their mapped old files. The
+    generation before the current one is kept for them and older ones deleted.
+    """
+
+    def __init__(self, base: str, dim: int, generation: Optional[int] = None):
+        self.base = base
+        self.generation = current_generation(base) if generation is None else generation
+        self.prefix = _generation_prefix(base, self.generation)
+        self.dim = dim
+        self._rows = {}  # Key -> row
+        self._count = 0
+        self._keys_offset = 0
+        self._codes = np.zeros((0, dim), dtype=np.int8)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.prefix) or ".", exist_ok=True)
+        with self._file_lock():
+            for suffix in (".i8", ".scale", ".keys"):
+                open(self.prefix + suffix, "ab").close()
+            self._refresh()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, keys: Sequence[str], vectors: np.ndarray) -> np.ndarray:
+        """Store vectors under keys; returns their rows (existing keys keep theirs)"""
+        rows = np.empty(len(keys), dtype=np.int64)
+        with self._lock, self._file_lock():
+            if not os.path.exists(self.prefix + ".i8"):
+                raise RuntimeError(f"{self.prefix} was compacted away; reload it")
+            self._refresh()
+            new = {}  # Key -> (row, position of its vector in this call)
+            for i, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is None:
+                    if key not in new:
+                        new[key] = (self._count + len(new), i)
+                    row = new[key][0]
+                rows[i] = row
+            if new:
+                codes, scales = quantize(vectors[[i for _, i in new.values()]])
+                # Drop a partial append left by a crashed writer
+                os.truncate(self.prefix + ".keys", self._keys_offset)
+                os.truncate(self.prefix + ".scale", self._count * 4)
+                os.truncate(self.prefix + ".i8", self._count * self.dim)
+                # Vectors last: a row exists once all three files hold it
+                with open(self.prefix + ".keys", "ab") as f:
+                    f.write("".join(f"{key}\n" for key in new).encode("utf-8"))
+                with open(self.prefix + ".scale", "ab") as f:
+                    f.write(scales.tobytes())
+                with open(self.prefix + ".i8", "ab") as f:
+                    f.write(codes.tobytes())
+                self._refresh()
+        return rows
+
+    def similarity(self, query: np.ndarray, rows: Optional[np.ndarray] = None):
+        """Dot products of query with the given rows (all rows if None)"""
+        codes, scales = self._codes, self._scales
+        query = np.asarray(query, dtype=np.float32)
+        if rows is not None:
+            return (codes[rows].astype(np.float32) @ query) * scales[rows]
+        result = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start : start + SCORE_BLOCK_ROWS].astype(np.float32)
+            result[start : start + len(block)] = block @ query
+        return result * scales
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Dequantized float32 copies of rows"""
+        return self._codes[rows].astype(np.float32) * self._scales[rows, None]
+
+    def compact(
+        self, rows: np.ndarray
+    ) -> Tuple["MappedVectorStore", Optional[np.ndarray]]:
+        """Copy rows (the ones still in use) into a new generation of files.
+
+        Returns the new store and each old row's row in it (-1 if dropped), or
+        this store and None if another process already compacted it.
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        with self._lock, self._file_lock():
+            if current_generation(self.base) != self.generation:
+                return self, None
+            self._refresh()
+            keys_by_row = {row: key for key, row in self._rows.items()}
+            generation = self.generation + 1
+            prefix = _generation_prefix(self.base, generation)
+            # The new generation is unused until base.current names it
+            with open(prefix + ".keys", "wb") as f:
+                f.write(
+                    "".join(f"{keys_by_row[row]}\n" for row in rows).encode("utf-8")
+                )
+            with open(prefix + ".scale", "wb") as f:
+                f.write(np.ascontiguousarray(self._scales[rows]).tobytes())
+            with open(prefix + ".i8", "wb") as f:
+                f.write(np.ascontiguousarray(self._codes[rows]).tobytes())
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.base) or ".")
+            with os.fdopen(fd, "w") as f:
+                f.write(str(generation))
+            os.replace(temp_path, self.base + ".current")
+            # Mapped files stay readable after unlinking, so deleting is safe
+            if self.generation > 0:
+                for suffix in (".i8", ".scale", ".keys", ".lock"):
+                    try:
+                        os.remove(
+                            _generation_prefix(self.base, self.generation - 1) + suffix
+                        )
+                    except OSError:
+                        pass
+
+        mapping = np.full(self._count, -1, dtype=np.int64)
+        mapping[rows] = np.arange(len(rows))
+        print(
+            f"Compacted {self.base} from {self._count} to {len(rows)} vectors "
+            f"(generation {generation})"
+        )
+        return MappedVectorStore(self.base, self.dim, generation), mapping
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "generation": self.generation,
+            "rows": self._count,
+            "mapped_mb": round(self._count * (self.dim + 4) / 2**20, 1),
+        }
+
+    def _refresh(self) -> None:
+        """Map rows appended since the last refresh (by any process)"""
+        with open(self.prefix + ".keys", "rb") as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        complete = data[: data.rfind(b"\n") + 1]
+        keys = complete.decode("utf-8").splitlines()
+        count = min(
+            self._count + len(keys),
+            os.path.getsize(self.prefix + ".i8") // self.dim,
+            os.path.getsize(self.prefix + ".scale") // 4,
+        )
+        if count == self._count:
+            return
+        for row, key in enumerate(keys[: count - self._count], self._count):
+            self._rows.setdefault(key, row)
+        self._keys_offset += len(
+            "".join(f"{key}\n" for key in keys[: count - self._count]).encode("utf-8")
+        )
+        # Existing views stay valid: a new map replaces the old one
+        self._codes = np.memmap(
+            self.prefix + ".i8", dtype=np.int8, mode="r", shape=(count, self.dim)
+        )
+        self._scales = np.memmap(
+            self.prefix + ".scale", dtype=np.float32, mode="r", shape=(count,)
+        )
+        self._count = count
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.prefix + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _generation_prefix(base: str, generation: int) -> str:
+    # Generation 0 keeps the original file names
+    return base if generation == 0 else f"{base}.g{generation}"
+
+
+def current_generation(base: str) -> int:
+    """Generation of the vector files at base that new stores should open"""
+    try:
+        with open(base + ".current") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
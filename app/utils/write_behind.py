@@ -0,0 +1,243 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from typing import Dict, List, Any
+
+
+class WriteBehindQueue:
+    """Buffers Supabase inserts off the request path and flushes them in batches.
+
+    Rows are grouped per table into multi-row inserts whenever batch_size rows are
+    waiting or flush_interval seconds have passed since the first one arrived.
+    Updates and rpc calls are queued the same way and applied in order after the
+    batch's inserts, so they can target a row that is still waiting to be inserted.
+    The worker thread starts lazily in each process (safe with forking servers)
+    and the queue is drained on shutdown. pending() lists rows queued for
+    insertion that are not written yet, so readers can merge them in instead of
+    waiting for a flush.
+    """
+
+    def __init__(
+        self,
+        supabase,
+        app=None,
+        batch_size: int = 25,
+        flush_interval: float = 0.5,
+        max_queue_size: int = 10000,
+    ):
+        self.supabase = supabase
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.app = None
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._unwritten = {}  # id(row) -> (table, row) of inserts not written yet
+        self._unwritten_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "flushed_rows": 0,
+            "failed_rows": 0,
+            "flushes": 0,
+            "last_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["write_behind"] = self
+        atexit.register(self.close)
+
+    def enqueue(self, table: str, row: Dict[str, Any]) -> None:
+        """Schedule a row for insertion into table"""
+        self._put("insert", table, row, None)
+
+    def enqueue_update(
+        self, table: str, match: Dict[str, Any], values: Dict[str, Any]
+    ) -> None:
+        """Schedule an update of the rows of table whose columns equal match"""
+        self._put("update", table, values, match)
+
+    def enqueue_rpc(self, function: str, params: Dict[str, Any]) -> None:
+        """Schedule a call of a database function, e.g. an atomic increment"""
+        self._put("rpc", function, params, None)
+
+    def pending(self, table: str, **columns) -> List[Dict[str, Any]]:
+        """Rows queued for insertion into table, not yet written, whose columns
+        equal the given values (in enqueue order)"""
+        with self._unwritten_lock:
+            return [
+                row
+                for row_table, row in self._unwritten.values()
+                if row_table == table
+                and all(row.get(column) == value for column, value in columns.items())
+            ]
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until every row enqueued so far has been written (or timeout)"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the worker after draining pending rows"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        total_flush_ms = stats.pop("total_flush_ms")
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_flush_ms"] = (
+            total_flush_ms / stats["flushes"] if stats["flushes"] else 0.0
+        )
+        return stats
+
+    def _put(self, operation: str, table: str, row: Dict[str, Any], match) -> None:
+        self._ensure_worker()
+        if operation == "insert":
+            with self._unwritten_lock:
+                self._unwritten[id(row)] = (table, row)
+        try:
+            self._queue.put_nowait((operation, table, row, match))
+        except queue.Full:
+            # Never drop data: fall back to a synchronous write when saturated
+            print(f"Write-behind queue full, writing to {table} synchronously")
+            if operation == "insert":
+                self._insert(table, [row])
+                self._written([row])
+            else:
+                self._apply(operation, table, row, match)
+            return
+
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self.app is None:
+                raise RuntimeError("WriteBehindQueue.init_app() has not been called")
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="write-behind", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        # One app context for the worker's lifetime so the Supabase client is reused
+        with self.app.app_context():
+            while not (self._stop.is_set() and self._queue.empty()):
+                batch = self._collect_batch()
+                if batch:
+                    self._flush_batch(batch)
+
+    def _collect_batch(self) -> List[tuple]:
+        """Wait for the first row, then gather more until the batch is full or stale"""
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush_batch(self, batch: List[tuple]) -> None:
+        started = time.monotonic()
+
+        # Multi-row inserts need the same columns, so group by table and key set
+        groups = {}
+        for operation, table, row, _ in batch:
+            if operation == "insert":
+                groups.setdefault((table, tuple(sorted(row))), []).append(row)
+
+        for (table, _), rows in groups.items():
+            self._insert(table, rows)
+            self._written(rows)
+        for operation, table, row, match in batch:
+            if operation != "insert":
+                self._apply(operation, table, row, match)
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["last_flush_ms"] = elapsed_ms
+            self._stats["total_flush_ms"] += elapsed_ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+
+        for _ in batch:
+            self._queue.task_done()
+
+    def _written(self, rows: List[Dict[str, Any]]) -> None:
+        """Stop listing rows as pending (written, or given up on after errors)"""
+        with self._unwritten_lock:
+            for row in rows:
+                self._unwritten.pop(id(row), None)
+
+    def _insert(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        try:
+            self.supabase.client.table(table).insert(rows).execute()
+            flushed, failed = len(rows), 0
+        except Exception as e:
+            print(f"✗ Batch insert into {table} failed ({len(rows)} rows): {e}")
+            flushed, failed = 0, 0
+            # Retry row by row so one bad row does not lose the whole batch
+            for row in rows:
+                try:
+                    self.supabase.client.table(table).insert(row).execute()
+                    flushed += 1
+                except Exception as row_error:
+                    failed += 1
+                    print(f"✗ Error inserting into {table}: {row_error}")
+
+        with self._stats_lock:
+            self._stats["flushed_rows"] += flushed
+            self._stats["failed_rows"] += failed
+        if flushed:
+            print(f"✓ Flushed {flushed} rows into {table}")
+
+    def _apply(self, operation: str, table: str, values: Dict[str, Any], match) -> None:
+        """Run one queued update, or rpc call (table is then the function name)"""
+        try:
+            if operation == "rpc":
+                self.supabase.client.rpc(table, values).execute()
+            else:
+                query = self.supabase.client.table(table).update(values)
+                for column, value in match.items():
+                    query = query.eq(column, value)
+                query.execute()
+            flushed, failed = 1, 0
+        except Exception as e:
+            flushed, failed = 0, 1
+            print(f"✗ Error applying {operation} to {table}: {e}")
+
+        with self._stats_lock:
+            self._stats["flushed_rows"] += flushed
+            self._stats["failed_rows"] += failed
@@ -0,0 +1,131 @@
+"""
+Collapse near-duplicate rows already stored in memory_stream.
+
+Memories are read oldest first and checked against the MinHash LSH index the app
+uses at write time (app/utils/minhash.py), one index per conversation_id: like
+write-time absorption, rows are only merged within their own conversation, so
+rehydrating a conversation still finds its turns. The oldest row of each group of
+near-duplicates is kept and its relevance_score raised by NEAR_DUPLICATE_BOOST
+per absorbed duplicate (capped at 1); the duplicates are deleted.
+
+Reports what it would do unless --apply is given.
+
+Usage:
+    python scripts/dedupe_memories.py [--threshold 0.8] [--apply]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import List, Dict
+
+# Add the project root to Python path
+project_root = str(Path(__file__).resolve().parent.parent)
+sys.path.append(project_root)
+
+from app import create_app, supabase_extension
+from app.utils.agent_components import (
+    memory_text,
+    NEAR_DUPLICATE_THRESHOLD,
+    NEAR_DUPLICATE_BOOST,
+)
+from app.utils.minhash import MinHashLSH
+
+PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 100
+
+
+def fetch_memories() -> List[Dict]:
+    """Every memory's text columns, oldest first, paged by (created_at, id)"""
+    rows, start = [], 0
+    while True:
+        response = (
+            supabase_extension.client.table("memory_stream")
+            .select(
+                "id, created_at, conversation_id, user_message, agent_response, "
+                "relevance_score"
+            )
+            .order("created_at")
+            .order("id")
+            .range(start, start + PAGE_SIZE - 1)
+            .execute()
+        )
+        rows.extend(response.data)
+        if len(response.data) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def find_duplicates(rows: List[Dict], threshold: float) -> Dict[int, List[int]]:
+    """Map position of each kept row to the positions of its later near-duplicates
+    in the same conversation"""
+    conversations = {}  # conversation_id -> positions in rows, oldest first
+    for position, row in enumerate(rows):
+        conversations.setdefault(row.get("conversation_id"), []).append(position)
+
+    groups = {}
+    # One index per conversation, built and dropped in turn to bound memory
+    for positions in conversations.values():
+        index = MinHashLSH()
+        kept = []  # Index document id -> position in rows
+        for position in positions:
+            signature = index.signature(memory_text(rows[position]))
+            match = index.query(signature, threshold)
+            if match is None:
+                index.add(signature[None, :])
+                kept.append(position)
+            else:
+                groups.setdefault(kept[match[0]], []).append(position)
+    return groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD)
+    parser.add_argument("--apply", action="store_true", help="write the changes")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    app = create_app()
+    with app.app_context():
+        rows = fetch_memories()
+        groups = find_duplicates(rows, args.threshold)
+        duplicates = sum(len(positions) for positions in groups.values())
+        print(
+            f"{len(rows)} memories, {duplicates} near-duplicates of {len(groups)} "
+            f"kept rows ({time.monotonic() - started:.1f}s)"
+        )
+        for kept, positions in list(groups.items())[:10]:
+            print(
+                f"  keep {rows[kept]['user_message'][:40]!r}, "
+                f"drop {len(positions)} like {rows[positions[0]]['user_message'][:40]!r}"
+            )
+        if not args.apply:
+            print("Dry run; pass --apply to collapse them")
+            return
+
+        client = supabase_extension.client
+        for kept, positions in groups.items():
+            score = min(
+                1.0,
+                float(rows[kept].get("relevance_score") or 0.5)
+                + NEAR_DUPLICATE_BOOST * len(positions),
+            )
+            client.table("memory_stream").update({"relevance_score": score}).eq(
+                "id", rows[kept]["id"]
+            ).execute()
+
+        ids = [rows[p]["id"] for positions in groups.values() for p in positions]
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            client.table("memory_stream").delete().in_(
+                "id", ids[start : start + DELETE_BATCH_SIZE]
+            ).execute()
+        print(
+            f"Collapsed {len(ids)} near-duplicates into {len(groups)} memories "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
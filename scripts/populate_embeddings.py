@@ -1,163 +1,204 @@
 """
-DEPRECATED: This script is no longer active.
-Embedding functionality has been disabled to avoid large model dependency (~500MB).
-The agent now uses recency-based and metadata-based retrieval instead of semantic similarity.
-See agent_components.py for the updated retrieval logic.
+Populate embeddings for memory_stream and saved_conversations rows that have none.
+
+Uses the same embedding backend as the app (EMBEDDING_BACKEND, hashing by default),
+so stored vectors live in the same space as the query vectors at retrieval time.
+With the embedding cache enabled (EMBEDDING_CACHE, see agent_components.py) texts
+already embedded by the app or an earlier run are not encoded again.
+
+Rows are streamed in id order (keyset pagination), encoded in batches across a
+process pool and written back with one bulk upsert per batch. The last id written
+per table is checkpointed, so an interrupted run resumes where it stopped.
+
+Usage:
+    python scripts/populate_embeddings.py [--batch-size 64] [--page-size 1000]
+        [--workers N] [--tables memory_stream saved_conversations] [--reset]
 """
 
 import sys
 import os
+import json
+import time
+import argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional
 
 # Add the project root to Python path
 project_root = str(Path(__file__).resolve().parent.parent)
 sys.path.append(project_root)
 
 from app import create_app, supabase_extension
-from sentence_transformers import SentenceTransformer
-import time
-import threading
-from typing import List, Dict, Any
-import json
-
-# Global variables for lazy loading
-_embedding_model = None
-_model_lock = threading.Lock()
-
-def get_embedding_model():
-    """Get the embedding model with lazy loading and thread safety"""
-    global _embedding_model
-    if _embedding_model is None:
-        with _model_lock:
-            # Double-check pattern to prevent race conditions
-            if _embedding_model is None:
-                _embedding_model = SentenceTransformer("intfloat/multilingual-e5-base")
-    return _embedding_model
-
-
-def generate_embedding(text: str) -> List[float] | None:
-    """Generate embedding for text using Sentence Transformers intfloat/multilingual-e5-base model"""
-    try:
-        # Get model with lazy loading
-        model = get_embedding_model()
-        
-        # E5 models require a "query: " prefix for optimal performance
-        prefixed_text = f"query: {text}"
-
-        # Generate embedding using sentence transformers (much faster, no rate limits)
-        embedding = model.encode(prefixed_text, convert_to_tensor=False)
-        return embedding.tolist()
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
-        return None
-
+from app.utils.agent_components import (
+    generate_embeddings,
+    memory_text,
+    conversation_text,
+)
+from app.utils.embeddings import to_pg_vector
 
-def process_batch(items: List[Dict], table_name: str) -> int:
-    """Process a batch of items to update their embeddings"""
-    updated_count = 0
+# Columns read per table: the id, what the text is built from, and every NOT NULL
+# column (an upsert is an INSERT ... ON CONFLICT, so the row must be insertable)
+TABLE_COLUMNS = {
+    "memory_stream": "id, user_message, agent_response",
+    "saved_conversations": "id, conversation_data",
+}
+CHECKPOINT_PATH = os.path.join(project_root, ".cache", "populate_embeddings.json")
 
-    for item in items:
-        try:
-            # Generate text for embedding based on table type
-            if table_name == "memory_stream":
-                text = (
-                    f"{item.get('user_message', '')} {item.get('agent_response', '')}"
-                )
-            else:  # saved_conversations table
-                # Extract text from conversation_data JSONB array
-                conversation_data = item.get("conversation_data", [])
-                if isinstance(conversation_data, list):
-                    text_parts = []
-                    for msg in conversation_data:
-                        if isinstance(msg, dict):
-                            text_parts.append(msg.get("text", ""))
-                    text = " ".join(text_parts)
-                else:
-                    text = str(conversation_data)
-
-            # Generate embedding
-            embedding = generate_embedding(text)
-            if embedding is None:
-                print(
-                    f"Skipping {table_name} item {item['id']}: Failed to generate embedding"
-                )
-                continue
 
-            # Update the item with the embedding
-            supabase_extension.client.table(table_name).update(
-                {"embedding": embedding}
-            ).eq("id", item["id"]).execute()
+def row_text(row: Dict, table_name: str) -> str:
+    if table_name == "memory_stream":
+        return memory_text(row)
+    return conversation_text(row.get("conversation_data") or [])
 
-            updated_count += 1
-            print(f"Updated {table_name} item {item['id']} with embedding")
 
-            # No delay needed for local Sentence Transformers model
+def encode_texts(texts: List[str]) -> List[List[float]]:
+    """Encode one batch (runs in a worker process, which loads its own backend)"""
+    return [to_pg_vector(vector) for vector in generate_embeddings(texts)]
 
-        except Exception as e:
-            print(f"Error processing {table_name} item {item['id']}: {e}")
-            continue
 
-    return updated_count
+def load_checkpoint(path: str) -> Dict[str, str]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, str]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+
+
+def fetch_page(table_name: str, after_id: Optional[str], page_size: int) -> List[Dict]:
+    """Next page of rows without embeddings, in id order after after_id"""
+    query = (
+        supabase_extension.client.table(table_name)
+        .select(TABLE_COLUMNS[table_name])
+        .is_("embedding", "null")
+    )
+    if after_id:
+        query = query.gt("id", after_id)
+    return query.order("id").limit(page_size).execute().data or []
+
+
+def write_batch(table_name: str, rows: List[Dict], vectors: List[List[float]]) -> int:
+    """Bulk upsert one batch of embeddings; returns the number of rows written"""
+    try:
+        supabase_extension.client.table(table_name).upsert(
+            [dict(row, embedding=vector) for row, vector in zip(rows, vectors)],
+            on_conflict="id",
+        ).execute()
+        return len(rows)
+    except Exception as e:
+        print(f"Error writing {len(rows)} {table_name} embeddings: {e}")
+        return 0
+
+
+def populate_table(
+    table_name: str,
+    pool: Optional[ProcessPoolExecutor],
+    checkpoint: Dict[str, str],
+    args: argparse.Namespace,
+) -> int:
+    """Embed every row of table_name missing one, resuming from the checkpoint"""
+    after_id = checkpoint.get(table_name)
+    if after_id:
+        print(f"\nResuming {table_name} after id {after_id}")
+    else:
+        print(f"\nProcessing {table_name}")
+
+    started = time.monotonic()
+    written = 0
+    page = fetch_page(table_name, after_id, args.page_size)
+    while page:
+        batches = [
+            page[i : i + args.batch_size] for i in range(0, len(page), args.batch_size)
+        ]
+        texts = [[row_text(row, table_name) for row in batch] for batch in batches]
+        # pool.map submits every batch at once, so later batches are encoded
+        # while earlier ones are written
+        if pool:
+            encoded = pool.map(encode_texts, texts)
+        else:
+            encoded = map(encode_texts, texts)
+
+        for batch, vectors in zip(batches, encoded):
+            written += write_batch(table_name, batch, vectors)
+
+        # Rows whose write failed keep a null embedding and are picked up by the
+        # next run, which starts over once this one completes
+        checkpoint[table_name] = page[-1]["id"]
+        save_checkpoint(args.checkpoint, checkpoint)
+
+        elapsed = time.monotonic() - started
+        print(
+            f"{table_name}: {written} rows written, "
+            f"{written / elapsed if elapsed else 0:.0f} rows/s"
+        )
+        if len(page) < args.page_size:
+            break
+        page = fetch_page(table_name, checkpoint[table_name], args.page_size)
+
+    # Finished: the next run starts from the beginning again
+    checkpoint.pop(table_name, None)
+    save_checkpoint(args.checkpoint, checkpoint)
+    elapsed = time.monotonic() - started
+    print(
+        f"Finished {table_name}: {written} rows in {elapsed:.1f}s "
+        f"({written / elapsed if elapsed else 0:.0f} rows/s)"
+    )
+    return written
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="encoder processes (0 encodes in this process)",
+    )
+    parser.add_argument(
+        "--tables", nargs="+", default=list(TABLE_COLUMNS), choices=TABLE_COLUMNS
+    )
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument(
+        "--reset", action="store_true", help="ignore the checkpoint and start over"
+    )
+    return parser.parse_args()
 
 
 def main():
     """Main function to populate embeddings"""
+    args = parse_args()
+    checkpoint = {} if args.reset else load_checkpoint(args.checkpoint)
     try:
         print("Starting embedding population process...")
+        started = time.monotonic()
 
         # Create Flask app and push context
         app = create_app()
-        with app.app_context():
-            # Get all memories without embeddings from both tables
-            memory_response = (
-                supabase_extension.client.table("memory_stream")
-                .select("*")
-                .is_("embedding", "null")
-                .execute()
-            )
-
-            saved_conversations_response = (
-                supabase_extension.client.table("saved_conversations")
-                .select("*")
-                .is_("embedding", "null")
-                .execute()
-            )
-
-            total_updated = 0
-
-            # Process memory_stream in batches
-            if memory_response.data:
-                print(
-                    f"\nProcessing {len(memory_response.data)} memory stream items..."
-                )
-                batch_size = 50  # Larger batch size since local model is faster
-                for i in range(0, len(memory_response.data), batch_size):
-                    batch = memory_response.data[i : i + batch_size]
-                    updated = process_batch(batch, "memory_stream")
-                    total_updated += updated
-                    print(
-                        f"Completed batch {i//batch_size + 1} of {(len(memory_response.data) + batch_size - 1)//batch_size}"
-                    )
-                    # No delay needed for local model
-
-            # Process saved conversations in batches
-            if saved_conversations_response.data:
-                print(
-                    f"\nProcessing {len(saved_conversations_response.data)} saved conversations..."
+        pool = ProcessPoolExecutor(args.workers) if args.workers > 0 else None
+        try:
+            with app.app_context():
+                total_updated = sum(
+                    populate_table(table_name, pool, checkpoint, args)
+                    for table_name in args.tables
                 )
-                batch_size = 50  # Larger batch size since local model is faster
-                for i in range(0, len(saved_conversations_response.data), batch_size):
-                    batch = saved_conversations_response.data[i : i + batch_size]
-                    updated = process_batch(batch, "saved_conversations")
-                    total_updated += updated
-                    print(
-                        f"Completed batch {i//batch_size + 1} of {(len(saved_conversations_response.data) + batch_size - 1)//batch_size}"
-                    )
-                    # No delay needed for local model
-
-            print(
-                f"\nPopulation complete! Updated {total_updated} items with embeddings"
-            )
+        finally:
+            if pool:
+                pool.shutdown()
+
+        elapsed = time.monotonic() - started
+        print(
+            f"\nPopulation complete! Updated {total_updated} items with embeddings "
+            f"in {elapsed:.1f}s ({total_updated / elapsed if elapsed else 0:.0f} rows/s)"
+        )
 
     except Exception as e:
         print(f"Error in main process: {e}")
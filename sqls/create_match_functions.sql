@@ -0,0 +1,140 @@
+-- Server-side vector search for ContextRetriever (RETRIEVAL_MODE=rpc)
+-- Returns only the best k rows with narrow columns instead of whole tables.
+-- Scoring mirrors app/utils/memory_cache.py:
+--   max(similarity, 0) x recency boost (1.5 < 1 day, 1.2 < 7 days) x quality/importance
+-- The inner query orders by cosine distance so the ivfflat vector_cosine_ops
+-- indexes from update_embeddings_to_768.sql are used to fetch the candidates.
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- The result columns changed (metadata added), which CREATE OR REPLACE cannot do
+DROP FUNCTION IF EXISTS match_memories(vector, INT, INT);
+
+CREATE OR REPLACE FUNCTION match_memories(
+    query_embedding vector(768),
+    match_count INT DEFAULT 5,
+    candidate_count INT DEFAULT 50
+)
+RETURNS TABLE (
+    id UUID,
+    created_at TIMESTAMP WITH TIME ZONE,
+    conversation_id UUID,
+    user_message TEXT,
+    agent_response TEXT,
+    conversation_topic VARCHAR(255),
+    emotional_context JSONB,
+    relevance_score FLOAT,
+    metadata JSONB,
+    similarity FLOAT,
+    score FLOAT
+)
+LANGUAGE sql STABLE
+SET ivfflat.probes = 10
+AS $$
+    SELECT
+        c.id,
+        c.created_at,
+        c.conversation_id,
+        c.user_message,
+        c.agent_response,
+        c.conversation_topic,
+        c.emotional_context,
+        c.relevance_score,
+        c.metadata,
+        c.similarity,
+        GREATEST(c.similarity, 0)
+            * CASE
+                WHEN c.created_at > NOW() - INTERVAL '1 day' THEN 1.5
+                WHEN c.created_at > NOW() - INTERVAL '7 days' THEN 1.2
+                ELSE 1.0
+              END
+            * COALESCE(NULLIF(c.relevance_score, 0), 0.5) AS score
+    FROM (
+        SELECT
+            m.id,
+            m.created_at,
+            m.conversation_id,
+            m.user_message,
+            m.agent_response,
+            m.conversation_topic,
+            m.emotional_context,
+            m.relevance_score,
+            m.metadata,
+            1 - (m.embedding <=> query_embedding) AS similarity
+        FROM memory_stream m
+        WHERE m.embedding IS NOT NULL
+        ORDER BY m.embedding <=> query_embedding
+        LIMIT GREATEST(candidate_count, match_count)
+    ) c
+    ORDER BY score DESC
+    LIMIT match_count;
+$$;
+
+-- conversation_data is cut to its first 6 messages, all that the prompt uses
+CREATE OR REPLACE FUNCTION match_conversations(
+    query_embedding vector(768),
+    match_count INT DEFAULT 3,
+    candidate_count INT DEFAULT 30
+)
+RETURNS TABLE (
+    id UUID,
+    created_at TIMESTAMP WITH TIME ZONE,
+    title VARCHAR(255),
+    description TEXT,
+    conversation_type VARCHAR(100),
+    topics TEXT[],
+    quality_score FLOAT,
+    usage_count INTEGER,
+    conversation_data JSONB,
+    similarity FLOAT,
+    score FLOAT
+)
+LANGUAGE sql STABLE
+SET ivfflat.probes = 10
+AS $$
+    SELECT
+        c.id,
+        c.created_at,
+        c.title,
+        c.description,
+        c.conversation_type,
+        c.topics,
+        c.quality_score,
+        c.usage_count,
+        (
+            SELECT COALESCE(jsonb_agg(message ORDER BY position), '[]'::jsonb)
+            FROM jsonb_array_elements(c.conversation_data) WITH ORDINALITY AS e(message, position)
+            WHERE position <= 6
+        ) AS conversation_data,
+        c.similarity,
+        GREATEST(c.similarity, 0)
+            * CASE
+                WHEN c.created_at > NOW() - INTERVAL '1 day' THEN 1.5
+                WHEN c.created_at > NOW() - INTERVAL '7 days' THEN 1.2
+                ELSE 1.0
+              END
+            * COALESCE(NULLIF(c.quality_score, 0), 1.0) AS score
+    FROM (
+        SELECT
+            s.id,
+            s.created_at,
+            s.title,
+            s.description,
+            s.conversation_type,
+            s.topics,
+            s.quality_score,
+            s.usage_count,
+            s.conversation_data,
+            1 - (s.embedding <=> query_embedding) AS similarity
+        FROM saved_conversations s
+        WHERE s.embedding IS NOT NULL AND s.is_active = TRUE
+        ORDER BY s.embedding <=> query_embedding
+        LIMIT GREATEST(candidate_count, match_count)
+    ) c
+    ORDER BY score DESC
+    LIMIT match_count;
+$$;
+
+-- Allow the API roles to call the functions through PostgREST (client.rpc)
+GRANT EXECUTE ON FUNCTION match_memories(vector, INT, INT) TO anon, authenticated, service_role;
+GRANT EXECUTE ON FUNCTION match_conversations(vector, INT, INT) TO anon, authenticated, service_role;
@@ -0,0 +1,28 @@
+-- Atomic reinforcement of a near-duplicate memory (see _store_turn in
+-- app/routes/chat_routes.py). Adding to relevance_score in the database
+-- instead of writing an absolute value keeps concurrent reinforcements from
+-- different workers from overwriting each other.
+-- Rows a worker inserted itself have no id on its side yet, so they are
+-- matched on (conversation_id, created_at) instead; created_at alone is not
+-- unique across workers.
+
+-- The parameters changed (p_conversation_id added), which CREATE OR REPLACE cannot do
+DROP FUNCTION IF EXISTS reinforce_memory(UUID, TIMESTAMP WITH TIME ZONE, FLOAT);
+
+CREATE OR REPLACE FUNCTION reinforce_memory(
+    p_id UUID,
+    p_conversation_id UUID,
+    p_created_at TIMESTAMP WITH TIME ZONE,
+    p_increment FLOAT
+)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE memory_stream
+    SET relevance_score = LEAST(1, COALESCE(relevance_score, 0) + p_increment)
+    WHERE CASE
+        WHEN p_id IS NOT NULL THEN id = p_id
+        ELSE created_at = p_created_at
+            AND conversation_id IS NOT DISTINCT FROM p_conversation_id
+    END;
+$$;